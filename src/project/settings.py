@@ -48,6 +48,66 @@ SITE_ID = 1
 # large.
 API_CACHE_TIMEOUT = 3600  # an hour
 
+# Each process also keeps a few recently used datasets in memory, so that
+# they do not have to be fetched from the cache on every request. Entries are
+# checked against the cache for changes, so the timeout only bounds how long
+# an unused entry lingers.
+API_LOCAL_CACHE_SIZE = 128
+API_LOCAL_CACHE_TIMEOUT = 300  # five minutes
+
+# When a cached response is missing, one worker rebuilds it while others
+# wait up to API_CACHE_LOCK_WAIT seconds for the result. The lock expires on
+# its own after API_CACHE_LOCK_TIMEOUT seconds, in case its holder dies.
+API_CACHE_LOCK_TIMEOUT = 60
+API_CACHE_LOCK_WAIT = 5
+
+# Views may keep serving an out-of-date response to anonymous users for a few
+# seconds after the data changes, while the current one is rebuilt in the
+# background. Map view class names to the number of seconds, e.g.:
+#
+#     API_CACHE_MAX_STALENESS = {'PlaceListView': 10}
+#
+# Views that are not listed always serve current responses.
+API_CACHE_MAX_STALENESS = {}
+
+# Count the requests made for each dataset's responses, and rebuild the
+# API_CACHE_WARM_COUNT most popular ones in the background whenever the dataset
+# changes. Zero turns this off.
+API_CACHE_WARM_COUNT = 0
+
+# Cached data is invalidated at the end of each request that changes
+# something. Set this to hand the invalidation off to a Celery worker once
+# the changes are committed, so that writes do not wait for it. Readers may
+# get the old data until the worker gets to it.
+API_CACHE_INVALIDATE_ASYNC = False
+
+# Record cache hits, misses, stale responses, rebuild times, response sizes,
+# and invalidations by view and by dataset. The numbers are available to
+# superusers at /api/v2/~/cache/stats (JSON) and /api/v2/~/cache/metrics
+# (Prometheus). Recording adds a cache write to every cached request.
+API_CACHE_STATS = False
+
+# How values are encoded in the cache. The SERIALIZER may be 'pickle' or
+# 'msgpack' (requires the msgpack package; values that msgpack cannot handle
+# are pickled anyway). Values of at least MIN_COMPRESS_SIZE bytes are
+# compressed with the COMPRESSOR, 'zlib' or 'zstd' (requires the zstandard
+# package), or None for no compression.
+API_CACHE_CODEC = {
+    'SERIALIZER': 'pickle',
+    'COMPRESSOR': 'zlib',
+    'MIN_COMPRESS_SIZE': 1024,
+}
+
+# Rendered responses of at least this many bytes are cached gzipped, and sent
+# to clients that accept gzip without being compressed again.
+API_CACHE_GZIP_MIN_SIZE = 1024
+
+# Owners, datasets and places that are looked up and not found are remembered
+# as missing for this many seconds, so that repeated requests for them (e.g.,
+# from clients configured for a deleted dataset) do not query the database.
+# Set it to 0 to turn off negative caching.
+API_CACHE_NEGATIVE_TIMEOUT = 60
+
 # Where should the user be redirected to when they visit the root of the site?
 ROOT_REDIRECT_TO = 'api-root'
 
@@ -139,6 +199,7 @@ MIDDLEWARE = [
 
     'sa_api_v2.middleware.RequestTimeLogger',
     'sa_api_v2.middleware.UniversalP3PHeader',
+    'sa_api_v2.middleware.CacheBufferFlusher',
 ]
 
 # We only use the CORS Headers app for oauth. The Shareabouts API resources
@@ -39,7 +39,7 @@ class APIKeyBackend(object):
 
     def _get_client_and_key(self, request, key_string):
         dataset = request.get_dataset()
-        ds_key = dataset.get_key(key_string)
+        ds_key = dataset.get_auth_snapshot().get_key(key_string)
         if ds_key is None:
             return (None, None)
         client = ds_key
@@ -68,7 +68,6 @@ def check_api_authorization(request):
 
     # TODO: Add an is_active flag for apikey, and check it here. If not active
     #       raise PermissionDenied.
-    client.backend = APIKeyBackend.backend_name
     return (client, auth)
 
 
@@ -13,6 +13,7 @@ from django.db import models
 from django.db.models.signals import post_save
 from django.utils.timezone import now
 from ..models import DataSet, KeyPermission
+from ..models.caching import CacheClearingModel
 from ..models.mixins import CloneableModelMixin
 
 # Changing this would require a migration, ugh.
@@ -40,7 +41,7 @@ def generate_unique_api_key():
     return api_key
 
 
-class ApiKey(CloneableModelMixin, models.Model):
+class ApiKey(CloneableModelMixin, CacheClearingModel, models.Model):
     key = models.CharField(max_length=KEY_SIZE, unique=True, default=generate_unique_api_key)
     logged_ip = models.GenericIPAddressField(blank=True, null=True)
     last_used = models.DateTimeField(blank=True, default=now)
@@ -83,6 +84,9 @@ class ApiKey(CloneableModelMixin, models.Model):
             fields.add('key')
         return fields
 
+    def clear_instance_cache(self):
+        return self.dataset.clear_instance_cache()
+
     def save(self, *args, **kwargs):
         if self.logged_ip == '':
             self.logged_ip = None
@@ -1,17 +1,353 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from random import randint
+from threading import Lock
+from time import monotonic, time
 from django.conf import settings
 from django.core import cache as django_cache
-from django.core.exceptions import ObjectDoesNotExist
-from django.urls import reverse
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
 
+import pickle
+import zlib
 import logging
 logger = logging.getLogger('sa_api_v2.cache')
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 # A sentinel object to differentiate from None
 Undefined = object()
 
 
+def new_generation():
+    """
+    Get a starting value for a generation counter. Counters start at a random
+    point rather than at zero so that a counter that has been evicted from the
+    cache does not restart at a value that older cached responses were
+    already stored under.
+    """
+    return randint(1, 2 ** 48)
+
+
+class CacheCodec (object):
+    """
+    Encodes the values that we store in the shared cache as compact bytes.
+    Values are serialized with msgpack or pickle, and compressed with zlib or
+    zstd when they are at least min_compress_size bytes long. Each encoded
+    value starts with a short header naming the serializer and compressor
+    that were used, so values encoded with any configuration can be decoded.
+
+    Integers are left alone, so that counters can still be incremented in the
+    cache, and values without the header (e.g., stored before the codec was
+    in use) are returned as is.
+    """
+    marker = b'\x93sa'
+    serializer_codes = {'pickle': b'p', 'msgpack': b'm'}
+    compressor_codes = {None: b'-', 'zlib': b'z', 'zstd': b's'}
+
+    def __init__(self, serializer='pickle', compressor='zlib', min_compress_size=1024, level=None):
+        if serializer not in self.serializer_codes:
+            raise ImproperlyConfigured('Unknown cache serializer: %r' % (serializer,))
+        if compressor not in self.compressor_codes:
+            raise ImproperlyConfigured('Unknown cache compressor: %r' % (compressor,))
+        if serializer == 'msgpack' and msgpack is None:
+            raise ImproperlyConfigured('The msgpack cache serializer requires the msgpack package.')
+        if compressor == 'zstd' and zstandard is None:
+            raise ImproperlyConfigured('The zstd cache compressor requires the zstandard package.')
+
+        self.serializer = serializer
+        self.compressor = compressor
+        self.min_compress_size = min_compress_size
+        self.level = level
+
+    @classmethod
+    def from_settings(cls):
+        config = settings.API_CACHE_CODEC
+        return cls(serializer=config.get('SERIALIZER', 'pickle'),
+                   compressor=config.get('COMPRESSOR', 'zlib'),
+                   min_compress_size=config.get('MIN_COMPRESS_SIZE', 1024),
+                   level=config.get('LEVEL'))
+
+    def encode(self, value):
+        if isinstance(value, int):
+            return value
+
+        serializer = self.serializer
+        payload = None
+        if serializer == 'msgpack':
+            try:
+                payload = msgpack.packb(value, use_bin_type=True)
+            except (TypeError, ValueError, OverflowError):
+                # Model instances, datetimes, etc. have to be pickled.
+                serializer = 'pickle'
+        if payload is None:
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        compressor = self.compressor if len(payload) >= self.min_compress_size else None
+        if compressor == 'zlib':
+            compressed = zlib.compress(payload, self.level if self.level is not None else 6)
+        elif compressor == 'zstd':
+            compressed = zstandard.ZstdCompressor(level=self.level or 3).compress(payload)
+
+        # Some values (e.g., response bodies that are already gzipped) do not
+        # get any smaller, and are not worth decompressing.
+        if compressor is not None:
+            if len(compressed) < len(payload):
+                payload = compressed
+            else:
+                compressor = None
+
+        return (self.marker + self.serializer_codes[serializer] +
+                self.compressor_codes[compressor] + payload)
+
+    def decode(self, value):
+        if not isinstance(value, bytes) or not value.startswith(self.marker):
+            return value
+
+        header_length = len(self.marker)
+        serializer_code = value[header_length:header_length + 1]
+        compressor_code = value[header_length + 1:header_length + 2]
+        payload = value[header_length + 2:]
+
+        if compressor_code == self.compressor_codes['zlib']:
+            payload = zlib.decompress(payload)
+        elif compressor_code == self.compressor_codes['zstd']:
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+
+        if serializer_code == self.serializer_codes['msgpack']:
+            return msgpack.unpackb(payload, raw=False)
+        return pickle.loads(payload)
+
+
+cache_codec = CacheCodec.from_settings()
+
+
+class StructuredCache (object):
+    """
+    Provides the handful of set and counter operations that we rely on for
+    cache bookkeeping. This base implementation stores each set as a plain Python
+    set value in the Django cache, so it works with any cache backend, but the
+    operations are not atomic. Backends that support native set types should
+    use a subclass instead (see get_structured_cache).
+    """
+    def __init__(self, cache):
+        self.cache = cache
+
+    def sadd(self, skey, members, timeout=None):
+        svalue = self.cache.get(skey) or set()
+        svalue |= set(members)
+        self.cache.set(skey, svalue, timeout)
+
+    def srem(self, skey, members):
+        svalue = self.cache.get(skey)
+        if svalue:
+            svalue -= set(members)
+            self.cache.set(skey, svalue)
+
+    def smembers(self, skey):
+        return set(self.cache.get(skey) or set())
+
+    def sismember(self, skey, member):
+        return member in (self.cache.get(skey) or set())
+
+    def incr_many(self, keys):
+        for key in keys:
+            self.cache.add(key, new_generation(), None)
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # The counter disappeared between the add and the incr.
+                self.cache.set(key, new_generation(), None)
+
+    def zincr_many(self, zkey, members, timeout=None):
+        zvalue = self.cache.get(zkey) or {}
+        for member, amount in members.items():
+            zvalue[member] = zvalue.get(member, 0) + amount
+        self.cache.set(zkey, zvalue, timeout)
+
+    def ztop(self, zkey, count):
+        """
+        Get the (member, score) pairs with the highest scores in the given
+        sorted set, highest first.
+        """
+        zvalue = self.cache.get(zkey) or {}
+        return sorted(zvalue.items(), key=lambda item: -item[1])[:count]
+
+    def hincr_many(self, hkey, fields):
+        hvalue = self.cache.get(hkey) or {}
+        for field, amount in fields.items():
+            hvalue[field] = hvalue.get(field, 0) + amount
+        self.cache.set(hkey, hvalue, None)
+
+    def hgetall(self, hkey):
+        return dict(self.cache.get(hkey) or {})
+
+    def start_generations(self, keys):
+        """
+        Start each of the given generation counters, unless some other
+        process has already started it, and return the counters' values.
+        """
+        generations = {}
+        for key in keys:
+            generation = new_generation()
+            if not self.cache.add(key, generation, None):
+                generation = self.cache.get(key)
+            generations[key] = generation
+        return generations
+
+    def write_many(self, deletes=(), values=None, sadds=None, srems=None,
+                   incrs=(), set_timeout=None, zincrs=None, hincrs=None):
+        """
+        Apply a batch of writes: deletes first, then values (a mapping of
+        key to (value, timeout) pairs), set additions and removals, counter
+        increments, sorted set score increments (a mapping of key to
+        ({member: amount}, timeout) pairs), and hash field increments (a
+        mapping of key to {field: amount}).
+        """
+        if deletes:
+            self.cache.delete_many(list(deletes))
+
+        timed_values = defaultdict(dict)
+        for key, (value, timeout) in (values or {}).items():
+            timed_values[timeout][key] = value
+        for timeout, mapping in timed_values.items():
+            self.cache.set_many(mapping, timeout)
+
+        for skey, members in (sadds or {}).items():
+            self.sadd(skey, members, set_timeout)
+        for skey, members in (srems or {}).items():
+            self.srem(skey, members)
+
+        if incrs:
+            self.incr_many(incrs)
+
+        for zkey, (members, timeout) in (zincrs or {}).items():
+            self.zincr_many(zkey, members, timeout)
+
+        for hkey, fields in (hincrs or {}).items():
+            self.hincr_many(hkey, fields)
+
+
+class RedisStructuredCache (StructuredCache):
+    """
+    Set operations backed by native Redis sets. Members are added and removed
+    atomically, so concurrent requests cannot lose each other's keys, and a
+    membership check does not have to deserialize the whole set. Batches of
+    writes are sent together in a single pipeline.
+    """
+    def get_client(self):
+        return self.cache.client.get_client(write=True)
+
+    def sadd(self, skey, members, timeout=None):
+        self.write_many(sadds={skey: members}, set_timeout=timeout)
+
+    def srem(self, skey, members):
+        self.write_many(srems={skey: members})
+
+    def smembers(self, skey):
+        key = self.cache.make_key(skey)
+        return set(member.decode('utf-8') for member in self.get_client().smembers(key))
+
+    def sismember(self, skey, member):
+        key = self.cache.make_key(skey)
+        return bool(self.get_client().sismember(key, member))
+
+    def incr_many(self, keys):
+        self.write_many(incrs=keys)
+
+    def zincr_many(self, zkey, members, timeout=None):
+        self.write_many(zincrs={zkey: (members, timeout)})
+
+    def hincr_many(self, hkey, fields):
+        self.write_many(hincrs={hkey: fields})
+
+    def hgetall(self, hkey):
+        key = self.cache.make_key(hkey)
+        return dict((field.decode('utf-8'), float(value))
+                    for field, value in self.get_client().hgetall(key).items())
+
+    def ztop(self, zkey, count):
+        key = self.cache.make_key(zkey)
+        return [(member.decode('utf-8'), score) for member, score
+                in self.get_client().zrevrange(key, 0, count - 1, withscores=True)]
+
+    def start_generations(self, keys):
+        keys = list(keys)
+        pipe = self.get_client().pipeline(transaction=False)
+        for key in keys:
+            pipe.set(self.cache.make_key(key), new_generation(), nx=True)
+        for key in keys:
+            pipe.get(self.cache.make_key(key))
+        results = pipe.execute()[len(keys):]
+        return dict((key, self.cache.client.decode(value))
+                    for key, value in zip(keys, results))
+
+    def write_many(self, deletes=(), values=None, sadds=None, srems=None,
+                   incrs=(), set_timeout=None, zincrs=None, hincrs=None):
+        make_key = self.cache.make_key
+        encode = self.cache.client.encode
+        pipe = self.get_client().pipeline(transaction=False)
+
+        if deletes:
+            pipe.delete(*[make_key(key) for key in deletes])
+
+        for key, (value, timeout) in (values or {}).items():
+            if timeout is not None and timeout <= 0:
+                pipe.delete(make_key(key))
+            else:
+                pipe.set(make_key(key), encode(value),
+                         ex=(int(timeout) if timeout is not None else None))
+
+        for skey, members in (sadds or {}).items():
+            if members:
+                pipe.sadd(make_key(skey), *members)
+                if set_timeout is not None:
+                    pipe.expire(make_key(skey), int(set_timeout))
+
+        for skey, members in (srems or {}).items():
+            if members:
+                pipe.srem(make_key(skey), *members)
+
+        # django-redis stores integers unpickled, so counters written here
+        # can be read back with a normal cache get.
+        for key in incrs:
+            pipe.set(make_key(key), new_generation(), nx=True)
+            pipe.incr(make_key(key))
+
+        for zkey, (members, timeout) in (zincrs or {}).items():
+            for member, amount in members.items():
+                pipe.zincrby(make_key(zkey), amount, member)
+            if timeout is not None:
+                pipe.expire(make_key(zkey), int(timeout))
+
+        for hkey, fields in (hincrs or {}).items():
+            for field, amount in fields.items():
+                pipe.hincrbyfloat(make_key(hkey), field, amount)
+
+        if len(pipe):
+            pipe.execute()
+
+
+def get_structured_cache(cache=None):
+    """
+    Get the set operations appropriate for the given (or default) cache
+    backend. The django-redis backend exposes its raw client, so we can use
+    native Redis sets; anything else gets the emulated version.
+    """
+    cache = cache or django_cache.cache
+    client = getattr(cache, 'client', None)
+    if hasattr(client, 'get_client') and hasattr(cache, 'make_key'):
+        return RedisStructuredCache(cache)
+    return StructuredCache(cache)
+
+
 class CacheBuffer (object):
     def __init__(self, initial_buffer=None):
         # When we get a value from the remote cache, it goes in to the buffer
@@ -25,7 +361,39 @@ class CacheBuffer (object):
         self.queue = {}
         self.delete_queue = set()
 
+        # Set members are buffered and queued separately from plain values,
+        # since they are stored as native sets where the backend allows.
+        self.set_buffer = {}
+        self.sadd_queue = {}
+        self.srem_queue = {}
+
+        # Generation counters to increment on flush.
+        self.incr_queue = set()
+
+        # Sorted set scores to increment on flush, and datasets whose popular
+        # responses should be rebuilt once the flush is committed.
+        self.zincr_queue = {}
+        self.warm_queue = set()
+
+        # Instances whose cached data should be invalidated, collected so
+        # that an instance saved many times in one request (or many instances
+        # that share the same keys) is only invalidated once.
+        self.invalidations = OrderedDict()
+
+        # Statistics counters to increment on flush.
+        self.hincr_queue = {}
+
+        # Generation counters that have been incremented since the last flush,
+        # to be incremented again once the current transaction is committed.
+        self.applied_incrs = set()
+
+        # The number of requests made to the remote cache since the last
+        # flush, for instrumentation.
+        self.round_trips = 0
+
     def get_many(self, keys):
+        self.apply_invalidations()
+
         results = {}
         unseen_keys = []
 
@@ -38,7 +406,10 @@ class CacheBuffer (object):
                 unseen_keys.append(key)
 
         if unseen_keys:
+            self.round_trips += 1
             new_results = django_cache.cache.get_many(unseen_keys)
+            new_results = dict((key, cache_codec.decode(value))
+                               for key, value in new_results.items())
             if new_results:
                 results.update(new_results)
                 self.buffer.update(new_results)
@@ -50,6 +421,15 @@ class CacheBuffer (object):
         return results
 
     def get(self, key, default=None):
+        self.apply_invalidations()
+        return self.peek(key, default)
+
+    def peek(self, key, default=None):
+        """
+        Get a value without applying the queued invalidations first. For the
+        values that queuing an invalidation itself needs, like instance
+        parameters, so that queuing one does not apply the ones before it.
+        """
         if key in self.delete_queue:
             return None
 
@@ -57,7 +437,8 @@ class CacheBuffer (object):
             value = self.buffer[key]
             return None if value is Undefined else value
         except KeyError:
-            value = django_cache.cache.get(key, default)
+            self.round_trips += 1
+            value = cache_codec.decode(django_cache.cache.get(key, default))
             self.buffer[key] = value
             return value
 
@@ -79,32 +460,168 @@ class CacheBuffer (object):
             except KeyError: pass
 
     def delete(self, key):
-        try: del self.queue[key]
-        except KeyError: pass
+        self.delete_many([key])
 
-        try: del self.buffer[key]
-        except KeyError: pass
+    def delete_many(self, keys):
+        for key in keys:
+            for queue in (self.queue, self.buffer, self.timeouts,
+                          self.set_buffer, self.sadd_queue, self.srem_queue):
+                try: del queue[key]
+                except KeyError: pass
 
-        try: del self.timeouts[key]
-        except KeyError: pass
+        self.delete_queue.update(keys)
 
-        self.delete_queue.add(key)
+    # === Generation counters
 
-    def delete_many(self, keys):
+    def get_generations(self, keys):
+        """
+        Get the current values of the given generation counters, starting any
+        counters that do not exist yet.
+        """
+        # Apply any pending increments first, so that we never read a
+        # generation that we have already invalidated.
+        self.apply_invalidations()
+        pending_keys = self.incr_queue.intersection(keys)
+        if pending_keys:
+            self.round_trips += 1
+            get_structured_cache().incr_many(pending_keys)
+            self.incr_queue -= pending_keys
+            self.applied_incrs |= pending_keys
+
+        generations = self.get_many(keys)
+
+        missing_keys = [key for key in keys if key not in generations]
+        if missing_keys:
+            self.round_trips += 1
+            new_generations = get_structured_cache().start_generations(missing_keys)
+            generations.update(new_generations)
+            self.buffer.update(new_generations)
+
+        return [generations[key] for key in keys]
+
+    def incr_many(self, keys):
         for key in keys:
-            try: del self.queue[key]
-            except KeyError: pass
-
             try: del self.buffer[key]
             except KeyError: pass
 
-            try: del self.timeouts[key]
-            except KeyError: pass
+        self.incr_queue.update(keys)
 
-        self.delete_queue.update(keys)
+    # === Invalidation
+
+    def invalidate(self, cache, pk, params):
+        """
+        Queue the cached data for an instance to be invalidated, using the
+        given cache object and instance parameters. The parameters are taken
+        when the instance is queued, since it may be gone by the time that the
+        invalidation is applied.
+        """
+        key = (type(cache).__name__, pk, tuple(sorted(params.items())))
+        self.invalidations[key] = (cache, pk, params)
+
+    def invalidate_async(self):
+        return settings.API_CACHE_INVALIDATE_ASYNC
+
+    def apply_invalidations(self):
+        """
+        Clear the keys for all the queued invalidations. Called before any
+        read, so that we never read data that has been invalidated, unless
+        invalidations are handed off to a worker.
+        """
+        if not self.invalidations or self.invalidate_async():
+            return
+
+        while self.invalidations:
+            _, (cache, pk, params) = self.invalidations.popitem(last=False)
+            cache.clear_instance_keys(pk, **params)
+
+    def schedule_invalidations(self, invalidations):
+        from django.db import transaction
+        from . import tasks
+
+        invalidations = [(type(cache).__name__, pk, params)
+                         for cache, pk, params in invalidations]
+        transaction.on_commit(lambda: tasks.invalidate_cache.delay(invalidations))
+
+    def schedule_reincrement(self, keys):
+        """
+        Increment the given generation counters again once the current
+        transaction has been committed. Anything cached in the meantime may
+        have been built from data as it was before the transaction, and the
+        second increment makes sure that it is never used.
+        """
+        from django.db import transaction
+
+        if keys and transaction.get_connection().in_atomic_block:
+            keys = list(keys)
+            transaction.on_commit(lambda: get_structured_cache().incr_many(keys))
+
+    # === Sorted sets
+
+    def incr_score(self, zkey, member, amount=1, timeout=None):
+        members, _ = self.zincr_queue.get(zkey, ({}, None))
+        members[member] = members.get(member, 0) + amount
+        self.zincr_queue[zkey] = (members, timeout)
+
+    # === Statistics
+
+    def incr_stat(self, hkey, field, amount=1):
+        fields = self.hincr_queue.setdefault(hkey, {})
+        fields[field] = fields.get(field, 0) + amount
+
+    # === Cache warming
+
+    def warm(self, owner_username, dataset_slug):
+        """
+        Rebuild the dataset's most popular cached responses in the background,
+        after the current transaction has been committed.
+        """
+        self.warm_queue.add((owner_username, dataset_slug))
+
+    def schedule_warming(self, datasets):
+        from django.db import transaction
+        from . import tasks
+
+        for owner_username, dataset_slug in datasets:
+            transaction.on_commit(lambda owner_username=owner_username, dataset_slug=dataset_slug:
+                tasks.warm_cached_responses.delay(owner_username, dataset_slug))
 
     # === Set operations
 
+    def members(self, skey):
+        """
+        Get the set of members stored under the given set key, including any
+        changes that have been made but not yet flushed.
+        """
+        self.apply_invalidations()
+
+        try:
+            return set(self.set_buffer[skey])
+        except KeyError:
+            if skey in self.delete_queue:
+                svalue = set()
+            else:
+                self.round_trips += 1
+                svalue = get_structured_cache().smembers(skey)
+            svalue = (svalue | self.sadd_queue.get(skey, set())) - self.srem_queue.get(skey, set())
+            self.set_buffer[skey] = svalue
+            return set(svalue)
+
+    def has_member(self, skey, member):
+        """
+        Check whether the given member is in the set, without fetching the
+        entire set from the remote cache.
+        """
+        self.apply_invalidations()
+
+        if skey in self.set_buffer:
+            return member in self.set_buffer[skey]
+        if member in self.sadd_queue.get(skey, ()):
+            return True
+        if member in self.srem_queue.get(skey, ()) or skey in self.delete_queue:
+            return False
+        self.round_trips += 1
+        return get_structured_cache().sismember(skey, member)
+
     def add(self, skey, members):
         members = set(members)
 
@@ -116,8 +633,8 @@ class CacheBuffer (object):
         new_members = (self.sadd_queue.get(skey) or set()) | members
         self.sadd_queue[skey] = new_members
 
-        svalue = (self.buffer.get(skey) or set()) | members
-        self.buffer[skey] = svalue
+        if skey in self.set_buffer:
+            self.set_buffer[skey] |= members
 
     def remove(self, skey, members):
         members = set(members)
@@ -130,30 +647,49 @@ class CacheBuffer (object):
         old_members = (self.srem_queue.get(skey) or set()) | members
         self.srem_queue[skey] = old_members
 
-        svalue = (self.buffer.get(skey) or set()) - members
-        self.buffer[skey] = svalue
+        if skey in self.set_buffer:
+            self.set_buffer[skey] -= members
 
     # === Flush, reset
 
     def flush(self):
-        timed_queues = defaultdict(dict)
+        """
+        Write everything that has been queued to the remote cache, in a single
+        batch where the backend allows, and start over with an empty buffer.
+        """
+        if self.invalidations and self.invalidate_async():
+            self.schedule_invalidations(self.invalidations.values())
+        else:
+            self.apply_invalidations()
 
-        if self.queue:
+        if self.delete_queue or self.queue or self.sadd_queue or self.srem_queue or self.incr_queue or self.zincr_queue or self.hincr_queue:
+            self.round_trips += 1
+
+            values = {}
             for key, value in self.queue.items():
                 timeout = self.timeouts[key]
-                timed_queues[timeout][key] = value
+                values[key] = (cache_codec.encode(value),
+                               settings.API_CACHE_TIMEOUT if timeout is Undefined else timeout)
 
-            for timeout, queue in timed_queues.items():
-                if timeout is not Undefined:
-                    django_cache.cache.set_many(queue, timeout)
-                else:
-                    django_cache.cache.set_many(queue, settings.API_CACHE_TIMEOUT)
+            # Deletes go first, so that members added to a set after it has
+            # been deleted in the same request end up in a fresh set.
+            get_structured_cache().write_many(
+                deletes=self.delete_queue,
+                values=values,
+                sadds=self.sadd_queue,
+                srems=self.srem_queue,
+                incrs=self.incr_queue,
+                set_timeout=settings.API_CACHE_TIMEOUT,
+                zincrs=self.zincr_queue,
+                hincrs=self.hincr_queue)
+
+        self.schedule_reincrement(self.applied_incrs | self.incr_queue)
 
-        # if self.sadd_queue:
-        #     for key, value in self.sadd_queue.iteritems():
+        if self.warm_queue:
+            self.schedule_warming(self.warm_queue)
 
-        if self.delete_queue:
-            django_cache.cache.delete_many(self.delete_queue)
+        if self.round_trips:
+            logger.debug('Made %s cache round trip(s)' % self.round_trips)
 
         self.reset()
 
@@ -162,48 +698,169 @@ class CacheBuffer (object):
         self.delete_queue = set()
         self.timeouts = {}
         self.buffer = {}
+        self.set_buffer = {}
+        self.sadd_queue = {}
+        self.srem_queue = {}
+        self.incr_queue = set()
+        self.zincr_queue = {}
+        self.warm_queue = set()
+        self.invalidations = OrderedDict()
+        self.applied_incrs = set()
+        self.hincr_queue = {}
+        self.round_trips = 0
 
 
 cache_buffer = CacheBuffer()
 
 
-class Cache (object):
+class LocalCache (object):
     """
-    The base class for objects responsible for caching Shareabouts data
-    structure information
+    A small, bounded, least-recently-used cache of objects held in this
+    process's memory. Each entry is stored along with a version (such as a
+    generation counter from the shared cache) and an expiration time. An
+    entry is only returned while it has not expired and its version matches
+    the version that the caller currently expects, so a change made by any
+    other process invalidates the entry as soon as the version moves on.
+    """
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            try:
+                value, entry_version, expires = self.entries[key]
+            except KeyError:
+                return None
+
+            if entry_version != version or expires < monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, version):
+        with self.lock:
+            self.entries[key] = (value, version, monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
 
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_instances = LocalCache(settings.API_LOCAL_CACHE_SIZE,
+                             settings.API_LOCAL_CACHE_TIMEOUT)
+
+
+class CacheStats (object):
+    """
+    Counters and histograms of how the cache is used, kept in hashes in the
+    shared cache so that every process adds to the same numbers. Each number
+    is recorded for one or more scopes: a view class, a dataset, or a cache
+    class. Nothing is recorded unless API_CACHE_STATS is on.
     """
+    scope_keys = OrderedDict([
+        ('views', 'cache-stats:views'),
+        ('datasets', 'cache-stats:datasets'),
+        ('caches', 'cache-stats:caches'),
+    ])
 
-    def get_meta_key(self, prefix):
+    histogram_buckets = {
+        'rebuild_seconds': (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+        'size_bytes': (1024, 10240, 102400, 1048576, 10485760),
+    }
+
+    def is_enabled(self):
+        return settings.API_CACHE_STATS
+
+    def count(self, scopes, metric, amount=1):
+        """
+        Add to a counter. Scopes is a list of (scope type, name) pairs, e.g.
+        [('views', 'PlaceListView'), ('datasets', 'aaron/ds')].
         """
-        Data identified by a number of keys may be cached for any given object.
-        A meta-key keeps track of a set of related keys, for the purposes of
-        invalidating all of those keys at once when the associated object is
-        updated.
+        if not self.is_enabled():
+            return
 
-        For example, data associated with a particular dataset with a primary
-        key of 23 might have cache keys that all begin with the prefix
-        "datasets:23". The cache keys themselves would be stored in a list
-        identified by the meta-key "dataset:23_keys".
+        for scope_type, name in scopes:
+            field = '%s:%s' % (name, metric)
+            cache_buffer.incr_stat(self.scope_keys[scope_type], field, amount)
+
+    def observe(self, scopes, metric, value):
+        """
+        Add an observation to a histogram.
         """
-        return prefix + '_keys'
+        bucket = '+Inf'
+        for upper_bound in self.histogram_buckets[metric]:
+            if value <= upper_bound:
+                bucket = str(upper_bound)
+                break
 
-    def get_request_prefixes(self, **params):
-        # Override in derived classes
-        return set()
+        self.count(scopes, '%s:bucket:%s' % (metric, bucket))
+        self.count(scopes, '%s:count' % metric)
+        self.count(scopes, '%s:sum' % metric, value)
 
-    def get_keys_with_prefixes(self, *prefixes):
+    def get_stats(self):
         """
-        Return a set of keys that begin with the given prefixes, including
-        meta-keys.
+        Get all of the recorded numbers, like:
+
+            {'views': {'PlaceListView': {'hits': 10, 'rebuild_seconds': {
+                'count': 2, 'sum': 0.3, 'buckets': {'0.1': 1, '0.25': 1}}}}}
         """
-        keys = set()
-        for prefix in prefixes:
-            meta_key = self.get_meta_key(prefix)
-            keys |= cache_buffer.get(meta_key) or set()
-            keys.add(meta_key)
-        logger.debug('Keys with prefixes "%s": "%s"' % ('", "'.join(prefixes), '", "'.join(keys)))
-        return keys
+        structured_cache = get_structured_cache()
+        stats = OrderedDict()
+
+        for scope_type, hkey in self.scope_keys.items():
+            scope_stats = stats[scope_type] = {}
+            for field, value in structured_cache.hgetall(hkey).items():
+                name, metric = field.split(':', 1)
+                metrics = scope_stats.setdefault(name, {})
+
+                if metric.startswith(tuple(self.histogram_buckets)):
+                    metric, part = metric.split(':', 1)
+                    histogram = metrics.setdefault(metric, {'count': 0, 'sum': 0, 'buckets': {}})
+                    if part.startswith('bucket:'):
+                        histogram['buckets'][part[len('bucket:'):]] = value
+                    else:
+                        histogram[part] = value
+                else:
+                    metrics[metric] = value
+
+        return stats
+
+    def reset(self):
+        django_cache.cache.delete_many(list(self.scope_keys.values()))
+
+
+cache_stats = CacheStats()
+
+
+class Cache (object):
+    """
+    The base class for objects responsible for caching Shareabouts data
+    structure information
+
+    """
+
+    def get_generation_keys(self, **params):
+        """
+        Cached responses are stored under keys that include the generation
+        numbers of the data they were built from. Invalidating an instance
+        increments each of the counters returned here, so any response built
+        from the old data will simply never be looked up again, no matter how
+        many variants of it have been cached.
+        """
+        # Override in derived classes
+        return set()
 
     def clear_keys(self, *keys):
         """
@@ -235,6 +892,40 @@ class Cache (object):
         logger.debug('Deleting: "%s"' % instance_params_key)
         cache_buffer.delete(instance_params_key)
 
+    def get_local_params(self, obj):
+        """
+        Get the parameters that can be read off of the instance itself,
+        without following any relations (other than reading foreign key ids).
+        """
+        # Override in derived classes
+        return {}
+
+    def get_parent_params(self, local_params, obj_getter):
+        """
+        Get the parameters that come from the instance's parent (e.g., the
+        dataset of a place), from the parent's own cached parameters. The
+        getter returns the instance, and is only evaluated if the parent's
+        parameters are not cached.
+        """
+        # Override in derived classes
+        return {}
+
+    def get_parent_params_key(self, local_params):
+        """
+        Get the key that the instance's parent's parameters are cached under,
+        if the instance has a parent.
+        """
+        return None
+
+    def get_instance_params(self, obj):
+        """
+        Get the instance parameters for an instance that we already have.
+        """
+        local_params = self.get_local_params(obj)
+        params = dict(self.get_parent_params(local_params, lambda: obj))
+        params.update(local_params)
+        return params
+
     def get_cached_instance_params(self, inst_key, obj_getter):
         """
         Get the instance parameters cached for the given instance key. If no
@@ -242,22 +933,38 @@ class Cache (object):
         calculate the parameters based on that object. The getter is a function
         so that it does not get evaluated if it doesn't have to be, since
         evaluating it may involve additional queries.
+
+        Only the instance's local parameters are cached under its own key. The
+        rest come from its parent's cached parameters, so that changing the
+        parent (e.g., renaming a dataset) only has to clear the parent's key.
         """
-        # instance_params_key = self.get_instance_params_key(inst_key)
-        # params = cache_buffer.get(instance_params_key)
-
-        # if params is None:
-        #     obj = obj_getter()
-        #     params = self.get_instance_params(obj)
-        #     logger.debug('Setting instance parameters for "%s": %r' % (instance_params_key, params))
-        #     cache_buffer.set(instance_params_key, params)
-        # else:
-        #     logger.debug('Found instance parameters for "%s": %r' % (instance_params_key, params))
-        # return params
-        obj = obj_getter()
-        params = self.get_instance_params(obj)
+        instance_params_key = self.get_instance_params_key(inst_key)
+        local_params = cache_buffer.peek(instance_params_key)
+
+        if local_params is None:
+            local_params = self.get_local_params(obj_getter())
+            logger.debug('Setting instance parameters for "%s": %r' % (instance_params_key, local_params))
+            cache_buffer.set(instance_params_key, local_params)
+
+        params = dict(self.get_parent_params(local_params, obj_getter))
+        params.update(local_params)
         return params
 
+    def prefetch_instance_params(self, objs):
+        """
+        Fetch the cached parameters of the parents of all the given instances
+        at once, so that getting each instance's parameters does not have to
+        go to the cache separately.
+        """
+        keys = set()
+        for obj in objs:
+            key = self.get_parent_params_key(self.get_local_params(obj))
+            if key is not None:
+                keys.add(key)
+
+        if keys:
+            cache_buffer.get_many(keys)
+
     def get_serialized_data_meta_key(self, inst_key):
         inst_params_key = self.get_instance_params_key(inst_key)
         return inst_params_key + ':_keys'
@@ -277,40 +984,96 @@ class Cache (object):
 
             # Cache the key itself
             meta_key = self.get_serialized_data_meta_key(inst_key)
-            keys = cache_buffer.get(meta_key) or set()
-            keys.add(key)
-            cache_buffer.set(meta_key, keys)
+            cache_buffer.add(meta_key, [key])
 
         return data
 
     def get_serialized_data_keys(self, inst_key):
         meta_key = self.get_serialized_data_meta_key(inst_key)
         if meta_key is not None:
-            keys = cache_buffer.get(meta_key)
-            return (keys or set()) | set([meta_key])
+            return cache_buffer.members(meta_key) | set([meta_key])
         else:
             return set()
 
     def get_other_keys(self, **params):
         return set()
 
+    # == Negative caching
+    def get_missing_key(self, **params):
+        """
+        Get the key that marks an instance, identified by the parameters in
+        the URLs that refer to it, as not existing.
+        """
+        # Override in derived classes
+        return None
+
+    def is_missing(self, **params):
+        """
+        Check whether the instance was recently looked up and not found.
+        """
+        if settings.API_CACHE_NEGATIVE_TIMEOUT <= 0:
+            return False
+        return cache_buffer.get(self.get_missing_key(**params)) is not None
+
+    def set_missing(self, **params):
+        """
+        Remember for a little while that the instance does not exist, so that
+        repeated requests for it do not have to query the database.
+        """
+        if settings.API_CACHE_NEGATIVE_TIMEOUT > 0:
+            cache_buffer.set(self.get_missing_key(**params), True,
+                             settings.API_CACHE_NEGATIVE_TIMEOUT)
+
     def clear_instance(self, obj):
+        """
+        Queue the cached data for the instance to be invalidated. The keys are
+        cleared when the cache buffer is next read from or flushed, once for
+        all the changes made to the instance in the meantime.
+        """
         # Collect information for cache keys
         params = self.get_cached_instance_params(obj.pk, lambda: obj)
-        # Collect the prefixes for cached requests
-        prefixes = self.get_request_prefixes(**params)
-        prefixed_keys = self.get_keys_with_prefixes(*prefixes)
+        cache_buffer.invalidate(self, obj.pk, params)
+
+        # If the identifying information for the instance has changed, the
+        # keys for its new parameters have to be cleared as well.
+        current_params = self.get_instance_params(obj)
+        if current_params != params:
+            cache_buffer.invalidate(self, obj.pk, current_params)
+
+        # An instance that was missing may have just been created. This is
+        # not deferred with the rest of the invalidation, so that the new
+        # instance can be found right away.
+        missing_key = self.get_missing_key(**current_params)
+        if missing_key is not None:
+            cache_buffer.delete(missing_key)
+
+    def clear_instance_keys(self, pk, **params):
+        # Move cached responses on to a new generation
+        generation_keys = self.get_generation_keys(**params)
+        logger.debug('Incrementing: "%s"' % '", "'.join(generation_keys))
+        cache_buffer.incr_many(generation_keys)
         # Serialized data keys
-        data_keys = self.get_serialized_data_keys(obj)
+        data_keys = self.get_serialized_data_keys(pk)
         # Collect other related keys
-        other_keys = self.get_other_keys(**params) | set([self.get_instance_params_key(obj.pk)])
+        other_keys = self.get_other_keys(**params) | set([self.get_instance_params_key(pk)])
         # Clear all the keys
-        self.clear_keys(*(prefixed_keys | data_keys | other_keys))
+        self.clear_keys(*(data_keys | other_keys))
+        # Rebuild the dataset's popular responses, if so configured
+        if settings.API_CACHE_WARM_COUNT > 0 and params.get('dataset_slug'):
+            cache_buffer.warm(params['owner_username'], params['dataset_slug'])
+        # Count the invalidation
+        scopes = [('caches', self.__class__.__name__)]
+        if params.get('dataset_slug'):
+            scopes.append(('datasets', '%s/%s' % (params['owner_username'], params['dataset_slug'])))
+        cache_stats.count(scopes, 'invalidations')
 
 
 class UserCache (Cache):
-    def get_instance_params(self, user_obj):
-        params = {'user_id': user_obj.id}
+    def get_local_params(self, user_obj):
+        params = {
+            'user_id': user_obj.id,
+            'username': user_obj.username,
+        }
         return params
 
     # == Raw query caching
@@ -321,24 +1084,92 @@ class UserCache (Cache):
     @classmethod
     def get_instance(cls, **params):
         """
-        Get a full cached user instance.
+        Get a full cached user instance. The instance comes with the user's
+        groups, so it is only used while the generations of the groups in
+        the datasets that the user has groups in have not changed.
         """
         key = cls.get_instance_key(**params)
-        return cache_buffer.get(key)
+        cached = cache_buffer.get(key)
+        if not isinstance(cached, tuple):
+            return None
+
+        generation_keys, generations, instance = cached
+        if cache_buffer.get_generations(generation_keys) != generations:
+            return None
+        return instance
 
     @classmethod
     def set_instance(cls, instance, **params):
         key = cls.get_instance_key(**params)
-        cache_buffer.set(key, instance)
+        dataset_ids = set(group.dataset_id for group in instance._groups.all()) if instance else set()
+        generation_keys = [GroupCache.get_groups_generation_key(dataset_id=dataset_id)
+                           for dataset_id in sorted(dataset_ids)]
+        generations = cache_buffer.get_generations(generation_keys)
+        cache_buffer.set(key, (generation_keys, generations, instance))
+
+    @classmethod
+    def get_group_datasets_key(cls, **params):
+        return ':'.join(['user-group-datasets', params['username']])
+
+    @classmethod
+    def get_group_dataset_ids(cls, dataset_ids_getter, **params):
+        """
+        Get the ids of the datasets that the user has groups in. The getter
+        is only evaluated if the ids are not cached.
+        """
+        key = cls.get_group_datasets_key(**params)
+        dataset_ids = cache_buffer.get(key)
+        if dataset_ids is None:
+            dataset_ids = sorted(set(dataset_ids_getter()))
+            cache_buffer.set(key, dataset_ids)
+        return dataset_ids
+
+    # == Generation counters
+    @classmethod
+    def get_user_generation_key(cls, **params):
+        """
+        The generation of the user's own information, including their
+        social auth details and which groups they belong to.
+        """
+        return ':'.join(['user-generation', params['username']])
+
+    # == Negative caching
+    @classmethod
+    def get_missing_key(cls, **params):
+        return ':'.join(['missing-user', params['username']])
 
     # == Cache invalidation
     @classmethod
-    def get_request_prefixes(cls, **params):
-        return set()
+    def get_generation_keys(cls, **params):
+        return set([cls.get_user_generation_key(**params)])
 
     @classmethod
     def get_other_keys(cls, **params):
-        return set([cls.get_instance_key(**params)])
+        return set([cls.get_instance_key(**params), cls.get_group_datasets_key(**params)])
+
+
+class GroupCache (Cache):
+    def get_local_params(self, group_obj):
+        params = {
+            'group_id': group_obj.pk,
+            'dataset_id': group_obj.dataset_id,
+        }
+        return params
+
+    # == Generation counters
+    @classmethod
+    def get_groups_generation_key(cls, **params):
+        """
+        The generation of the groups in a dataset. Users' information includes
+        the groups that they belong to, so it depends on this counter for each
+        dataset that they have a group in, and changing a group does not have
+        to invalidate each of its submitters separately.
+        """
+        return ':'.join(['groups-generation', str(params['dataset_id'])])
+
+    # == Cache invalidation
+    def get_generation_keys(self, **params):
+        return set([self.get_groups_generation_key(**params)])
 
 
 class DataSetCache (Cache):
@@ -346,16 +1177,31 @@ class DataSetCache (Cache):
     def get_instance_key(self, **params):
         return ':'.join(['dataset-instance', params['owner_username'], params['dataset_slug']])
 
+    def get_instance_version(self, **params):
+        return cache_buffer.get_generations([self.get_config_generation_key(**params)])[0]
+
     def get_instance(self, **params):
         """
-        Get a full cached dataset instance.
+        Get a full cached dataset instance. Recently used instances are kept
+        in this process, and are only fetched from the shared cache when the
+        dataset's configuration generation has changed.
         """
         key = self.get_instance_key(**params)
-        return cache_buffer.get(key)
+        version = self.get_instance_version(**params)
+
+        instance = local_instances.get(key, version)
+        if instance is None:
+            instance = cache_buffer.get(key)
+            if instance is not None:
+                local_instances.set(key, instance, version)
+        return instance
 
     def set_instance(self, instance, **params):
         key = self.get_instance_key(**params)
+        version = self.get_instance_version(**params)
+
         cache_buffer.set(key, instance)
+        local_instances.set(key, instance, version)
 
     def get_permissions_key(self, **params):
         return ':'.join(['dataset-permissions', params['owner_username'], params['dataset_slug']])
@@ -374,130 +1220,242 @@ class DataSetCache (Cache):
             dataset_id, submission_set_name, format,
             ':'.join(k for k, v in list(flags.items()) if v))
 
-    def get_instance_params(self, dataset_obj):
+    user_cache = UserCache()
+
+    def get_local_params(self, dataset_obj):
         params = {
-            'owner_username': dataset_obj.owner.username,
-            'owner_id': dataset_obj.owner.pk,
+            'owner_id': dataset_obj.owner_id,
             'dataset_slug': dataset_obj.slug,
             'dataset_id': dataset_obj.pk,
         }
         return params
 
-    # == Cache invalidation
-    def get_request_prefixes(self, **params):
-        owner, dataset = list(map(params.get, ('owner_username', 'dataset_slug')))
-        prefixes = super(DataSetCache, self).get_request_prefixes(**params)
+    def get_parent_params(self, local_params, obj_getter):
+        user_params = self.user_cache.get_cached_instance_params(
+            local_params['owner_id'], lambda: obj_getter().owner)
+        return {'owner_username': user_params['username']}
+
+    def get_parent_params_key(self, local_params):
+        return self.user_cache.get_instance_params_key(local_params['owner_id'])
+
+    # == Generation counters
+    all_datasets_generation_key = 'datasets-generation'
+
+    def get_config_generation_key(self, **params):
+        """
+        The generation of the dataset's own configuration -- its attributes,
+        permissions, keys and origins. Every response about the dataset
+        depends on it.
+        """
+        return ':'.join(['dataset-generation', 'config', params['owner_username'], params['dataset_slug']])
+
+    def get_data_generation_key(self, **params):
+        """
+        The generation of the data (places, submissions, ...) within the
+        dataset. Collection responses depend on it.
+        """
+        return ':'.join(['dataset-generation', 'data', params['owner_username'], params['dataset_slug']])
+
+    def get_places_generation_key(self, **params):
+        """
+        The generation of the places within the dataset, not counting their
+        submissions or attachments. Submission lists depend on it, since a
+        place's submissions go away with it.
+        """
+        return ':'.join(['dataset-generation', 'places', params['owner_username'], params['dataset_slug']])
+
+    def get_owner_generation_key(self, **params):
+        """
+        The generation of all the datasets belonging to an owner, for the
+        owner's dataset list.
+        """
+        return ':'.join(['owner-generation', params['owner_username']])
+
+    # == Negative caching
+    def get_missing_key(self, **params):
+        return ':'.join(['missing-dataset', params['owner_username'], params['dataset_slug']])
 
-        instance_path = reverse('dataset-detail', args=[owner, dataset])
-        collection_path = reverse('dataset-list', args=[owner])
-        prefixes.update([instance_path, collection_path])
+    # == Request popularity
+    def get_hot_requests_key(self, period, **params):
+        return ':'.join(['hot-requests', params['owner_username'], params['dataset_slug'], str(period)])
 
-        return prefixes
+    def get_hot_requests_period(self):
+        # Requests are counted in periods as long as the cache timeout, so
+        # that requests which were once popular eventually drop out.
+        return int(time() // settings.API_CACHE_TIMEOUT)
+
+    def record_request(self, request_info, **params):
+        """
+        Count a request for one of the dataset's responses. The request info
+        is a string that identifies the request well enough to replay it.
+        """
+        key = self.get_hot_requests_key(self.get_hot_requests_period(), **params)
+        cache_buffer.incr_score(key, request_info, timeout=2 * settings.API_CACHE_TIMEOUT)
+
+    def get_hot_requests(self, count, **params):
+        """
+        Get the info for the dataset's most frequently made requests over the
+        current and previous periods, most frequent first.
+        """
+        period = self.get_hot_requests_period()
+        structured_cache = get_structured_cache()
+
+        scores = defaultdict(int)
+        for key in (self.get_hot_requests_key(period - 1, **params),
+                    self.get_hot_requests_key(period, **params)):
+            for request_info, score in structured_cache.ztop(key, count):
+                scores[request_info] += score
+
+        return sorted(scores, key=lambda request_info: -scores[request_info])[:count]
+
+    # == Cache invalidation
+    def get_generation_keys(self, **params):
+        return set([
+            self.get_config_generation_key(**params),
+            self.get_data_generation_key(**params),
+            self.get_owner_generation_key(**params),
+            self.all_datasets_generation_key,
+        ])
 
     def get_other_keys(self, **params):
         return set([self.get_instance_key(**params), self.get_permissions_key(**params)])
 
+    def clear_instance_keys(self, pk, **params):
+        local_instances.delete(self.get_instance_key(**params))
+        super(DataSetCache, self).clear_instance_keys(pk, **params)
+
 
 class PlaceCache (Cache):
     dataset_cache = DataSetCache()
 
-    def get_instance_params(self, place_obj):
-        params = self.dataset_cache.get_cached_instance_params(
-            place_obj.dataset_id, lambda: place_obj.dataset).copy()
-        params.update({
+    def get_local_params(self, place_obj):
+        params = {
+            'dataset_id': place_obj.dataset_id,
             'place_id': place_obj.pk,
             'thing_id': place_obj.pk,
             'thing_type': 'place'
-        })
+        }
         return params
 
-    def get_request_prefixes(self, **params):
-        owner, dataset, place = list(map(params.get, ('owner_username', 'dataset_slug', 'place_id')))
-        prefixes = super(PlaceCache, self).get_request_prefixes(**params)
+    def get_parent_params(self, local_params, obj_getter):
+        return self.dataset_cache.get_cached_instance_params(
+            local_params['dataset_id'], lambda: obj_getter().dataset)
+
+    def get_parent_params_key(self, local_params):
+        return self.dataset_cache.get_instance_params_key(local_params['dataset_id'])
+
+    # == Generation counters
+    def get_place_generation_key(self, **params):
+        """
+        The generation of a single place, including its submissions and
+        attachments. Responses scoped to one place depend on it instead of on
+        the generation of all the data in the dataset.
+        """
+        return ':'.join(['place-generation', params['owner_username'], params['dataset_slug'], str(params['place_id'])])
 
-        instance_path = reverse('place-detail', args=[owner, dataset, place])
-        collection_path = reverse('place-list', args=[owner, dataset])
-        dataset_instance_path = reverse('dataset-detail', args=[owner, dataset])
-        dataset_collection_path = reverse('dataset-list', args=[owner])
-        action_collection_path = reverse('action-list', args=[owner, dataset])
-        prefixes.update([instance_path, collection_path, dataset_instance_path,
-                         dataset_collection_path, action_collection_path])
+    # == Negative caching
+    def get_missing_key(self, **params):
+        return ':'.join(['missing-place', params['owner_username'], params['dataset_slug'], str(params['place_id'])])
 
-        return prefixes
+    # == Cache invalidation
+    def get_generation_keys(self, **params):
+        return set([
+            self.dataset_cache.get_data_generation_key(**params),
+            self.dataset_cache.get_owner_generation_key(**params),
+            self.dataset_cache.all_datasets_generation_key,
+            self.dataset_cache.get_places_generation_key(**params),
+            self.get_place_generation_key(**params),
+        ])
 
 
 class SubmissionCache (Cache):
     dataset_cache = DataSetCache()
     place_cache = PlaceCache()
 
-    def get_instance_params(self, submission_obj):
-        params = self.place_cache.get_cached_instance_params(
-            submission_obj.place_id, lambda: submission_obj.place).copy()
-        params.update({
+    def get_local_params(self, submission_obj):
+        params = {
+            'place_id': submission_obj.place_id,
             'submission_set_name': submission_obj.set_name,
             'submission_id': submission_obj.pk,
             'thing_id': submission_obj.pk,
             'thing_type': 'submission'
-        })
+        }
         return params
 
+    def get_parent_params(self, local_params, obj_getter):
+        return self.place_cache.get_cached_instance_params(
+            local_params['place_id'], lambda: obj_getter().place)
+
+    def get_parent_params_key(self, local_params):
+        return self.place_cache.get_instance_params_key(local_params['place_id'])
+
     def get_other_keys(self, **params):
         dataset_id, place_id, submission_set_name = list(map(params.get, ['dataset_id', 'place_id', 'submission_set_name']))
         dataset_serialized_data_keys = self.dataset_cache.get_serialized_data_keys(dataset_id)
         place_serialized_data_keys = self.place_cache.get_serialized_data_keys(place_id)
         return dataset_serialized_data_keys | place_serialized_data_keys
 
-    def get_request_prefixes(self, **params):
-        owner, dataset, place, submission_set_name, submission = list(map(params.get, ['owner_username', 'dataset_slug', 'place_id', 'submission_set_name', 'submission_id']))
-        prefixes = super(SubmissionCache, self).get_request_prefixes(**params)
-
-        # TODO: it's pretty clear that a developer should be able to register
-        # a URL with or cache key or prefix or something to be cleared. How
-        # would that work?
-        specific_instance_path = reverse('submission-detail', args=[owner, dataset, place, submission_set_name, submission])
-        general_instance_path = reverse('submission-detail', args=[owner, dataset, place, 'submissions', submission])
-        specific_collection_path = reverse('submission-list', args=[owner, dataset, place, submission_set_name])
-        general_collection_path = reverse('submission-list', args=[owner, dataset, place, 'submissions'])
-        specific_all_path = reverse('dataset-submission-list', args=[owner, dataset, submission_set_name])
-        general_all_path = reverse('dataset-submission-list', args=[owner, dataset, 'submissions'])
-        place_instance_path = reverse('place-detail', args=[owner, dataset, place])
-        place_collection_path = reverse('place-list', args=[owner, dataset])
-        dataset_instance_path = reverse('dataset-detail', args=[owner, dataset])
-        dataset_collection_path = reverse('dataset-list', args=[owner])
-        action_collection_path = reverse('action-list', args=[owner, dataset])
-
-        prefixes.update([specific_instance_path, general_instance_path,
-                         specific_collection_path, general_collection_path,
-                         specific_all_path, general_all_path,
-                         place_instance_path, place_collection_path,
-                         dataset_instance_path, dataset_collection_path,
-                         action_collection_path])
-
-        return prefixes
+    # == Generation counters
+    all_submission_sets_name = 'submissions'
 
+    def get_submission_set_generation_key(self, **params):
+        """
+        The generation of the submissions in one of the dataset's submission
+        sets. The set named "submissions" stands for all of the sets.
+        """
+        return ':'.join(['submission-set-generation', params['owner_username'], params['dataset_slug'], params['submission_set_name']])
 
-class ActionCache (Cache):
-    def clear_instance(self, obj):
-        keys = cache_buffer.get('action_keys') or set()
-        keys.add('action_keys')
-        cache_buffer.delete_many(keys)
+    # == Cache invalidation
+    def get_generation_keys(self, **params):
+        # A submission changes its place, and everything that summarizes the
+        # place, but only its own submission set.
+        all_sets_params = dict(params, submission_set_name=self.all_submission_sets_name)
+        place_keys = self.place_cache.get_generation_keys(**params)
+        place_keys.discard(self.dataset_cache.get_places_generation_key(**params))
+        return place_keys | set([
+            self.get_submission_set_generation_key(**params),
+            self.get_submission_set_generation_key(**all_sets_params),
+        ])
 
 
 class ThingWithAttachmentCache (Cache):
     place_cache = PlaceCache()
     submission_cache = SubmissionCache()
 
-    def get_instance_params(self, thing_obj):
+    def get_local_params(self, thing_obj):
         try:
-            return self.place_cache.get_instance_params(thing_obj.full_place)
+            thing_obj.full_place
+            thing_type = 'place'
         except ObjectDoesNotExist:
-            return self.submission_cache.get_instance_params(thing_obj.full_submission)
+            thing_type = 'submission'
 
-    def get_serialized_data_keys(self, thing_obj):
-        try:
-            return self.place_cache.get_instance_params(thing_obj.full_place)
-        except ObjectDoesNotExist:
-            return self.submission_cache.get_instance_params(thing_obj.full_submission)
+        params = {
+            'thing_id': thing_obj.pk,
+            'thing_type': thing_type,
+        }
+        return params
+
+    def get_parent_params(self, local_params, obj_getter):
+        # A place or submission shares its primary key with its thing.
+        if local_params['thing_type'] == 'place':
+            return self.place_cache.get_cached_instance_params(
+                local_params['thing_id'], lambda: obj_getter().full_place)
+        else:
+            try:
+                return self.submission_cache.get_cached_instance_params(
+                    local_params['thing_id'], lambda: obj_getter().full_submission)
+            except ObjectDoesNotExist:
+                # A bare thing, which is neither a place nor a submission,
+                # only has the parameters of its own dataset.
+                thing = obj_getter()
+                return self.place_cache.dataset_cache.get_cached_instance_params(
+                    thing.dataset_id, lambda: thing.dataset)
+
+    def get_serialized_data_keys(self, inst_key):
+        # A thing's data is serialized as the place or submission that it is,
+        # which share its primary key.
+        return (self.place_cache.get_serialized_data_keys(inst_key) |
+                self.submission_cache.get_serialized_data_keys(inst_key))
 
     def get_attachments_key(self, dataset_id):
         return 'dataset:%s:%s' % (dataset_id, 'attachments-by-thing_id')
@@ -508,51 +1466,37 @@ class AttachmentCache (Cache):
     place_cache = PlaceCache()
     submission_cache = SubmissionCache()
 
-    def get_instance_params(self, attachment_obj):
-        params = self.thing_cache.get_cached_instance_params(
-            attachment_obj.thing_id, lambda: attachment_obj.thing).copy()
-        params.update({
+    def get_local_params(self, attachment_obj):
+        params = {
+            'thing_id': attachment_obj.thing_id,
             'attachment': attachment_obj.name,
             'attachment_id': attachment_obj.pk,
-        })
+        }
         return params
 
-    def get_request_prefixes(self, **params):
-        prefixes = super(AttachmentCache, self).get_request_prefixes(**params)
-        if params['thing_type'] == 'submission':
-            return prefixes | self.get_submission_attachment_request_prefixes(**params)
-        else:
-            return prefixes | self.get_place_attachment_request_prefixes(**params)
-
-    def get_submission_attachment_request_prefixes(self, **params):
-        owner, dataset, place, submission_set_name, submission = list(map(params.get, ['owner_username', 'dataset_slug', 'place_id', 'submission_set_name', 'submission_id']))
-        prefixes = set()
-
-        specific_instance_path = reverse('submission-detail', args=[owner, dataset, place, submission_set_name, submission])
-        general_instance_path = reverse('submission-detail', args=[owner, dataset, place, 'submissions', submission])
-        specific_collection_path = reverse('submission-list', args=[owner, dataset, place, submission_set_name])
-        general_collection_path = reverse('submission-list', args=[owner, dataset, place, 'submissions'])
-        specific_all_path = reverse('dataset-submission-list', args=[owner, dataset, submission_set_name])
-        general_all_path = reverse('dataset-submission-list', args=[owner, dataset, 'submissions'])
-        action_collection_path = reverse('action-list', args=[owner, dataset])
-
-        prefixes.update([specific_instance_path, general_instance_path,
-                         specific_collection_path, general_collection_path,
-                         specific_all_path, general_all_path,
-                         action_collection_path])
+    def get_parent_params(self, local_params, obj_getter):
+        return self.thing_cache.get_cached_instance_params(
+            local_params['thing_id'], lambda: obj_getter().thing)
 
-        return prefixes
+    def get_parent_params_key(self, local_params):
+        return self.thing_cache.get_instance_params_key(local_params['thing_id'])
 
-    def get_place_attachment_request_prefixes(self, **params):
-        owner, dataset, place = list(map(params.get, ('owner_username', 'dataset_slug', 'place_id')))
-        prefixes = set()
+    def get_generation_keys(self, **params):
+        # Attachments are listed on the place or submission that they belong
+        # to, so they change that place and the dataset's data.
+        keys = set([
+            self.place_cache.dataset_cache.get_data_generation_key(**params),
+            self.place_cache.get_place_generation_key(**params),
+        ])
 
-        instance_path = reverse('place-detail', args=[owner, dataset, place])
-        collection_path = reverse('place-list', args=[owner, dataset])
-        action_collection_path = reverse('action-list', args=[owner, dataset])
-        prefixes.update([instance_path, collection_path, action_collection_path])
+        if params['thing_type'] == 'submission':
+            all_sets_params = dict(params, submission_set_name=self.submission_cache.all_submission_sets_name)
+            keys |= set([
+                self.submission_cache.get_submission_set_generation_key(**params),
+                self.submission_cache.get_submission_set_generation_key(**all_sets_params),
+            ])
 
-        return prefixes
+        return keys
 
     def get_other_keys(self, **params):
         dataset_id = params.get('dataset_id')
@@ -566,3 +1510,26 @@ class AttachmentCache (Cache):
 
         # Union the two sets
         return set([thing_attachments_key]) | thing_serialized_data_keys
+
+
+class ActionCache (Cache):
+    dataset_cache = DataSetCache()
+    thing_cache = ThingWithAttachmentCache()
+
+    def get_local_params(self, action_obj):
+        params = {
+            'action_id': action_obj.pk,
+            'thing_id': action_obj.thing_id,
+        }
+        return params
+
+    def get_parent_params(self, local_params, obj_getter):
+        return self.thing_cache.get_cached_instance_params(
+            local_params['thing_id'], lambda: obj_getter().thing)
+
+    def get_parent_params_key(self, local_params):
+        return self.thing_cache.get_instance_params_key(local_params['thing_id'])
+
+    def get_generation_keys(self, **params):
+        # Actions are only listed in their own dataset's activity.
+        return set([self.dataset_cache.get_data_generation_key(**params)])
@@ -1,5 +1,6 @@
 from django.core.exceptions import PermissionDenied
 from rest_framework import authentication
+from .models import Origin
 
 
 # Client authentication with CORS
@@ -25,7 +26,7 @@ class OriginAuthentication(authentication.BaseAuthentication):
         return (client, auth)
 
     def check_origin_permission(self, origin_header, dataset):
-        ds_origin = dataset.get_origin(origin_header)
+        ds_origin = dataset.get_auth_snapshot().get_origin(origin_header, Origin.match)
         if ds_origin is not None:
             return ds_origin, ds_origin
         else:
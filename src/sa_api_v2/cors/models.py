@@ -13,11 +13,12 @@ from django.db import models
 from django.db.models.signals import post_save
 from django.utils.timezone import now
 from ..models import DataSet, OriginPermission
+from ..models.caching import CacheClearingModel
 from ..models.mixins import CloneableModelMixin
 import re
 
 
-class Origin(CloneableModelMixin, models.Model):
+class Origin(CloneableModelMixin, CacheClearingModel, models.Model):
     pattern = models.CharField(max_length=100, help_text='The origin pattern, e.g., https://*.github.io, http://localhost:*, http*://map.phila.gov')
     logged_ip = models.GenericIPAddressField(blank=True, null=True)
     last_used = models.DateTimeField(blank=True, default=now)
@@ -82,6 +83,9 @@ class Origin(CloneableModelMixin, models.Model):
         for permission in self.permissions.all():
             permission.clone(overrides={'origin': onto})
 
+    def clear_instance_cache(self):
+        return self.dataset.clear_instance_cache()
+
     def save(self, *args, **kwargs):
         if self.logged_ip == '':
             self.logged_ip = None
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from sa_api_v2.models import DataIndex
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Build the database index for each data index, e.g. for indexes '
+            'that were declared before the data blob could be indexed.')
+
+    def handle(self, *args, **options):
+        if not DataIndex.uses_expression_indexes():
+            raise CommandError('The database does not support data blob indexes; '
+                               'indexed values are kept in IndexedValues instead.')
+
+        for index in DataIndex.objects.all().select_related('dataset'):
+            log.info('Building the "%s" index for dataset %s' % (index.attr_name, index.dataset.slug))
+            DataIndex.sync_db_index(index.id)
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.urls import reverse
+from sa_api_v2.cache import DataSetCache
+from sa_api_v2.models import DataSet
+from sa_api_v2.tasks import replay_cached_request
+
+import json
+import logging
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the cached responses for the most popular requests to '
+            'each dataset (or to the given datasets), e.g. after a deploy. '
+            'Datasets with no recorded requests get their place list cached.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('datasets', nargs='*', metavar='owner/dataset',
+            help='The datasets to warm. By default, all of them.')
+        parser.add_argument('--count', type=int, default=None,
+            help='How many requests to replay for each dataset.')
+
+    def handle(self, *args, **options):
+        count = options['count'] or settings.API_CACHE_WARM_COUNT or 20
+
+        datasets = DataSet.objects.all().select_related('owner')
+        if options['datasets']:
+            filters = Q(pk__in=[])
+            for name in options['datasets']:
+                try:
+                    owner_username, dataset_slug = name.split('/')
+                except ValueError:
+                    raise CommandError('Expected a dataset like "owner/dataset", not "%s"' % name)
+                filters |= Q(owner__username=owner_username, slug=dataset_slug)
+            datasets = datasets.filter(filters)
+
+        for dataset in datasets:
+            params = {'owner_username': dataset.owner.username, 'dataset_slug': dataset.slug}
+            log.info('Warming the cache for %s/%s' % (params['owner_username'], params['dataset_slug']))
+
+            hot_requests = [json.loads(request_info) for request_info
+                            in DataSetCache().get_hot_requests(count, **params)]
+            if not hot_requests:
+                hot_requests = [(reverse('place-list', kwargs=params), '', [])]
+
+            for path, querystring, headers in hot_requests:
+                replay_cached_request(path, querystring, dict(headers))
@@ -1,6 +1,7 @@
 import time
 import logging
 from django.utils.deprecation import MiddlewareMixin
+from .cache import cache_buffer
 
 
 class RequestTimeLogger (MiddlewareMixin):
@@ -68,3 +69,15 @@ class UniversalP3PHeader (MiddlewareMixin):
     def process_response(self, request, response):
         response['P3P'] = 'CP="Shareabouts does not have a P3P policy."'
         return response
+
+
+class CacheBufferFlusher (MiddlewareMixin):
+    """
+    Writes any buffered cache changes (including invalidations triggered by
+    saving models, e.g. from the admin) at the end of every request, so that
+    they do not wait around for the next cached API response in the same
+    process.
+    """
+    def process_response(self, request, response):
+        cache_buffer.flush()
+        return response
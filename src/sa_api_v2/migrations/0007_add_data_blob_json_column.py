@@ -0,0 +1,17 @@
+from django.db import migrations
+import sa_api_v2.models.core
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sa_api_v2', '0006_alter_submittedthing_visible_alter_user_first_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submittedthing',
+            name='data_json',
+            field=sa_api_v2.models.core.JSONTextField(null=True),
+        ),
+    ]
@@ -0,0 +1,96 @@
+from django.db import DatabaseError, migrations, models, transaction
+from django.db.models.functions import Cast
+
+import json
+import logging
+log = logging.getLogger(__name__)
+
+
+# Rows are copied between the text and JSON columns this many at a time, so
+# that no single statement has to rewrite a whole large table.
+BATCH_SIZE = 10000
+
+
+def remove_nul_characters(value):
+    # A JSON column can't hold the NUL character, which a text column could.
+    if isinstance(value, str):
+        return value.replace('\x00', '')
+    elif isinstance(value, list):
+        return [remove_nul_characters(item) for item in value]
+    elif isinstance(value, dict):
+        return dict((remove_nul_characters(key), remove_nul_characters(item))
+                    for key, item in value.items())
+    return value
+
+
+def clean_data_blob(thing_id, data):
+    """
+    Get a data blob that a JSON column can hold. A blob that is not a valid
+    JSON object is replaced by an empty one.
+    """
+    try:
+        blob = json.loads(data)
+    except (TypeError, ValueError):
+        blob = None
+
+    if not isinstance(blob, dict):
+        log.warning('Replacing the data blob of thing %s, which is not a JSON object: %r', thing_id, data)
+        return {}
+
+    cleaned_blob = remove_nul_characters(blob)
+    if cleaned_blob != blob:
+        log.warning('Removing NUL characters from the data blob of thing %s', thing_id)
+    return cleaned_blob
+
+
+def batches(things):
+    bounds = things.aggregate(first_id=models.Min('id'), last_id=models.Max('id'))
+    if bounds['first_id'] is None:
+        return
+
+    for start_id in range(bounds['first_id'], bounds['last_id'] + 1, BATCH_SIZE):
+        yield things.filter(id__gte=start_id, id__lt=start_id + BATCH_SIZE)
+
+
+def copy_text_to_json(apps, schema_editor):
+    """
+    Copy each data blob that has not been copied yet to the JSON column. Any
+    batch that the database can't cast is copied row by row, cleaning the
+    blobs that need it.
+    """
+    SubmittedThing = apps.get_model('sa_api_v2', 'SubmittedThing')
+    using = schema_editor.connection.alias
+
+    for batch in batches(SubmittedThing.objects.using(using).filter(data_json__isnull=True)):
+        try:
+            with transaction.atomic(using=using):
+                batch.update(data_json=Cast('data', models.JSONField()))
+        except DatabaseError:
+            for thing_id, data in batch.values_list('id', 'data'):
+                with transaction.atomic(using=using):
+                    SubmittedThing.objects.using(using).filter(id=thing_id)\
+                        .update(data_json=clean_data_blob(thing_id, data))
+
+
+def copy_json_to_text(apps, schema_editor):
+    SubmittedThing = apps.get_model('sa_api_v2', 'SubmittedThing')
+    using = schema_editor.connection.alias
+
+    for batch in batches(SubmittedThing.objects.using(using).all()):
+        with transaction.atomic(using=using):
+            batch.update(data=Cast('data_json', models.TextField()))
+
+
+class Migration(migrations.Migration):
+    # Commit each batch as it is copied, rather than holding every row of the
+    # table in one transaction. Only rows that have not been copied are
+    # copied, so the migration can be run again if it is interrupted.
+    atomic = False
+
+    dependencies = [
+        ('sa_api_v2', '0007_add_data_blob_json_column'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_text_to_json, copy_json_to_text),
+    ]
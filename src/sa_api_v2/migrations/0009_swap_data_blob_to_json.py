@@ -0,0 +1,51 @@
+from django.db import migrations
+from importlib import import_module
+import sa_api_v2.models.core
+
+
+copy_data_blob = import_module('sa_api_v2.migrations.0008_copy_data_blob_to_json')
+
+GIN_INDEX_NAME = 'sa_api_submittedthing_data_gin'
+
+
+def copy_remaining_text_to_json(apps, schema_editor):
+    # Copy any blobs that were written after the bulk copy.
+    copy_data_blob.copy_text_to_json(apps, schema_editor)
+
+
+def add_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS %s ON sa_api_submittedthing '
+            'USING gin (data jsonb_path_ops)' % GIN_INDEX_NAME)
+
+
+def remove_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % GIN_INDEX_NAME)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sa_api_v2', '0008_copy_data_blob_to_json'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_remaining_text_to_json, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='submittedthing',
+            name='data',
+        ),
+        migrations.RenameField(
+            model_name='submittedthing',
+            old_name='data_json',
+            new_name='data',
+        ),
+        migrations.AlterField(
+            model_name='submittedthing',
+            name='data',
+            field=sa_api_v2.models.core.JSONTextField(default='{}'),
+        ),
+        migrations.RunPython(add_gin_index, remove_gin_index),
+    ]
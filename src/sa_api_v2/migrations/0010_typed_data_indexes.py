@@ -0,0 +1,36 @@
+from django.db import migrations, models
+from sa_api_v2.models.data_indexes import CREATE_CAST_FUNCTIONS, DROP_CAST_FUNCTIONS
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sa_api_v2', '0009_swap_data_blob_to_json'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dataindex',
+            name='attr_type',
+            field=models.CharField(choices=[('string', 'String'), ('number', 'Number'), ('boolean', 'Boolean'), ('datetime', 'Date/time')], default='string', max_length=10, verbose_name='Attribute type'),
+        ),
+        migrations.AddField(
+            model_name='indexedvalue',
+            name='number_value',
+            field=models.FloatField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexedvalue',
+            name='boolean_value',
+            field=models.BooleanField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexedvalue',
+            name='datetime_value',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        # Cast an attribute's text to each index type, for the typed
+        # expression indexes. The functions are also created after every
+        # migrate, for databases whose tables are not built by migrations.
+        migrations.RunSQL(CREATE_CAST_FUNCTIONS, DROP_CAST_FUNCTIONS),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def clear_indexed_values(apps, schema_editor):
+    # On PostgreSQL, indexed attributes are read straight out of the data
+    # blob, and IndexedValues are no longer kept up to date. Remove them,
+    # rather than leave them to go stale.
+    if schema_editor.connection.vendor == 'postgresql':
+        IndexedValue = apps.get_model('sa_api_v2', 'IndexedValue')
+        IndexedValue.objects.using(schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sa_api_v2', '0010_typed_data_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_indexed_values, migrations.RunPython.noop),
+    ]
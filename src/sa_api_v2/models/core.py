@@ -7,12 +7,15 @@ if settings.USE_GEODB:
 else:
     from django.db import models
 
+from django import forms
+from django.core.exceptions import ValidationError
 from django.core.files.storage import storages
+from django.db.models.fields.json import KeyTransform
 from django.utils.timezone import now
 from .. import cache
 from .. import utils
 from .caching import CacheClearingModel
-from .data_indexes import IndexedValue, FilterByIndexMixin
+from .data_indexes import DataIndex, IndexedValue, FilterByIndexMixin
 from .mixins import CloneableModelMixin
 from .profiles import User
 from PIL import Image, UnidentifiedImageError
@@ -30,8 +33,42 @@ class TimeStampedModel (models.Model):
         abstract = True
 
 
+class JSONTextField (models.JSONField):
+    """
+    A JSON column that reads and writes its value as JSON text, the way the
+    data blob has always been handled. Lookups into the JSON (e.g.,
+    ``data__contains`` or ``data__<key>``) run in the database.
+    """
+    def parse(self, value):
+        # Unlike a text column, the JSON column can only store valid JSON.
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise ValidationError(self.error_messages['invalid'], code='invalid', params={'value': value})
+
+    def validate(self, value, model_instance):
+        if isinstance(value, str):
+            self.parse(value)
+        super(JSONTextField, self).validate(value, model_instance)
+
+    def get_prep_value(self, value):
+        if isinstance(value, str):
+            value = self.parse(value)
+        return super(JSONTextField, self).get_prep_value(value)
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(expression, KeyTransform):
+            return super(JSONTextField, self).from_db_value(value, expression, connection)
+        if value is not None and not isinstance(value, str):
+            value = json.dumps(value)
+        return value
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **dict({'widget': forms.Textarea}, **kwargs))
+
+
 class ModelWithDataBlob (models.Model):
-    data = models.TextField(default='{}')
+    data = JSONTextField(default='{}')
 
     class Meta:
         abstract = True
@@ -75,6 +112,11 @@ class SubmittedThing (CloneableModelMixin, CacheClearingModel, ModelWithDataBlob
         db_table = 'sa_api_submittedthing'
 
     def index_values(self, indexes=None):
+        # Where the database can index the data blob directly, there are no
+        # IndexedValues to keep up to date.
+        if DataIndex.uses_expression_indexes(self._state.db):
+            return
+
         if indexes is None:
             indexes = self.dataset.indexes.all()
 
@@ -148,6 +190,16 @@ class DataSet (CloneableModelMixin, CacheClearingModel, models.Model):
             self._submissions = Submission.objects.filter(dataset=self)
         return self._submissions
 
+    # The snapshot of the dataset's keys, origins, groups and permissions
+    # that authentication and permission checks use, once it has been built.
+    auth_snapshot = None
+
+    def get_auth_snapshot(self):
+        if self.auth_snapshot is None:
+            from .data_permissions import DataSetAuthSnapshot
+            self.auth_snapshot = DataSetAuthSnapshot.from_dataset(self)
+        return self.auth_snapshot
+
     @utils.memo
     def get_key(self, key_string):
         for ds_key in self.keys.all():
@@ -163,6 +215,9 @@ class DataSet (CloneableModelMixin, CacheClearingModel, models.Model):
         return None
 
     def reindex(self):
+        if DataIndex.uses_expression_indexes(self._state.db):
+            return
+
         things = self.things.all()
         indexes = self.indexes.all()
 
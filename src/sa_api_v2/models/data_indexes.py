@@ -1,15 +1,71 @@
 import operator
 import ujson as json
-from django.db import models
+from datetime import datetime, time, timezone
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models.signals import post_migrate
+from django.utils.dateparse import parse_date, parse_datetime
 from .mixins import CloneableModelMixin
 from functools import reduce
 
 
+# Cast an attribute's text from a data blob to each index type, or to NULL if
+# it is not of the type. The casts do not depend on any session settings, so
+# they can be used in expression indexes. Each statement can be run again.
+CREATE_CAST_FUNCTIONS = (
+    '''
+    CREATE OR REPLACE FUNCTION sa_api_to_number(value text) RETURNS double precision AS $$
+    BEGIN
+        RETURN value::double precision;
+    EXCEPTION WHEN invalid_text_representation OR numeric_value_out_of_range THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE STRICT;
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION sa_api_to_boolean(value text) RETURNS boolean AS $$
+        SELECT CASE lower(value) WHEN 'true' THEN true WHEN 'false' THEN false END;
+    $$ LANGUAGE sql IMMUTABLE STRICT;
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION sa_api_to_datetime(value text) RETURNS timestamp with time zone AS $$
+    BEGIN
+        -- Only ISO 8601 dates and times, so that special values like 'now' are
+        -- never read as the time that the value was indexed.
+        IF value !~ '^\\d{4}-\\d{2}-\\d{2}' THEN
+            RETURN NULL;
+        END IF;
+        RETURN value::timestamp with time zone;
+    EXCEPTION WHEN invalid_datetime_format OR datetime_field_overflow OR invalid_text_representation THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE STRICT SET timezone = 'UTC';
+    ''',
+)
+
+DROP_CAST_FUNCTIONS = (
+    'DROP FUNCTION IF EXISTS sa_api_to_number(text);',
+    'DROP FUNCTION IF EXISTS sa_api_to_boolean(text);',
+    'DROP FUNCTION IF EXISTS sa_api_to_datetime(text);',
+)
+
+
 class DataIndex (CloneableModelMixin, models.Model):
     ATTR_TYPE_CHOICES = (
         ('string', 'String'),
+        ('number', 'Number'),
+        ('boolean', 'Boolean'),
+        ('datetime', 'Date/time'),
     )
 
+    # For each typed attribute, the database function that casts its text in
+    # the data blob to the type (see CREATE_CAST_FUNCTIONS), and the IndexedValue
+    # field that holds the typed value where the blob cannot be indexed.
+    ATTR_TYPE_CASTS = {
+        'number': ('sa_api_to_number', 'number_value'),
+        'boolean': ('sa_api_to_boolean', 'boolean_value'),
+        'datetime': ('sa_api_to_datetime', 'datetime_value'),
+    }
+
     dataset = models.ForeignKey('DataSet', on_delete=models.CASCADE, related_name='indexes')
     attr_name = models.CharField(max_length=100, db_index=True, verbose_name='Attribute name')
     attr_type = models.CharField(max_length=10, choices=ATTR_TYPE_CHOICES, default='string', verbose_name='Attribute type')
@@ -20,7 +76,128 @@ class DataIndex (CloneableModelMixin, models.Model):
     def __unicode__(self):
         return self.attr_name
 
+    @classmethod
+    def uses_expression_indexes(cls, using=None):
+        """
+        Whether indexed attributes are read straight out of the data blob
+        (with a database index on each one) instead of being copied into
+        IndexedValues.
+        """
+        return connections[using or DEFAULT_DB_ALIAS].vendor == 'postgresql'
+
+    @classmethod
+    def get_db_index_name(cls, index_id, typed=False):
+        return 'sa_api_dataindex_%s%s' % (index_id, '_typed' if typed else '')
+
+    def get_value_field_name(self):
+        return self.ATTR_TYPE_CASTS.get(self.attr_type, (None, 'value'))[1]
+
+    def get_value_expression(self):
+        """
+        The expression for the typed value of the indexed attribute in a
+        thing's data blob.
+        """
+        expression = DataAttributeText(self.attr_name)
+        if self.attr_type in self.ATTR_TYPE_CASTS:
+            function, field_name = self.ATTR_TYPE_CASTS[self.attr_type]
+            expression = models.Func(expression, function=function,
+                output_field=IndexedValue._meta.get_field(field_name))
+        return expression
+
+    def parse_value(self, value):
+        """
+        Convert an attribute value, from a data blob or a query string, to
+        the index's type. Returns None if the value is not of the type.
+        """
+        if self.attr_type == 'number':
+            if isinstance(value, bool):
+                return None
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+
+        elif self.attr_type == 'boolean':
+            if isinstance(value, bool):
+                return value
+            return {'true': True, 'false': False}.get(str(value).lower())
+
+        elif self.attr_type == 'datetime':
+            if not isinstance(value, str):
+                return None
+            try:
+                parsed = parse_datetime(value)
+                if parsed is None:
+                    parsed_date = parse_date(value)
+                    parsed = parsed_date and datetime.combine(parsed_date, time())
+            except ValueError:
+                return None
+            if parsed is not None and parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            return parsed
+
+        else:
+            return str(value)
+
+    @classmethod
+    def sync_db_index(cls, index_id, using=None):
+        """
+        Build the database index on the data attribute of the DataIndex with
+        the given id, or drop it if the DataIndex no longer exists. The index
+        is built concurrently, so this must not be run inside a transaction.
+        """
+        connection = connections[using or DEFAULT_DB_ALIAS]
+        index_names = [cls.get_db_index_name(index_id), cls.get_db_index_name(index_id, typed=True)]
+
+        with connection.cursor() as cursor:
+            try:
+                index = cls.objects.using(connection.alias).get(pk=index_id)
+            except cls.DoesNotExist:
+                for index_name in index_names:
+                    cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS %s' % connection.ops.quote_name(index_name))
+                return
+
+            # The attribute's text is always indexed, for equality filters. A
+            # typed attribute's value gets a second index, for comparisons
+            # and ordering.
+            things_table = connection.ops.quote_name(IndexedValue._meta.get_field('thing').related_model._meta.db_table)
+            params = [index.attr_name, index.dataset_id]
+            cls.replace_db_index(connection, cursor, index_names[0],
+                'ON %s ((data ->> %%s)) WHERE dataset_id = %%s' % things_table, params)
+
+            if index.attr_type in cls.ATTR_TYPE_CASTS:
+                function = cls.ATTR_TYPE_CASTS[index.attr_type][0]
+                cls.replace_db_index(connection, cursor, index_names[1],
+                    'ON %s (%s(data ->> %%s)) WHERE dataset_id = %%s' % (things_table, function), params)
+            else:
+                cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS %s' % connection.ops.quote_name(index_names[1]))
+
+    @classmethod
+    def replace_db_index(cls, connection, cursor, index_name, definition, params):
+        """
+        Build an index under a temporary name and then swap it in for any
+        existing index of the same name, so that queries always have one to
+        use.
+        """
+        new_index_name = connection.ops.quote_name(index_name + '_new')
+        index_name = connection.ops.quote_name(index_name)
+
+        # Clear away what is left of any earlier build that failed.
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS %s' % new_index_name)
+        cursor.execute('CREATE INDEX CONCURRENTLY %s %s' % (new_index_name, definition), params)
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS %s' % index_name)
+        cursor.execute('ALTER INDEX %s RENAME TO %s' % (new_index_name, index_name))
+
+    def queue_db_index_sync(self):
+        from .. import tasks
+
+        index_id = self.id
+        transaction.on_commit(lambda: tasks.sync_data_index.delay(index_id))
+
     def index_things(self):
+        if self.uses_expression_indexes(self._state.db):
+            return
+
         things = self.dataset.things.all()
         for thing in things:
             IndexedValue.objects.sync(thing, self)
@@ -30,10 +207,17 @@ class DataIndex (CloneableModelMixin, models.Model):
 
     def save(self, reindex=True, *args, **kwargs):
         ret = super(DataIndex, self).save(*args, **kwargs)
+        if self.uses_expression_indexes(self._state.db):
+            self.queue_db_index_sync()
         if reindex:
             self.index_things()
         return ret
 
+    def delete(self, *args, **kwargs):
+        if self.uses_expression_indexes(self._state.db):
+            self.queue_db_index_sync()
+        return super(DataIndex, self).delete(*args, **kwargs)
+
 
 class IndexedValueManager (models.Manager):
     def sync(self, thing, index, data=None):
@@ -48,8 +232,11 @@ class IndexedValueManager (models.Manager):
                 value = IndexedValue(thing_id=thing.id, index_id=index.id)
 
             new_indexable_value = str(data[index.attr_name])
-            if value.value != new_indexable_value:
+            typed_field_name = index.get_value_field_name()
+            new_typed_value = index.parse_value(data[index.attr_name])
+            if value.value != new_indexable_value or getattr(value, typed_field_name) != new_typed_value:
                 value.value = new_indexable_value
+                setattr(value, typed_field_name, new_typed_value)
                 value.save()
         else:
             # If there's no value and there was one previously indexed, get
@@ -62,15 +249,12 @@ class IndexedValue (models.Model):
     thing = models.ForeignKey('SubmittedThing', on_delete=models.CASCADE, related_name='indexed_values')
 
     value = models.CharField(max_length=100, null=True, db_index=True)
-    # TODO: This might be better as:
-    #
-    #   * string_value
-    #   * number_value
-    #   * boolean_value
-    #   * datetime_value
-    #
-    #   So that we can use the appropriate comparisons for each (i.e., less
-    #   than operates differently on strings than on numbers)
+
+    # The value of a typed index, so that comparisons work for the type (i.e.,
+    # less than operates differently on strings than on numbers)
+    number_value = models.FloatField(null=True, db_index=True)
+    boolean_value = models.BooleanField(null=True, db_index=True)
+    datetime_value = models.DateTimeField(null=True, db_index=True)
 
     objects = IndexedValueManager()
 
@@ -85,14 +269,96 @@ class IndexedValue (models.Model):
             raise KeyError('The thing %s has no data attribute %s' % (self.thing, self.index.attr_name))
 
 
+class DataAttributeText (models.Func):
+    """
+    The text of an attribute in a thing's data blob, i.e. ``data ->> 'attr'``
+    on PostgreSQL. This is the expression that each DataIndex's database
+    index is built on.
+    """
+    template = '(%(expressions)s ->> %%s)'
+    output_field = models.TextField()
+
+    def __init__(self, attr_name, expression='data'):
+        super(DataAttributeText, self).__init__(expression)
+        self.attr_name = attr_name
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super(DataAttributeText, self).as_sql(compiler, connection, **extra_context)
+        return sql, tuple(params) + (self.attr_name,)
+
+
 class FilterByIndexMixin (object):
     """
     Mixin for model managers of indexed models.
     """
     def filter_by_index(self, key, *values):
+        queryset = self.all()
+
+        # Compare against the attribute's text in the data blob, which the
+        # DataIndex's expression index covers.
+        if DataIndex.uses_expression_indexes(queryset.db):
+            alias = 'indexed_value_%s' % len(queryset.query.annotations)
+            return queryset\
+                .alias(**{alias: DataAttributeText(key)})\
+                .filter(**{alias + '__in': values})
+
         matches_any_values_clause = reduce(
             operator.or_,
             [models.Q(indexed_values__value=value) for value in values])
-        return self\
+        return queryset\
             .filter(indexed_values__index__attr_name=key)\
             .filter(matches_any_values_clause)
+
+    def filter_by_index_lookup(self, index, lookup, value):
+        """
+        Filter on a comparison (e.g., 'gt', 'lte' or 'in') between the typed
+        value of an indexed attribute and the given value.
+        """
+        queryset = self.all()
+
+        if DataIndex.uses_expression_indexes(queryset.db):
+            alias = 'indexed_value_%s' % len(queryset.query.annotations)
+            return queryset\
+                .alias(**{alias: index.get_value_expression()})\
+                .filter(**{'%s__%s' % (alias, lookup): value})
+
+        return queryset.filter(**{
+            'indexed_values__index': index,
+            'indexed_values__%s__%s' % (index.get_value_field_name(), lookup): value})
+
+    def order_by_index(self, index, descending=False):
+        """
+        Order by the typed value of an indexed attribute. Things without a
+        value for the attribute come last.
+        """
+        queryset = self.all()
+
+        if DataIndex.uses_expression_indexes(queryset.db):
+            value = index.get_value_expression()
+        else:
+            value = models.Subquery(IndexedValue.objects
+                .filter(thing=models.OuterRef('pk'), index=index)
+                .values(index.get_value_field_name())[:1])
+
+        return queryset.order_by(models.OrderBy(value, descending=descending, nulls_last=True), 'pk')
+
+
+def create_cast_functions(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Make sure that the cast functions for typed indexes exist after every
+    migrate, including when the tables are created without running the
+    migrations (e.g., with "migrate --run-syncdb", or in tests).
+    """
+    if sender.label != 'sa_api_v2':
+        return
+
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        for statement in CREATE_CAST_FUNCTIONS:
+            cursor.execute(statement)
+
+
+post_migrate.connect(create_cast_functions, dispatch_uid="data-index-create-cast-functions")
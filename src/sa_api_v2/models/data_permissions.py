@@ -25,6 +25,28 @@ class DataPermissionManager (models.Manager):
             priority=priority), bulk=False)
 
 
+# Bits of a permission mask. A permission allows an action if it has the
+# action's bit set, and allows it on protected data if it also has the
+# CAN_ACCESS_PROTECTED bit set.
+CAN_RETRIEVE = 1
+CAN_CREATE = 2
+CAN_UPDATE = 4
+CAN_DESTROY = 8
+CAN_ACCESS_PROTECTED = 16
+
+ACTION_MASKS = {
+    'retrieve': CAN_RETRIEVE,
+    'create': CAN_CREATE,
+    'update': CAN_UPDATE,
+    'destroy': CAN_DESTROY,
+}
+ALL_ACTIONS = CAN_RETRIEVE | CAN_CREATE | CAN_UPDATE | CAN_DESTROY
+
+# In a compiled policy, the action bits are repeated this far to the left for
+# actions that are allowed on protected data as well.
+PROTECTED_SHIFT = 4
+
+
 class DataPermission (CloneableModelMixin, CacheClearingModel, models.Model):
     """
     Rules for what permissions a given authentication method affords.
@@ -74,6 +96,16 @@ class DataPermission (CloneableModelMixin, CacheClearingModel, models.Model):
         else:
             return 'can not create, retrieve, update, or destroy ' + things + ' at all'
 
+    @property
+    def mask(self):
+        mask = 0
+        for action, action_mask in ACTION_MASKS.items():
+            if getattr(self, 'can_' + action):
+                mask |= action_mask
+        if self.can_access_protected:
+            mask |= CAN_ACCESS_PROTECTED
+        return mask
+
     def clear_instance_cache(self):
         return self.dataset.clear_instance_cache()
 
@@ -148,17 +180,177 @@ def create_data_permissions(sender, instance, created, **kwargs):
 post_save.connect(create_data_permissions, sender=DataSet, dispatch_uid="dataset-create-permissions")
 
 
+class Snapshot (object):
+    """
+    An immutable copy of the values that some check needs from a model
+    instance and its related objects. Snapshots are cheap to cache and to load
+    from the cache, since they hold no model instances or querysets.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s objects are immutable' % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s objects are immutable' % type(self).__name__)
+
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, ' '.join(
+            '%s=%r' % (name, getattr(self, name)) for name in self.__slots__))
+
+
+class PermissionSnapshot (Snapshot):
+    """
+    A data permission: the submission set that it applies to, and the mask of
+    what it allows.
+    """
+    __slots__ = ('submission_set', 'mask')
+
+    @classmethod
+    def from_permissions(cls, permissions):
+        return tuple(cls(permission.submission_set, permission.mask)
+                     for permission in permissions)
+
+
+class ApiKeySnapshot (Snapshot):
+    """
+    An API key, as a client of its dataset.
+    """
+    __slots__ = ('id', 'key', 'dataset_id', 'owner_username', 'permissions')
+
+
+class OriginSnapshot (Snapshot):
+    """
+    An allowed origin, as a client of its dataset.
+    """
+    __slots__ = ('id', 'pattern', 'dataset_id', 'owner_username', 'permissions')
+
+
+def get_client_principal(client):
+    """
+    Get the name that a key or origin has in a compiled policy.
+    """
+    if isinstance(client, ApiKeySnapshot) or hasattr(client, 'key'):
+        return ('key', client.id)
+    return ('origin', client.id)
+
+
+class DataPermissionPolicy (Snapshot):
+    """
+    All of a dataset's data permissions, compiled into a table. The table is
+    keyed by (principal, submission set), where the principal is "dataset" or
+    a ("key", id), ("origin", id) or ("group", id) pair, and holds the mask of
+    everything that the principal's permissions on the set allow.
+    """
+    __slots__ = ('table',)
+
+    @classmethod
+    def compile(cls, permissions_by_principal):
+        table = {}
+        for principal, permissions in permissions_by_principal:
+            for permission in permissions:
+                mask = permission.mask & ALL_ACTIONS
+                if permission.mask & CAN_ACCESS_PROTECTED:
+                    mask |= mask << PROTECTED_SHIFT
+
+                entry = (principal, permission.submission_set)
+                table[entry] = table.get(entry, 0) | mask
+        return cls(table)
+
+    def get_mask(self, principal, submission_set):
+        return (self.table.get((principal, submission_set), 0) |
+                self.table.get((principal, '*'), 0))
+
+    def allows(self, principals, do_action, submission_set, protected=False):
+        """
+        Check whether the permissions of any of the principals allow the
+        action on a submission set with the given name.
+        """
+        required_mask = ACTION_MASKS.get(do_action, 0)
+        if protected:
+            required_mask <<= PROTECTED_SHIFT
+
+        for principal in principals:
+            if self.get_mask(principal, submission_set) & required_mask:
+                return True
+        return False
+
+
+class DataSetAuthSnapshot (Snapshot):
+    """
+    Everything that authentication and data permission checks need to know
+    about a dataset: its owner, its keys (mapped from key strings) and
+    origins, and the compiled policy of its own, its clients' and its groups'
+    permissions.
+    """
+    __slots__ = ('id', 'slug', 'owner_id', 'keys', 'origins', 'policy')
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        owner_username = dataset.owner.username
+        keys = dict(
+            (key.key, ApiKeySnapshot(key.id, key.key, dataset.id, owner_username,
+                                     PermissionSnapshot.from_permissions(key.permissions.all())))
+            for key in dataset.keys.all())
+        origins = tuple(
+            OriginSnapshot(origin.id, origin.pattern, dataset.id, owner_username,
+                           PermissionSnapshot.from_permissions(origin.permissions.all()))
+            for origin in dataset.origins.all())
+
+        permissions_by_principal = [('dataset', dataset.permissions.all())]
+        permissions_by_principal.extend(
+            (get_client_principal(client), client.permissions)
+            for client in list(keys.values()) + list(origins))
+        permissions_by_principal.extend(
+            (('group', group.id), group.permissions.all())
+            for group in dataset.groups.all())
+
+        return cls(dataset.id, dataset.slug, dataset.owner_id, keys, origins,
+                   DataPermissionPolicy.compile(permissions_by_principal))
+
+    def get_key(self, key_string):
+        return self.keys.get(key_string)
+
+    def get_origin(self, origin_header, match):
+        for origin in self.origins:
+            if match(origin.pattern, origin_header):
+                return origin
+        return None
+
+
+def get_permissions(obj):
+    """
+    Get the data permissions of a key or origin, whether it is a model
+    instance or a snapshot.
+    """
+    if isinstance(obj, Snapshot):
+        return obj.permissions
+    return obj.permissions.all()
+
+
 def any_allow(permissions, do_action, submission_set, protected=False):
     """
     Check whether any of the data permissions in the managed set allow the
     action on a submission set with the given name. Specify whether the action
     is on protected data.
     """
+    required_mask = ACTION_MASKS.get(do_action, 0)
+    if not required_mask:
+        return False
+    if protected:
+        required_mask |= CAN_ACCESS_PROTECTED
+
     for permission in permissions:
         if (
             permission.submission_set in (submission_set, '*')
-            and getattr(permission, 'can_' + do_action, False)
-            and (permission.can_access_protected or not protected)
+            and permission.mask & required_mask == required_mask
         ):
             return True
     return False
@@ -176,19 +368,34 @@ def check_data_permission(user, client, do_action, dataset, submission_set, prot
     if user and user.is_superuser:
         return True
 
+    # Use the dataset's auth snapshot, if it has one, so that none of the
+    # permissions have to be loaded.
+    dataset = getattr(dataset, 'auth_snapshot', None) or dataset
+
     # Owner can do anything
     if user and dataset and user.id == dataset.owner_id:
         return True
 
+    # With a snapshot, just look up what the dataset, client and groups are
+    # allowed to do in the compiled policy.
+    if isinstance(dataset, DataSetAuthSnapshot):
+        principals = ['dataset']
+        if client is not None and client.dataset_id == dataset.id:
+            principals.append(get_client_principal(client))
+        if user is not None and user.is_authenticated:
+            principals.extend(('group', group.id) for group in user._groups.all()
+                              if group.dataset_id == dataset.id)
+        return dataset.policy.allows(principals, do_action, submission_set, protected)
+
     # Start with the dataset permission
-    if dataset and any_allow(dataset.permissions.all(), do_action, submission_set, protected):
+    if dataset and any_allow(get_permissions(dataset), do_action, submission_set, protected):
         return True
 
     # Then the client permission
     if client is not None:
         if (
-            client.dataset == dataset and
-            any_allow(client.permissions.all(), do_action, submission_set, protected)
+            dataset and client.dataset_id == dataset.id and
+            any_allow(get_permissions(client), do_action, submission_set, protected)
         ):
             return True
 
@@ -202,3 +409,33 @@ def check_data_permission(user, client, do_action, dataset, submission_set, prot
                 return True
 
     return False
+
+
+def check_request_data_permission(request, do_action, dataset, submission_set, protected=False):
+    """
+    Check whether the user and client of the request have permission on the
+    submission_set, as check_data_permission does. The decision is kept on
+    the request, since serializers check the same few submission sets again
+    for every object that they represent.
+    """
+    user = getattr(request, 'user', None)
+    client = getattr(request, 'client', None)
+
+    http_request = getattr(request, '_request', request)
+    try:
+        decisions = http_request.data_permission_decisions
+    except AttributeError:
+        decisions = http_request.data_permission_decisions = {}
+
+    decision_key = (
+        getattr(user, 'id', None),
+        type(client).__name__, getattr(client, 'id', None),
+        getattr(dataset, 'id', None),
+        do_action, submission_set, protected)
+
+    try:
+        return decisions[decision_key]
+    except KeyError:
+        decision = decisions[decision_key] = check_data_permission(
+            user, client, do_action, dataset, submission_set, protected)
+        return decision
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.signals import m2m_changed, post_save
 from django.contrib.auth.models import AbstractUser, UserManager
 from .caching import CacheClearingModel
 from .. import cache
@@ -106,12 +107,21 @@ class User (CacheClearingModel, AbstractUser):
     def get_groups(self):
         return self._groups.all().prefetch_related('permissions')
 
+    @utils.memo
+    def get_group_fingerprint(self, dataset_id):
+        """
+        Get a string that identifies the set of groups that the user belongs
+        to in the given dataset, e.g. for telling apart cached responses.
+        """
+        names = set(group.name for group in self._groups.all() if group.dataset_id == dataset_id)
+        return ','.join(sorted(names))
+
     class Meta:
         app_label = 'sa_api_v2'
         db_table = 'auth_user'
 
 
-class Group (CloneableModelMixin, models.Model):
+class Group (CloneableModelMixin, CacheClearingModel, models.Model):
     """
     A group of submitters within a dataset.
     """
@@ -119,6 +129,8 @@ class Group (CloneableModelMixin, models.Model):
     name = models.CharField(max_length=32, help_text='What is the name of the group to which users with this group belong? For example: "judges", "administrators", "winners", ...')
     submitters = models.ManyToManyField(User, related_name='_groups', blank=True)
 
+    cache = cache.GroupCache()
+
     class Meta:
         app_label = 'sa_api_v2'
         db_table = 'sa_api_group'
@@ -127,9 +139,53 @@ class Group (CloneableModelMixin, models.Model):
     def __unicode__(self):
         return '%s in %s' % (self.name, self.dataset.slug)
 
+    def clear_instance_cache(self):
+        # The group is part of its dataset's configuration, and of the
+        # information about each of its submitters, which all depend on the
+        # generation of the groups.
+        self.dataset.clear_instance_cache()
+        super(Group, self).clear_instance_cache()
+
     def clone_related(self, onto):
         for permission in self.permissions.all():
             permission.clone(overrides={'group': onto})
 
         for submitter in self.submitters.all():
             onto.submitters.add(submitter)
+
+
+def clear_group_membership_cache(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Clear the cached data for the groups and users on both sides of a change
+    in group membership.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    # Clearing all of a group's submitters changes the group as a whole.
+    if pk_set is None and not reverse:
+        instance.clear_instance_cache()
+        return
+
+    if pk_set is None:
+        related = instance._groups.all() if reverse else instance.submitters.all()
+    else:
+        related = model.objects.filter(pk__in=pk_set)
+
+    groups, users = (related, [instance]) if reverse else ([instance], related)
+    for group in groups:
+        group.dataset.clear_instance_cache()
+    for user in users:
+        user.clear_instance_cache()
+
+
+def clear_social_auth_cache(sender, instance, **kwargs):
+    """
+    Clear the cached data for a user when their social auth details change,
+    since their name and avatar come from them.
+    """
+    instance.user.clear_instance_cache()
+
+
+m2m_changed.connect(clear_group_membership_cache, sender=Group.submitters.through, dispatch_uid="group-membership-clear-cache")
+post_save.connect(clear_social_auth_cache, sender='social_django.UserSocialAuth', dispatch_uid="social-auth-clear-cache")
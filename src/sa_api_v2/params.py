@@ -9,6 +9,7 @@ DISTANCE_PARAM = 'distance_lt'
 BBOX_PARAM = 'bounds'
 FORMAT_PARAM = 'format'
 TEXTSEARCH_PARAM = 'search'
+ORDER_BY_PARAM = 'order_by'
 
 PAGE_PARAM = 'page'
 PAGE_SIZE_PARAM = lambda: getattr(settings, 'REST_FRAMEWORK', {}).get('PAGINATE_BY_PARAM')
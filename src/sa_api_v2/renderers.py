@@ -35,8 +35,20 @@ class JSONPRenderer (JSONRenderer):
         renderer_context = renderer_context or {}
         callback = self.get_callback(renderer_context)
         json = super(JSONPRenderer, self).render(data, accepted_media_type, renderer_context)
+        return self.wrap(json, callback)
+
+    def wrap(self, json, callback):
+        """
+        Wrap rendered json in a call to the callback function.
+        """
         return callback.encode(self.charset) + b'(' + json + b');'
 
+    def unwrap(self, content, callback):
+        """
+        Get the rendered json back out of content from `wrap`.
+        """
+        return content[len(callback.encode(self.charset)) + 1:-2]
+
 
 class PaginatedCSVRenderer (CSVRenderer):
     def render(self, data, media_type=None, renderer_context=None):
@@ -19,7 +19,7 @@ from rest_framework_bulk import serializers as bulk_serializers
 from . import apikey
 from . import cors
 from . import models
-from .models import check_data_permission
+from .models import check_request_data_permission
 from .params import (INCLUDE_INVISIBLE_PARAM, INCLUDE_PRIVATE_PARAM,
     INCLUDE_SUBMISSIONS_PARAM,)
 
@@ -81,7 +81,7 @@ class ShareaboutsFieldMixin (object):
         if isinstance(obj, models.User):
             instance_kwargs = {'owner_username': obj.username}
         else:
-            instance_kwargs = obj.cache.get_cached_instance_params(obj.pk, lambda: obj)
+            instance_kwargs = obj.cache.get_instance_params(obj)
 
         url_kwargs = {}
         for arg_name in self.url_arg_names:
@@ -673,10 +673,7 @@ class DataSetSubmissionSetSummarySerializer (serializers.HyperlinkedModelSeriali
         summaries = {}
         for set_name, submission_set in sets.items():
             # Ensure the user has read permission on the submission set.
-            user = getattr(request, 'user', None)
-            client = getattr(request, 'client', None)
-            dataset = obj
-            if not check_data_permission(user, client, 'retrieve', dataset, set_name):
+            if not check_request_data_permission(request, 'retrieve', obj, set_name):
                 continue
 
             obj.submission_set_name = set_name
@@ -779,10 +776,8 @@ class BasePlaceSerializer (SubmittedThingSerializer, serializers.ModelSerializer
         summaries = {}
         for set_name, submissions in submission_sets.items():
             # Ensure the user has read permission on the submission set.
-            user = getattr(request, 'user', None)
-            client = getattr(request, 'client', None)
             dataset = getattr(request, 'get_dataset', lambda: None)()
-            if not check_data_permission(user, client, 'retrieve', dataset, set_name):
+            if not check_request_data_permission(request, 'retrieve', dataset, set_name):
                 continue
 
             summaries[set_name] = self.summary_to_representation(set_name, submissions)
@@ -805,10 +800,8 @@ class BasePlaceSerializer (SubmittedThingSerializer, serializers.ModelSerializer
         details = {}
         for set_name, submissions in submission_sets.items():
             # Ensure the user has read permission on the submission set.
-            user = getattr(request, 'user', None)
-            client = getattr(request, 'client', None)
             dataset = getattr(request, 'get_dataset', lambda: None)()
-            if not check_data_permission(user, client, 'retrieve', dataset, set_name):
+            if not check_request_data_permission(request, 'retrieve', dataset, set_name):
                 continue
 
             # We know that the submission datasets will be the same as the place
@@ -1,14 +1,20 @@
 import requests
 from celery import shared_task
 from celery.result import AsyncResult
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core import cache as django_cache
 from django.db import transaction
 from django.test.client import RequestFactory
+from django.urls import resolve, Resolver404
 from django.utils.timezone import now
 from social_django.models import UserSocialAuth
-from .models import DataSnapshotRequest, DataSnapshot, DataSet, User, Place, Submission
+from .cache import cache_buffer, DataSetCache
+from .models import DataSnapshotRequest, DataSnapshot, DataSet, DataIndex, User, Place, Submission
 from .serializers import SimplePlaceSerializer, SimpleSubmissionSerializer, SimpleDataSetSerializer
 from .renderers import CSVRenderer, JSONRenderer, GeoJSONRenderer
 
+import json
 import logging
 log = logging.getLogger(__name__)
 
@@ -119,6 +125,100 @@ def clone_related_dataset_data(orig_dataset_id, new_dataset_id):
         orig_dataset.clone_related(onto=new_dataset)
 
 
+# =========================================================
+# Building data indexes
+#
+
+@shared_task
+def sync_data_index(index_id):
+    """
+    Build (or drop) the database index for a DataIndex's attribute. Indexes
+    are built concurrently, so they do not lock out writes to the things
+    table while they build.
+    """
+    DataIndex.sync_db_index(index_id)
+
+
+# =========================================================
+# Refreshing cached responses
+#
+
+# The only request headers that are kept for replaying a request. They choose
+# the format of the response; credentials are never replayed.
+REPLAYED_HEADERS = ('HTTP_ACCEPT', 'CONTENT_TYPE')
+
+
+def replay_cached_request(path, querystring, headers):
+    """
+    Make an anonymous GET request through the view stack, so that its
+    response is rebuilt and cached if it is not already.
+    """
+    cache_buffer.reset()
+
+    headers = dict((header, value) for header, value in headers.items()
+                   if header in REPLAYED_HEADERS)
+    request = RequestFactory().get(path, QUERY_STRING=querystring, **headers)
+    request.user = AnonymousUser()
+    request.is_cache_refresh = True
+
+    match = resolve(path)
+    response = match.func(request, *match.args, **match.kwargs)
+    if response.status_code != 200:
+        log.info('Could not rebuild the cached response for %s (status %s)', path, response.status_code)
+    return response
+
+
+@shared_task
+def refresh_cached_response(path, querystring, headers, stale_since_key=None):
+    """
+    Rebuild the cached response for a request, so that readers who are being
+    served an out-of-date response get the current one. If the request no
+    longer resolves (e.g., its dataset was renamed), the note of when the
+    response went out of date is cleared instead.
+    """
+    try:
+        replay_cached_request(path, querystring, headers)
+    except Resolver404:
+        log.info('Not refreshing the cache for %s, which no longer exists', path)
+        if stale_since_key is not None:
+            django_cache.cache.delete(stale_since_key)
+
+
+@shared_task
+def warm_cached_responses(owner_username, dataset_slug, count=None):
+    """
+    Rebuild the cached responses for a dataset's most popular requests, so
+    that the readers who make them after a change do not have to wait.
+    """
+    count = count or settings.API_CACHE_WARM_COUNT
+    hot_requests = DataSetCache().get_hot_requests(
+        count, owner_username=owner_username, dataset_slug=dataset_slug)
+
+    for request_info in hot_requests:
+        path, querystring, headers = json.loads(request_info)
+        try:
+            replay_cached_request(path, querystring, dict(headers))
+        except Resolver404:
+            log.info('Not warming the cache for %s, which no longer exists', path)
+
+    return len(hot_requests)
+
+
+@shared_task
+def invalidate_cache(invalidations):
+    """
+    Clear the cached data for instances that have changed. Each invalidation
+    is the name of a cache class, an instance's primary key, and the
+    instance's parameters.
+    """
+    from . import cache
+
+    cache_buffer.reset()
+    for cache_name, pk, params in invalidations:
+        getattr(cache, cache_name)().clear_instance_keys(pk, **params)
+    cache_buffer.flush()
+
+
 # =========================================================
 # Loading a dataset
 #
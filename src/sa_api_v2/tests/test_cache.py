@@ -0,0 +1,377 @@
+from django.core.cache import cache as django_cache
+from django.test import TestCase
+from mock import patch
+from ..cache import (CacheBuffer, CacheCodec, LocalCache, DataSetCache,
+    PlaceCache, SubmissionCache, UserCache, GroupCache, cache_buffer, local_instances,
+    get_structured_cache)
+from ..models import User, DataSet, Place, Submission, Group
+
+
+class TestCacheBufferSets (TestCase):
+    def setUp(self):
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def tearDown(self):
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def test_added_members_are_flushed_to_the_cache(self):
+        buf = CacheBuffer()
+        buf.add('things_keys', ['a', 'b'])
+        buf.add('things_keys', ['c'])
+        self.assertEqual(buf.members('things_keys'), set(['a', 'b', 'c']))
+
+        buf.flush()
+        self.assertEqual(get_structured_cache().smembers('things_keys'), set(['a', 'b', 'c']))
+
+    def test_removed_members_are_flushed_to_the_cache(self):
+        get_structured_cache().sadd('things_keys', ['a', 'b', 'c'])
+
+        buf = CacheBuffer()
+        buf.remove('things_keys', ['b'])
+        self.assertEqual(buf.members('things_keys'), set(['a', 'c']))
+
+        buf.flush()
+        self.assertEqual(get_structured_cache().smembers('things_keys'), set(['a', 'c']))
+
+    def test_additions_from_separate_buffers_are_not_lost(self):
+        buf1 = CacheBuffer()
+        buf2 = CacheBuffer()
+
+        # Both buffers read the set before either one writes to it.
+        self.assertEqual(buf1.members('things_keys'), set())
+        self.assertEqual(buf2.members('things_keys'), set())
+
+        buf1.add('things_keys', ['a'])
+        buf2.add('things_keys', ['b'])
+        buf1.flush()
+        buf2.flush()
+
+        self.assertEqual(get_structured_cache().smembers('things_keys'), set(['a', 'b']))
+
+    def test_has_member_checks_pending_changes(self):
+        get_structured_cache().sadd('things_keys', ['a'])
+
+        buf = CacheBuffer()
+        self.assertTrue(buf.has_member('things_keys', 'a'))
+        self.assertFalse(buf.has_member('things_keys', 'b'))
+
+        buf.add('things_keys', ['b'])
+        buf.remove('things_keys', ['a'])
+        self.assertTrue(buf.has_member('things_keys', 'b'))
+        self.assertFalse(buf.has_member('things_keys', 'a'))
+
+    def test_deleted_set_starts_fresh(self):
+        get_structured_cache().sadd('things_keys', ['a', 'b'])
+
+        buf = CacheBuffer()
+        buf.delete('things_keys')
+        buf.add('things_keys', ['c'])
+        self.assertEqual(buf.members('things_keys'), set(['c']))
+
+        buf.flush()
+        self.assertEqual(get_structured_cache().smembers('things_keys'), set(['c']))
+
+
+class TestLocalCache (TestCase):
+    def test_entry_is_returned_for_matching_version(self):
+        local = LocalCache(max_size=10, timeout=60)
+        local.set('a', 'value', 1)
+        self.assertEqual(local.get('a', 1), 'value')
+        self.assertIsNone(local.get('a', 2))
+
+        # The stale entry is dropped once it has been seen.
+        self.assertIsNone(local.get('a', 1))
+
+    def test_expired_entry_is_not_returned(self):
+        local = LocalCache(max_size=10, timeout=60)
+        with patch('sa_api_v2.cache.monotonic', return_value=100):
+            local.set('a', 'value', 1)
+        with patch('sa_api_v2.cache.monotonic', return_value=200):
+            self.assertIsNone(local.get('a', 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        local = LocalCache(max_size=2, timeout=60)
+        local.set('a', 'A', 1)
+        local.set('b', 'B', 1)
+        local.get('a', 1)
+        local.set('c', 'C', 1)
+
+        self.assertEqual(local.get('a', 1), 'A')
+        self.assertIsNone(local.get('b', 1))
+        self.assertEqual(local.get('c', 1), 'C')
+
+
+class TestDataSetInstanceCache (TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='aaron', password='123', email='abc@example.com')
+        self.dataset = DataSet.objects.create(slug='ds', owner=self.owner)
+        cache_buffer.reset()
+        django_cache.clear()
+        local_instances.clear()
+
+    def tearDown(self):
+        cache_buffer.reset()
+        django_cache.clear()
+        local_instances.clear()
+
+    def test_instance_is_served_from_process_memory(self):
+        ds_cache = DataSetCache()
+        ds_cache.set_instance(self.dataset, owner_username='aaron', dataset_slug='ds')
+        cache_buffer.flush()
+
+        with patch.object(cache_buffer, 'get', wraps=cache_buffer.get) as patched_get:
+            instance = ds_cache.get_instance(owner_username='aaron', dataset_slug='ds')
+        self.assertIs(instance, self.dataset)
+        self.assertEqual(patched_get.call_count, 0)
+
+    def test_instance_is_dropped_when_dataset_changes(self):
+        ds_cache = DataSetCache()
+        ds_cache.set_instance(self.dataset, owner_username='aaron', dataset_slug='ds')
+        cache_buffer.flush()
+
+        # Simulate a change made by another process.
+        get_structured_cache().incr_many([ds_cache.get_config_generation_key(owner_username='aaron', dataset_slug='ds')])
+        django_cache.delete(ds_cache.get_instance_key(owner_username='aaron', dataset_slug='ds'))
+
+        self.assertIsNone(ds_cache.get_instance(owner_username='aaron', dataset_slug='ds'))
+
+
+class TestHotRequests (TestCase):
+    def setUp(self):
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def tearDown(self):
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def test_most_frequent_requests_come_first(self):
+        ds_cache = DataSetCache()
+        for request_info in ['a', 'b', 'b', 'c', 'b', 'c']:
+            ds_cache.record_request(request_info, owner_username='aaron', dataset_slug='ds')
+        cache_buffer.flush()
+
+        self.assertEqual(ds_cache.get_hot_requests(2, owner_username='aaron', dataset_slug='ds'), ['b', 'c'])
+        self.assertEqual(ds_cache.get_hot_requests(2, owner_username='aaron', dataset_slug='ds2'), [])
+
+
+class TestDeferredInvalidation (TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='aaron', password='123', email='abc@example.com')
+        self.dataset = DataSet.objects.create(slug='ds', owner=self.owner)
+        self.place = Place.objects.create(dataset=self.dataset, geometry='POINT(2 3)')
+        cache_buffer.reset()
+        django_cache.clear()
+
+        self.generation_key = DataSetCache().get_data_generation_key(owner_username='aaron', dataset_slug='ds')
+        self.generation = cache_buffer.get_generations([self.generation_key])[0]
+        cache_buffer.reset()
+
+    def tearDown(self):
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def test_repeated_changes_are_invalidated_once(self):
+        with patch.object(PlaceCache, 'clear_instance_keys', autospec=True,
+                          side_effect=PlaceCache.clear_instance_keys) as clear_instance_keys:
+            self.place.save()
+            self.place.save()
+            cache_buffer.flush()
+
+        self.assertEqual(clear_instance_keys.call_count, 1)
+        self.assertEqual(django_cache.get(self.generation_key), self.generation + 1)
+
+    def test_generations_are_incremented_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.place.save()
+            cache_buffer.flush()
+            self.assertEqual(django_cache.get(self.generation_key), self.generation + 1)
+
+        self.assertEqual(django_cache.get(self.generation_key), self.generation + 2)
+
+    def test_invalidation_can_be_handed_off_to_a_worker(self):
+        from ..tasks import invalidate_cache
+
+        with self.settings(API_CACHE_INVALIDATE_ASYNC=True):
+            with patch('sa_api_v2.tasks.invalidate_cache.delay') as delay:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.place.save()
+                    cache_buffer.flush()
+
+            self.assertEqual(django_cache.get(self.generation_key), self.generation)
+            self.assertEqual(delay.call_count, 1)
+
+            invalidate_cache(*delay.call_args[0])
+            self.assertEqual(django_cache.get(self.generation_key), self.generation + 1)
+
+
+class TestInstanceParams (TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='aaron', password='123', email='abc@example.com')
+        self.dataset = DataSet.objects.create(slug='ds', owner=self.owner)
+        self.place = Place.objects.create(dataset=self.dataset, geometry='POINT(2 3)')
+        self.submission = Submission.objects.create(place=self.place, set_name='comments', dataset=self.dataset, data='{}')
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def tearDown(self):
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def test_params_do_not_query_related_objects_once_cached(self):
+        submission = Submission.objects.get(pk=self.submission.pk)
+        SubmissionCache().get_instance_params(submission)
+        cache_buffer.flush()
+
+        submission = Submission.objects.get(pk=self.submission.pk)
+        with self.assertNumQueries(0):
+            params = SubmissionCache().get_instance_params(submission)
+
+        self.assertEqual(params['owner_username'], 'aaron')
+        self.assertEqual(params['dataset_slug'], 'ds')
+        self.assertEqual(params['place_id'], self.place.pk)
+        self.assertEqual(params['submission_id'], self.submission.pk)
+        self.assertEqual(params['thing_id'], self.submission.pk)
+
+    def test_params_follow_a_renamed_dataset(self):
+        place_cache = PlaceCache()
+        place_cache.get_cached_instance_params(self.place.pk, lambda: self.place)
+        cache_buffer.flush()
+
+        self.dataset.slug = 'new-ds'
+        self.dataset.save()
+        cache_buffer.flush()
+
+        params = place_cache.get_cached_instance_params(self.place.pk, lambda: self.place)
+        self.assertEqual(params['dataset_slug'], 'new-ds')
+
+    def test_params_for_many_instances_are_fetched_at_once(self):
+        places = [self.place, Place.objects.create(dataset=self.dataset, geometry='POINT(3 4)')]
+        cache_buffer.reset()
+
+        place_cache = PlaceCache()
+        place_cache.get_instance_params(self.place)
+        cache_buffer.flush()
+
+        place_cache.prefetch_instance_params(places)
+        self.assertEqual(cache_buffer.round_trips, 1)
+
+
+class TestCacheCodec (TestCase):
+    def test_large_values_are_compressed(self):
+        codec = CacheCodec(serializer='pickle', compressor='zlib', min_compress_size=100)
+        value = (b'x' * 10000, 200, [('Content-Type', 'application/json')])
+
+        encoded = codec.encode(value)
+        self.assertLess(len(encoded), 1000)
+        self.assertEqual(codec.decode(encoded), value)
+
+    def test_small_values_are_not_compressed(self):
+        codec = CacheCodec(serializer='pickle', compressor='zlib', min_compress_size=100)
+        encoded = codec.encode('small')
+        self.assertEqual(encoded[len(codec.marker) + 1:len(codec.marker) + 2], b'-')
+        self.assertEqual(codec.decode(encoded), 'small')
+
+    def test_counters_and_unencoded_values_are_left_alone(self):
+        codec = CacheCodec()
+        self.assertEqual(codec.encode(42), 42)
+        self.assertEqual(codec.decode(42), 42)
+        self.assertEqual(codec.decode(b'raw bytes'), b'raw bytes')
+        self.assertEqual(codec.decode({'a': 1}), {'a': 1})
+
+
+class TestMissingInstances (TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='aaron', password='123', email='abc@example.com')
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def tearDown(self):
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def test_missing_dataset_is_forgotten_once_it_is_created(self):
+        ds_cache = DataSetCache()
+        ds_cache.set_missing(owner_username='aaron', dataset_slug='ds')
+        cache_buffer.flush()
+        self.assertTrue(ds_cache.is_missing(owner_username='aaron', dataset_slug='ds'))
+        self.assertFalse(ds_cache.is_missing(owner_username='aaron', dataset_slug='ds2'))
+
+        DataSet.objects.create(slug='ds', owner=self.owner)
+        cache_buffer.flush()
+        self.assertFalse(ds_cache.is_missing(owner_username='aaron', dataset_slug='ds'))
+
+    def test_nothing_is_remembered_without_a_timeout(self):
+        with self.settings(API_CACHE_NEGATIVE_TIMEOUT=0):
+            ds_cache = DataSetCache()
+            ds_cache.set_missing(owner_username='aaron', dataset_slug='ds')
+            cache_buffer.flush()
+            self.assertFalse(ds_cache.is_missing(owner_username='aaron', dataset_slug='ds'))
+
+
+class TestGroupInvalidation (TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='aaron', password='123', email='abc@example.com')
+        self.submitter = User.objects.create_user(username='mjumbe', password='456', email='123@example.com')
+        self.dataset = DataSet.objects.create(slug='ds', owner=self.owner)
+        self.group = Group.objects.create(dataset=self.dataset, name='judges')
+        cache_buffer.reset()
+        django_cache.clear()
+
+        self.user_generation_key = UserCache.get_user_generation_key(username='mjumbe')
+        self.config_generation_key = DataSetCache().get_config_generation_key(owner_username='aaron', dataset_slug='ds')
+        self.generations = cache_buffer.get_generations([self.user_generation_key, self.config_generation_key])
+        cache_buffer.reset()
+
+    def tearDown(self):
+        cache_buffer.reset()
+        django_cache.clear()
+
+    def test_membership_changes_clear_the_user_and_dataset(self):
+        self.group.submitters.add(self.submitter)
+        cache_buffer.flush()
+
+        self.assertEqual(django_cache.get(self.user_generation_key), self.generations[0] + 1)
+        self.assertEqual(django_cache.get(self.config_generation_key), self.generations[1] + 1)
+
+    def test_group_changes_clear_the_datasets_groups_generation_instead_of_each_user(self):
+        self.group.submitters.add(self.submitter)
+        cache_buffer.flush()
+        groups_generation_key = GroupCache.get_groups_generation_key(dataset_id=self.dataset.id)
+        groups_generation, = cache_buffer.get_generations([groups_generation_key])
+        user_generation = django_cache.get(self.user_generation_key)
+        cache_buffer.reset()
+
+        self.group.name = 'winners'
+        self.group.save()
+        cache_buffer.flush()
+
+        self.assertEqual(django_cache.get(groups_generation_key), groups_generation + 1)
+        self.assertEqual(django_cache.get(self.user_generation_key), user_generation)
+
+    def test_cached_user_instance_is_dropped_only_when_their_datasets_groups_change(self):
+        self.group.submitters.add(self.submitter)
+        other_dataset = DataSet.objects.create(slug='ds2', owner=self.owner)
+        other_group = Group.objects.create(dataset=other_dataset, name='judges')
+        cache_buffer.flush()
+        cache_buffer.reset()
+
+        submitter = User.objects.get(pk=self.submitter.pk)
+        UserCache.set_instance(submitter, user_id=submitter.id)
+        cache_buffer.flush()
+        cache_buffer.reset()
+
+        # A group in another dataset has nothing to do with the user.
+        other_group.name = 'winners'
+        other_group.save()
+        cache_buffer.flush()
+        cache_buffer.reset()
+        self.assertEqual(UserCache.get_instance(user_id=submitter.id), submitter)
+        cache_buffer.reset()
+
+        self.group.delete()
+        cache_buffer.flush()
+        cache_buffer.reset()
+        self.assertIsNone(UserCache.get_instance(user_id=submitter.id))
@@ -1,13 +1,21 @@
 import json
+import pickle
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from ..models import (Attachment, DataSet, User, Group, SubmittedThing, Action, Place, Submission,
-    DataSetPermission, check_data_permission, DataIndex, IndexedValue)
+    DataSetPermission, check_data_permission, DataIndex, IndexedValue,
+    DataSetAuthSnapshot, DataPermissionPolicy, PermissionSnapshot, CAN_RETRIEVE,
+    CAN_CREATE, CAN_ACCESS_PROTECTED, check_request_data_permission)
 from ..apikey.models import ApiKey
 from mock import patch
 
 
 import os.path
+import unittest
 FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures')
 
 
@@ -93,9 +101,38 @@ class TestSubmittedThing (TestCase):
         qs = Action.objects.all()
         self.assertEqual(qs.count(), 1)
 
+    def test_data_is_read_as_json_text(self):
+        st = SubmittedThing(dataset=self.dataset, data='{"key": "value", "count": 1}')
+        st.save()
+
+        st = SubmittedThing.objects.get(pk=st.pk)
+        self.assertEqual(json.loads(st.data), {'key': 'value', 'count': 1})
+        self.assertEqual(json.loads(SubmittedThing.objects.values_list('data', flat=True).get(pk=st.pk)),
+                         {'key': 'value', 'count': 1})
+
+        self.assertTrue(SubmittedThing.objects.filter(data__contains={'key': 'value'}).exists())
+        self.assertFalse(SubmittedThing.objects.filter(data__contains={'count': '1'}).exists())
+
+    def test_data_must_be_valid_json(self):
+        st = SubmittedThing(dataset=self.dataset, data='{"key": "value"')
+
+        # The column holds JSON, so text that is not JSON can't be saved.
+        with self.assertRaises(ValidationError):
+            SubmittedThing._meta.get_field('data').clean(st.data, st)
+        with self.assertRaises(ValidationError):
+            with transaction.atomic():
+                st.save()
+        self.assertEqual(SubmittedThing.objects.count(), 0)
+
 
 class TestDataIndexes (TestCase):
     def setUp(self):
+        # These tests cover indexing into IndexedValues, which is how indexes
+        # work where the database cannot index the data blob.
+        patcher = patch.object(DataIndex, 'uses_expression_indexes', return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         User.objects.all().delete()
 
         self.owner = User.objects.create(username='myuser')
@@ -155,6 +192,28 @@ class TestDataIndexes (TestCase):
         qs = self.dataset.things.filter_by_index('index2', '2')
         self.assertEqual(qs.count(), 2)
 
+    def test_user_can_compare_and_order_by_typed_indexed_values(self):
+        self.dataset.indexes.add(DataIndex(attr_name='votes', attr_type='number'), bulk=False)
+        self.dataset.indexes.add(DataIndex(attr_name='closed', attr_type='boolean'), bulk=False)
+
+        things = []
+        for data in ({'votes': 1, 'closed': True}, {'votes': 5, 'closed': 'false'}, {'votes': '10'}, {}):
+            thing = SubmittedThing(dataset=self.dataset, data=json.dumps(data))
+            thing.save()
+            things.append(thing)
+
+        votes = self.dataset.indexes.get(attr_name='votes')
+        closed = self.dataset.indexes.get(attr_name='closed')
+
+        qs = self.dataset.things.filter_by_index_lookup(votes, 'gt', 2)
+        self.assertEqual(set(qs.values_list('pk', flat=True)), set([things[1].pk, things[2].pk]))
+
+        qs = self.dataset.things.filter_by_index_lookup(closed, 'in', [False])
+        self.assertEqual(list(qs.values_list('pk', flat=True)), [things[1].pk])
+
+        qs = self.dataset.things.order_by_index(votes, descending=True)
+        self.assertEqual(list(qs.values_list('pk', flat=True)), [things[2].pk, things[1].pk, things[0].pk, things[3].pk])
+
     def test_get_returns_the_true_value_of_an_indexed_value(self):
         st1 = SubmittedThing(dataset=self.dataset)
         st1.data = '{"index1": "value1", "index2": 2, "freetext": "This is an unindexed value."}'
@@ -229,6 +288,63 @@ class TestDataIndexes (TestCase):
         self.assertEqual(IndexedValue.objects.all().count(), num_indexed_values - 1)
 
 
+@unittest.skipUnless(DataIndex.uses_expression_indexes(), 'The database cannot index the data blob')
+class TestDataIndexExpressions (TestCase):
+    def setUp(self):
+        User.objects.all().delete()
+
+        self.owner = User.objects.create(username='myuser')
+        self.dataset = DataSet.objects.create(slug='data',
+                                              owner_id=self.owner.id)
+
+    def test_indexed_values_are_not_copied_when_thing_is_saved(self):
+        self.dataset.indexes.add(DataIndex(attr_name='index1'), bulk=False)
+
+        st1 = SubmittedThing(dataset=self.dataset)
+        st1.data = '{"index1": "value1", "freetext": "This is an unindexed value."}'
+        st1.save()
+
+        self.assertEqual(IndexedValue.objects.filter(index__dataset=self.dataset).count(), 0)
+
+    def test_user_can_query_by_indexed_value(self):
+        st1 = SubmittedThing(dataset=self.dataset)
+        st1.data = '{"index1": "value1", "index2": 2, "somefreetext": "This is an unindexed value."}'
+        st1.save()
+
+        st2 = SubmittedThing(dataset=self.dataset)
+        st2.data = '{"index1": "value_not1", "index2": "2", "morefreetext": "This is an unindexed value."}'
+        st2.save()
+
+        st3 = SubmittedThing(dataset=DataSet.objects.create(slug='temp-dataset', owner=self.owner))
+        st3.data = '{"index1": "value1", "index2": 2}'
+        st3.save()
+
+        self.dataset.indexes.add(DataIndex(attr_name='index1'), bulk=False)
+        self.dataset.indexes.add(DataIndex(attr_name='index2'), bulk=False)
+
+        qs = self.dataset.things.filter_by_index('index1', 'value1')
+        self.assertEqual(qs.count(), 1)
+        self.assertEqual(json.loads(qs[0].data)['index1'], 'value1')
+
+        qs = self.dataset.things.filter_by_index('index2', '2')
+        self.assertEqual(qs.count(), 2)
+
+        qs = self.dataset.things.filter_by_index('index1', 'value1', 'value_not1')
+        self.assertEqual(qs.count(), 2)
+
+    def test_index_changes_queue_a_database_index_sync(self):
+        index = DataIndex(attr_name='index1', dataset=self.dataset)
+
+        with patch('sa_api_v2.tasks.sync_data_index.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                index.save()
+            index_id = index.id
+            with self.captureOnCommitCallbacks(execute=True):
+                index.delete()
+
+        self.assertEqual([call[0] for call in delay.call_args_list], [(index_id,), (index_id,)])
+
+
 class CloningTests (TestCase):
     def clear_objects(self):
         # This should cascade to everything else.
@@ -561,6 +677,70 @@ class DataPermissionTests (TestCase):
             check_data_permission(user, None, 'retrieve', dataset, 'comments')
             self.assertEqual(any_allow.call_args[0][2], 'comments')
 
+    def test_auth_snapshot_gives_the_same_answers(self):
+        owner = User.objects.create(username='myowner')
+        user = User.objects.create(username='myuser')
+        dataset = DataSet.objects.create(slug='data', owner_id=owner.id)
+        key = ApiKey.objects.create(key='abc', dataset=dataset)
+
+        group = Group.objects.create(dataset=dataset, name='judges')
+        group.permissions.add_permission('comments', True, True, True, True, True)
+        group.submitters.add(user)
+
+        perm = dataset.permissions.all().get()
+        perm.submission_set = 'comments'
+        perm.save()
+
+        snapshot = pickle.loads(pickle.dumps(DataSetAuthSnapshot.from_dataset(dataset)))
+        self.assertEqual(snapshot.get_key('abc').id, key.id)
+        self.assertIsNone(snapshot.get_key('xyz'))
+
+        user = User.objects.get(pk=user.pk)
+        key_snapshot = snapshot.get_key('abc')
+        for do_action in ('retrieve', 'create', 'update', 'destroy'):
+            for submission_set in ('comments', 'places'):
+                for protected in (False, True):
+                    for check_user, client, client_snapshot in ((None, None, None), (None, key, key_snapshot), (user, None, None)):
+                        self.assertEqual(
+                            check_data_permission(check_user, client_snapshot, do_action, snapshot, submission_set, protected),
+                            check_data_permission(check_user, client, do_action, dataset, submission_set, protected))
+
+    def test_policy_keeps_protected_access_with_its_permission(self):
+        policy = DataPermissionPolicy.compile([
+            ('dataset', [PermissionSnapshot('comments', CAN_RETRIEVE),
+                         PermissionSnapshot('*', CAN_CREATE | CAN_ACCESS_PROTECTED)]),
+        ])
+
+        self.assertTrue(policy.allows(['dataset'], 'retrieve', 'comments'))
+        self.assertFalse(policy.allows(['dataset'], 'retrieve', 'comments', protected=True))
+        self.assertTrue(policy.allows(['dataset'], 'create', 'places', protected=True))
+        self.assertFalse(policy.allows(['dataset'], 'retrieve', 'places'))
+        self.assertFalse(policy.allows([('group', 1)], 'create', 'places'))
+
+    def test_auth_snapshot_is_immutable(self):
+        owner = User.objects.create(username='myowner')
+        dataset = DataSet.objects.create(slug='data', owner_id=owner.id)
+        snapshot = dataset.get_auth_snapshot()
+
+        with self.assertRaises(AttributeError):
+            snapshot.slug = 'other'
+
+    def test_request_decisions_are_remembered(self):
+        owner = User.objects.create(username='myowner')
+        dataset = DataSet.objects.create(slug='data', owner_id=owner.id)
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request.client = None
+
+        with patch('sa_api_v2.models.data_permissions.check_data_permission', return_value=True) as check:
+            for _ in range(3):
+                self.assertTrue(check_request_data_permission(request, 'retrieve', dataset, 'comments'))
+            self.assertEqual(check.call_count, 1)
+
+            check_request_data_permission(request, 'retrieve', dataset, 'comments', protected=True)
+            check_request_data_permission(request, 'create', dataset, 'comments')
+            self.assertEqual(check.call_count, 3)
+
 
 # More permissions tests to write:
 # - General client permission allows reading and restricts writing
@@ -8,15 +8,18 @@ from django.contrib.auth.models import AnonymousUser
 from django.contrib.gis import geos
 import base64
 import csv
+import gzip
 import json
 import mock
+import time
 import unittest
 from io import StringIO
-from ..models import User, DataSet, Place, Submission, Attachment, Action, Group, DataIndex
+from ..models import User, DataSet, Place, Submission, Attachment, Action, Group, DataIndex, OriginSnapshot, ApiKeySnapshot
 from ..cache import cache_buffer
 from ..apikey.models import ApiKey
-from ..apikey.auth import KEY_HEADER
+from ..apikey.auth import KEY_HEADER, check_api_authorization
 from ..cors.models import Origin
+from ..cors.auth import OriginAuthentication
 from ..views import (PlaceInstanceView, PlaceListView, SubmissionInstanceView,
     SubmissionListView, DataSetSubmissionListView, DataSetInstanceView,
     DataSetListView, AttachmentListView, ActionListView)
@@ -253,6 +256,7 @@ class TestPlaceInstanceView (APITestMixin, TestCase):
         # Create a dummy view instance so that we can call get_cache_key
         temp_view = PlaceInstanceView()
         temp_view.request = request
+        temp_view.kwargs = self.request_kwargs
 
         # Check that the response is cached
         cache_key = temp_view.get_cache_key(request)
@@ -527,6 +531,153 @@ class TestPlaceInstanceView (APITestMixin, TestCase):
             response = self.view(request, **self.request_kwargs)
             self.assertStatusCode(response, 200)
 
+    def test_GET_from_cache_does_not_render_again(self):
+        request = self.factory.get(self.path)
+        response = self.view(request, **self.request_kwargs)
+        initial_content = response.rendered_content
+
+        # A cache hit should send the rendered content as is.
+        request = self.factory.get(self.path)
+        with mock.patch('sa_api_v2.renderers.GeoJSONRenderer.render') as patched_render:
+            response = self.view(request, **self.request_kwargs)
+            self.assertStatusCode(response, 200)
+
+        self.assertEqual(patched_render.call_count, 0)
+        self.assertEqual(response.content, initial_content)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_GET_from_cache_makes_few_cache_round_trips(self):
+        request = self.factory.get(self.path)
+        self.view(request, **self.request_kwargs)
+
+        round_trips = []
+        flush = cache_buffer.flush
+
+        def counting_flush():
+            round_trips.append(cache_buffer.round_trips)
+            flush()
+
+        request = self.factory.get(self.path)
+        with mock.patch.object(cache_buffer, 'flush', side_effect=counting_flush):
+            response = self.view(request, **self.request_kwargs)
+            self.assertStatusCode(response, 200)
+
+        # One read for the generations, and one for the response
+        self.assertEqual(round_trips, [2])
+
+    def test_GET_waits_for_concurrent_rebuild(self):
+        request = self.factory.get(self.path)
+        response = self.view(request, **self.request_kwargs)
+        initial_content = response.rendered_content
+
+        temp_view = PlaceInstanceView()
+        temp_view.request = request
+        temp_view.kwargs = self.request_kwargs
+        cache_key = temp_view.get_cache_key(request)
+        cache_buffer.reset()
+
+        # Pretend that the response has not been cached yet, and that some
+        # other worker is busy building it.
+        cached_response = django_cache.get(cache_key)
+        django_cache.delete(cache_key)
+        django_cache.set(cache_key + ':lock', 'some other token', 60)
+
+        def finish_rebuild(seconds):
+            django_cache.set(cache_key, cached_response, 60)
+
+        # The request should use the other worker's response instead of
+        # building its own.
+        with mock.patch('time.sleep', side_effect=finish_rebuild):
+            with self.assertNumQueries(0):
+                response = self.view(request, **self.request_kwargs)
+                self.assertStatusCode(response, 200)
+
+        self.assertEqual(response.rendered_content, initial_content)
+
+    def test_GET_from_cache_sends_gzipped_body_as_is(self):
+        with self.settings(API_CACHE_GZIP_MIN_SIZE=0):
+            request = self.factory.get(self.path)
+            response = self.view(request, **self.request_kwargs)
+            initial_content = response.rendered_content
+
+            request = self.factory.get(self.path, HTTP_ACCEPT_ENCODING='gzip, deflate')
+            with self.assertNumQueries(0):
+                gzipped_response = self.view(request, **self.request_kwargs)
+            self.assertEqual(gzipped_response['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', gzipped_response['Vary'])
+            self.assertEqual(gzip.decompress(gzipped_response.content), initial_content)
+
+            # Clients that do not accept gzip get the plain body.
+            request = self.factory.get(self.path)
+            plain_response = self.view(request, **self.request_kwargs)
+            self.assertFalse(plain_response.has_header('Content-Encoding'))
+            self.assertEqual(plain_response.content, initial_content)
+
+    def test_GET_unknown_place_is_remembered_as_missing(self):
+        missing_kwargs = dict(self.request_kwargs, place_id=str(self.invisible_place.id + 1000))
+        missing_path = reverse('place-detail', kwargs=missing_kwargs)
+
+        request = self.factory.get(missing_path)
+        response = self.view(request, **missing_kwargs)
+        self.assertStatusCode(response, 404)
+
+        # The database is not asked about the place again.
+        request = self.factory.get(missing_path)
+        with mock.patch.object(PlaceInstanceView, 'get_object_or_404') as get_object_or_404:
+            response = self.view(request, **missing_kwargs)
+        self.assertStatusCode(response, 404)
+        self.assertEqual(get_object_or_404.call_count, 0)
+
+    def test_GET_from_cache_wraps_json_in_each_callback(self):
+        request = self.factory.get(self.path + '?callback=first')
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+        self.assertTrue(response.content.startswith(b'first('))
+
+        # A different callback name uses the same cached json.
+        request = self.factory.get(self.path + '?callback=second')
+        with self.assertNumQueries(0):
+            second_response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(second_response, 200)
+        self.assertEqual(second_response.content, b'second(' + response.content[len(b'first('):])
+        self.assertNotEqual(second_response['ETag'], response['ETag'])
+
+    def test_GET_with_matching_etag_is_not_modified(self):
+        request = self.factory.get(self.path)
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+        # A client that already has the current content gets a 304 without
+        # the content being built again.
+        request = self.factory.get(self.path, HTTP_IF_NONE_MATCH=response['ETag'])
+        with self.assertNumQueries(0):
+            not_modified_response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(not_modified_response, 304)
+        self.assertEqual(not_modified_response['ETag'], response['ETag'])
+
+        # After a change, the client should get the new content.
+        self.place.data = json.dumps({'type': 'ATM', 'name': 'Walmart'})
+        self.place.save()
+        cache_buffer.flush()
+
+        request = self.factory.get(self.path, HTTP_IF_NONE_MATCH=response['ETag'])
+        changed_response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(changed_response, 200)
+        self.assertNotEqual(changed_response['ETag'], response['ETag'])
+
+    def test_GET_with_only_if_modified_since_is_not_a_304(self):
+        request = self.factory.get(self.path)
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+
+        # The view cannot tell whether anything changed since a date (e.g.,
+        # a deleted submission), so it always sends the content.
+        request = self.factory.get(self.path, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+
     def test_GET_from_cache_with_api_key(self):
         # Modify the dataset permissions
         ds_perm = self.dataset.permissions.all()[0]
@@ -1127,6 +1278,25 @@ class TestPlaceListView (APITestMixin, TestCase):
         self.assertStatusCode(response, 200)
         self.assertEqual(len(data['features']), 0)
 
+    def test_GET_filtered_response_with_and_without_containment(self):
+        Place.objects.create(dataset=self.dataset, geometry='POINT(0 0)', data=json.dumps({'foo': 'bar', 'name': 1})),
+        Place.objects.create(dataset=self.dataset, geometry='POINT(1 0)', data=json.dumps({'foo': 'bar', 'name': 2})),
+        Place.objects.create(dataset=self.dataset, geometry='POINT(2 0)', data=json.dumps({'foo': 'baz', 'name': 3})),
+        Place.objects.create(dataset=self.dataset, geometry='POINT(3 0)', data=json.dumps({'name': 4})),
+
+        from sa_api_v2.views.base_views import FilteredResourceMixin
+        for can_use_containment in (True, False):
+            cache_buffer.reset()
+            django_cache.clear()
+            with mock.patch.object(FilteredResourceMixin, 'can_filter_data_by_containment', return_value=can_use_containment):
+                for query, expected_count in (('?foo=bar', 2), ('?foo=bar&foo=baz', 3), ('?name=1', 0), ('?nonexistent=foo', 0), ('?save=x', 0)):
+                    request = self.factory.get(self.path + query)
+                    response = self.view(request, **self.request_kwargs)
+                    data = json.loads(response.rendered_content)
+
+                    self.assertStatusCode(response, 200)
+                    self.assertEqual(len(data['features']), expected_count)
+
     def test_GET_indexed_response(self):
         Place.objects.create(dataset=self.dataset, geometry='POINT(0 0)', data=json.dumps({'foo': 'bar', 'name': 1})),
         Place.objects.create(dataset=self.dataset, geometry='POINT(1 0)', data=json.dumps({'foo': 'bar', 'name': 2})),
@@ -1143,6 +1313,36 @@ class TestPlaceListView (APITestMixin, TestCase):
             self.view(request, **self.request_kwargs)
             self.assertEqual(patched_filter.call_count, 1)
 
+    def test_GET_compared_and_ordered_by_typed_index(self):
+        Place.objects.create(dataset=self.dataset, geometry='POINT(0 0)', data=json.dumps({'votes': 1})),
+        Place.objects.create(dataset=self.dataset, geometry='POINT(1 0)', data=json.dumps({'votes': 5})),
+        Place.objects.create(dataset=self.dataset, geometry='POINT(2 0)', data=json.dumps({'votes': '10'})),
+        Place.objects.create(dataset=self.dataset, geometry='POINT(3 0)', data=json.dumps({'name': 4})),
+
+        self.dataset.indexes.add(DataIndex(attr_name='votes', attr_type='number'), bulk=False)
+
+        request = self.factory.get(self.path + '?votes__gt=2&order_by=-votes')
+        response = self.view(request, **self.request_kwargs)
+        data = json.loads(response.rendered_content)
+
+        self.assertStatusCode(response, 200)
+        self.assertEqual([feature['properties']['votes'] for feature in data['features']], ['10', 5])
+
+        request = self.factory.get(self.path + '?votes__in=1,10&order_by=votes')
+        response = self.view(request, **self.request_kwargs)
+        data = json.loads(response.rendered_content)
+
+        self.assertStatusCode(response, 200)
+        self.assertEqual([feature['properties']['votes'] for feature in data['features']], [1, '10'])
+
+        request = self.factory.get(self.path + '?votes__gt=many')
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 400)
+
+        request = self.factory.get(self.path + '?order_by=name')
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 400)
+
     def test_GET_unindexed_response(self):
         Place.objects.create(dataset=self.dataset, geometry='POINT(0 0)', data=json.dumps({'foo': 'bar', 'name': 1})),
         Place.objects.create(dataset=self.dataset, geometry='POINT(1 0)', data=json.dumps({'foo': 'bar', 'name': 2})),
@@ -1773,6 +1973,49 @@ class TestPlaceListView (APITestMixin, TestCase):
         # Check that the request was successful
         self.assertStatusCode(response, 201)
 
+    def test_POST_response_with_origin_auth_snapshot(self):
+        place_data = json.dumps({
+            'properties': {
+                'submitter_name': 'Andy',
+                'type': 'Park Bench',
+            },
+            'type': 'Feature',
+            'geometry': {"type": "Point", "coordinates": [-73.99, 40.75]}
+        })
+
+        client, _ = OriginAuthentication().check_origin_permission(self.ds_origin.pattern, self.dataset)
+        self.assertIsInstance(client, OriginSnapshot)
+        self.assertEqual(client.owner_username, self.owner.username)
+
+        request = self.factory.post(self.path, data=place_data, content_type='application/json')
+        request.META['HTTP_ORIGIN'] = self.ds_origin.pattern
+        response = self.view(request, **self.request_kwargs)
+
+        self.assertStatusCode(response, 201)
+
+    def test_POST_response_with_apikey_auth_snapshot(self):
+        place_data = json.dumps({
+            'properties': {
+                'submitter_name': 'Andy',
+                'type': 'Park Bench',
+            },
+            'type': 'Feature',
+            'geometry': {"type": "Point", "coordinates": [-73.99, 40.75]}
+        })
+
+        request = self.factory.post(self.path, data=place_data, content_type='application/json')
+        request.META[KEY_HEADER] = self.apikey.key
+        request.get_dataset = lambda: self.dataset
+        client, _ = check_api_authorization(request)
+        self.assertIsInstance(client, ApiKeySnapshot)
+        self.assertEqual(client.owner_username, self.owner.username)
+
+        request = self.factory.post(self.path, data=place_data, content_type='application/json')
+        request.META[KEY_HEADER] = self.apikey.key
+        response = self.view(request, **self.request_kwargs)
+
+        self.assertStatusCode(response, 201)
+
     def test_model_update_clears_GET_cache_for_multiple_specific_objects(self):
         places = []
         for _ in range(10):
@@ -1841,6 +2084,216 @@ class TestPlaceListView (APITestMixin, TestCase):
         with self.assertNumQueries(6):
             view(request, **request_kwargs)
 
+    def test_GET_equivalent_requests_from_cache(self):
+        request = self.factory.get(self.path + '?type=ATM&name=K-Mart&_=1234', HTTP_ACCEPT='application/json')
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+
+        # The same parameters in a different order, repeated, and with a
+        # different Accept header that selects the same renderer should get
+        # the same cached response.
+        request = self.factory.get(self.path + '?name=K-Mart&type=ATM&type=ATM', HTTP_ACCEPT='application/json, text/plain, */*')
+        with self.assertNumQueries(0):
+            cached_response = self.view(request, **self.request_kwargs)
+            self.assertStatusCode(cached_response, 200)
+
+        self.assertEqual(cached_response.rendered_content, response.rendered_content)
+
+        # Any other parameter may be a filter on the data, so it gets its own
+        # entry.
+        request = self.factory.get(self.path + '?type=ATM&name=K-Mart&color=red', HTTP_ACCEPT='application/json')
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+        self.assertNotEqual(response.rendered_content, cached_response.rendered_content)
+
+    def test_GET_records_cache_stats(self):
+        from ..cache import cache_stats
+        from ..views import CacheStatsView, CacheMetricsView
+
+        with self.settings(API_CACHE_STATS=True):
+            for _ in range(3):
+                request = self.factory.get(self.path)
+                self.view(request, **self.request_kwargs)
+
+        stats = cache_stats.get_stats()
+        view_stats = stats['views']['PlaceListView']
+        self.assertEqual(view_stats['misses'], 1)
+        self.assertEqual(view_stats['hits'], 2)
+        self.assertEqual(view_stats['rebuild_seconds']['count'], 1)
+        self.assertEqual(view_stats['size_bytes']['count'], 1)
+        self.assertEqual(stats['datasets']['aaron/ds']['hits'], 2)
+
+        # The stats are only available to superusers.
+        request = self.factory.get('/api/v2/~/cache/stats')
+        request.user = self.owner
+        response = CacheStatsView.as_view()(request)
+        self.assertStatusCode(response, 403)
+
+        admin = User.objects.create_superuser(username='admin', password='123', email='admin@example.com')
+        request = self.factory.get('/api/v2/~/cache/metrics')
+        request.user = admin
+        response = CacheMetricsView.as_view()(request)
+        self.assertStatusCode(response, 200)
+        self.assertIn(b'shareabouts_cache_hits_total{view="PlaceListView"} 2', response.content)
+        self.assertIn(b'shareabouts_cache_rebuild_seconds_count{dataset="aaron/ds"} 1', response.content)
+
+    @mock.patch('sa_api_v2.tasks.refresh_cached_response.delay')
+    def test_GET_serves_stale_response_while_refreshing(self, refresh):
+        request = self.factory.get(self.path)
+        self.view(request, **self.request_kwargs)
+
+        self.place.data = json.dumps({'type': 'ATM', 'name': 'Target'})
+        self.place.save()
+        cache_buffer.flush()
+
+        # Without a maximum staleness, the changed place shows up right away.
+        request = self.factory.get(self.path)
+        response = self.view(request, **self.request_kwargs)
+        self.assertIn(b'Target', response.rendered_content)
+        self.assertEqual(refresh.call_count, 0)
+
+        self.place.data = json.dumps({'type': 'ATM', 'name': 'Costco'})
+        self.place.save()
+        cache_buffer.flush()
+
+        # With one, the previous response is served, and only one refresh is
+        # scheduled.
+        with self.settings(API_CACHE_MAX_STALENESS={'PlaceListView': 10}):
+            request = self.factory.get(self.path)
+            response = self.view(request, **self.request_kwargs)
+            stale_content = response.rendered_content
+            self.assertIn(b'Costco', stale_content)
+
+            self.place.data = json.dumps({'type': 'ATM', 'name': 'Sears'})
+            self.place.save()
+            cache_buffer.flush()
+
+            for _ in range(2):
+                request = self.factory.get(self.path)
+                with self.assertNumQueries(0):
+                    response = self.view(request, **self.request_kwargs)
+                self.assertEqual(response.rendered_content, stale_content)
+            self.assertEqual(refresh.call_count, 1)
+
+            # The refresh rebuilds the current response.
+            path, querystring, headers = refresh.call_args[0]
+            from ..tasks import refresh_cached_response
+            refresh_cached_response(path, querystring, headers)
+
+            request = self.factory.get(self.path)
+            with self.assertNumQueries(0):
+                response = self.view(request, **self.request_kwargs)
+            self.assertIn(b'Sears', response.rendered_content)
+
+    @mock.patch('sa_api_v2.tasks.refresh_cached_response.delay')
+    def test_GET_stops_serving_stale_response_when_refresh_fails(self, refresh):
+        with self.settings(API_CACHE_MAX_STALENESS={'PlaceListView': 10}):
+            request = self.factory.get(self.path)
+            self.view(request, **self.request_kwargs)
+
+            # The refreshes never run, and further changes do not extend the
+            # time that the first response may be served for.
+            for name in ('Target', 'Costco'):
+                self.place.data = json.dumps({'type': 'ATM', 'name': name})
+                self.place.save()
+                cache_buffer.flush()
+
+                request = self.factory.get(self.path)
+                response = self.view(request, **self.request_kwargs)
+                self.assertNotIn(name.encode(), response.rendered_content)
+            self.assertEqual(refresh.call_count, 2)
+
+            # Past the maximum staleness, the response is rebuilt right away.
+            later = time.time() + 11
+            with mock.patch('sa_api_v2.views.base_views.time.time', return_value=later):
+                request = self.factory.get(self.path)
+                response = self.view(request, **self.request_kwargs)
+            self.assertIn(b'Costco', response.rendered_content)
+
+    @mock.patch('sa_api_v2.tasks.refresh_cached_response.delay')
+    def test_refresh_of_a_path_that_no_longer_resolves_clears_the_stale_note(self, refresh):
+        with self.settings(API_CACHE_MAX_STALENESS={'PlaceListView': 10}):
+            request = self.factory.get(self.path)
+            self.view(request, **self.request_kwargs)
+
+            self.place.data = json.dumps({'type': 'ATM', 'name': 'Target'})
+            self.place.save()
+            cache_buffer.flush()
+
+            request = self.factory.get(self.path)
+            self.view(request, **self.request_kwargs)
+
+        stale_since_key = refresh.call_args[1]['stale_since_key']
+        self.assertIsNotNone(django_cache.get(stale_since_key))
+
+        from ..tasks import refresh_cached_response
+        refresh_cached_response('/no-such-path/', '', {}, stale_since_key=stale_since_key)
+        self.assertIsNone(django_cache.get(stale_since_key))
+
+    @mock.patch('sa_api_v2.tasks.warm_cached_responses.delay')
+    def test_change_warms_popular_responses(self, warm):
+        with self.settings(API_CACHE_WARM_COUNT=5):
+            request = self.factory.get(self.path)
+            self.view(request, **self.request_kwargs)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.place.data = json.dumps({'type': 'ATM', 'name': 'Target'})
+                self.place.save()
+                cache_buffer.flush()
+            warm.assert_called_with(self.owner.username, self.dataset.slug)
+
+            # Warming replays the popular request, so the next reader finds
+            # the current response already cached.
+            from ..tasks import warm_cached_responses
+            self.assertEqual(warm_cached_responses(self.owner.username, self.dataset.slug), 1)
+
+            request = self.factory.get(self.path)
+            with self.assertNumQueries(0):
+                response = self.view(request, **self.request_kwargs)
+            self.assertIn(b'Target', response.rendered_content)
+
+    def test_popular_requests_are_recorded_and_replayed_without_credentials(self):
+        from ..cache import DataSetCache
+        from ..tasks import warm_cached_responses
+
+        # Anonymous readers may read the places and their comments, but not
+        # their likes. Readers with a key may read everything.
+        ds_perm = self.dataset.permissions.all()[0]
+        ds_perm.submission_set = 'places'
+        ds_perm.save()
+        self.dataset.permissions.add_permission('comments', False, True, False, False)
+
+        request = self.factory.get(self.path, HTTP_ACCEPT='application/json', HTTP_COOKIE='sessionid=abc')
+        request.META[KEY_HEADER] = self.apikey.key
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+        data = json.loads(response.rendered_content)
+        self.assertIn('likes', data['features'][0]['properties']['submission_sets'])
+        cache_buffer.flush()
+
+        hot_requests = DataSetCache().get_hot_requests(5, **self.request_kwargs)
+        self.assertEqual(len(hot_requests), 1)
+        path, querystring, headers = json.loads(hot_requests[0])
+        self.assertEqual(dict(headers), {'HTTP_ACCEPT': 'application/json'})
+
+        # The replayed request is made anonymously, so the response that it
+        # caches only has what anonymous readers may see.
+        self.place.data = json.dumps({'type': 'ATM', 'name': 'Target'})
+        self.place.save()
+        cache_buffer.flush()
+
+        self.assertEqual(warm_cached_responses(self.owner.username, self.dataset.slug), 1)
+
+        request = self.factory.get(self.path, HTTP_ACCEPT='application/json')
+        with self.assertNumQueries(0):
+            response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+        data = json.loads(response.rendered_content)
+        self.assertEqual(data['features'][0]['properties']['name'], 'Target')
+        submission_sets = data['features'][0]['properties']['submission_sets']
+        self.assertIn('comments', submission_sets)
+        self.assertNotIn('likes', submission_sets)
+
 
 class TestSubmissionInstanceView (APITestMixin, TestCase):
     def setUp(self):
@@ -2066,6 +2519,9 @@ class TestSubmissionInstanceView (APITestMixin, TestCase):
         # - SELECT key permissions
         # - SELECT origins
         # - SELECT origin permissions
+        # - SELECT groups (their permissions are compiled into the dataset's
+        #   auth snapshot; there are none to select here, since the dataset
+        #   has no groups)
         #
         # ---- Build the data
         #
@@ -2080,7 +2536,7 @@ class TestSubmissionInstanceView (APITestMixin, TestCase):
         # - SELECT * FROM sa_api_attachment AS a
         #    WHERE a.thing_id IN (<self.submission.id>);
         #
-        with self.assertNumQueries(8):
+        with self.assertNumQueries(9):
             response = self.view(request, **self.request_kwargs)
             self.assertStatusCode(response, 200)
 
@@ -2977,6 +3433,29 @@ class TestDataSetSubmissionListView (APITestMixin, TestCase):
                 self.submission1.set_name, self.submission1.id]),
             urls)
 
+    def test_GET_from_cache_is_kept_when_another_set_changes(self):
+        request = self.factory.get(self.path)
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+
+        # A new like does not change the list of comments.
+        Submission.objects.create(place=self.place1, set_name='likes', dataset=self.dataset, data='{"bar": 3}')
+        cache_buffer.flush()
+
+        request = self.factory.get(self.path)
+        with self.assertNumQueries(0):
+            cached_response = self.view(request, **self.request_kwargs)
+        self.assertEqual(cached_response.rendered_content, response.rendered_content)
+
+        # A new comment does.
+        Submission.objects.create(place=self.place1, set_name='comments', dataset=self.dataset, data='{"foo": 3}')
+        cache_buffer.flush()
+
+        request = self.factory.get(self.path)
+        response = self.view(request, **self.request_kwargs)
+        data = json.loads(response.rendered_content)
+        self.assertEqual(len(data['results']), 5)
+
     def test_GET_csv_response(self):
         request = self.factory.get(self.path + '?format=csv')
         response = self.view(request, **self.request_kwargs)
@@ -3614,6 +4093,26 @@ class TestDataSetListView (APITestMixin, TestCase):
             'http://testserver' + reverse('dataset-detail', args=[
                 self.owner.username, self.dataset.slug]))
 
+    def test_GET_from_cache_until_the_owners_data_changes(self):
+        request = self.factory.get(self.path)
+        response = self.view(request, **self.request_kwargs)
+        self.assertStatusCode(response, 200)
+        data = json.loads(response.rendered_content)
+        self.assertEqual(data['results'][0]['places']['length'], 1)
+
+        request = self.factory.get(self.path)
+        with self.assertNumQueries(0):
+            cached_response = self.view(request, **self.request_kwargs)
+        self.assertEqual(cached_response.rendered_content, response.rendered_content)
+
+        Place.objects.create(dataset=self.dataset, geometry='POINT(4 5)')
+        cache_buffer.flush()
+
+        request = self.factory.get(self.path)
+        response = self.view(request, **self.request_kwargs)
+        data = json.loads(response.rendered_content)
+        self.assertEqual(data['results'][0]['places']['length'], 2)
+
     def test_POST_response(self):
         dataset_data = json.dumps({
           'slug': 'newds',
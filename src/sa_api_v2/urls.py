@@ -55,6 +55,13 @@ urlpatterns = [
         views.AdminDataSetListView.as_view(),
         name='admin-dataset-list'),
 
+    re_path(r'^~/cache/stats$',
+        views.CacheStatsView.as_view(),
+        name='cache-stats'),
+    re_path(r'^~/cache/metrics$',
+        views.CacheMetricsView.as_view(),
+        name='cache-metrics'),
+
     re_path(r'^(?P<owner_username>[^/]+)/datasets/(?P<dataset_slug>[^/]+)/keys$',
         views.ApiKeyListView.as_view(),
         name='apikey-list'),
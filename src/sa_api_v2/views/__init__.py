@@ -1,2 +1,3 @@
 from .base_views import *  # noqa
 from .bulk_data_views import *  # noqa
+from .cache_stats_views import *  # noqa
@@ -1,13 +1,17 @@
 from django.conf import settings
 from django.contrib.auth import views as auth_views
+from django.core import cache as django_cache
 if settings.USE_GEODB:
     from django.contrib.gis.geos import Polygon
-from django.core import cache as django_cache
 from django.urls import reverse
-from django.db.models import Count, Q
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import CharField, Count, Q, TextField
+from django.db.models.fields.json import KeyTransform
 from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.test.client import RequestFactory
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import (views, permissions, authentication,
                             generics, exceptions, status)
@@ -29,23 +33,28 @@ from .. import parsers
 from .. import apikey
 from .. import cors
 from .. import tasks
-from ..cache import cache_buffer
+from ..cache import cache_buffer, cache_stats, cache_codec
 from ..params import (INCLUDE_INVISIBLE_PARAM, INCLUDE_PRIVATE_PARAM,
     INCLUDE_SUBMISSIONS_PARAM, NEAR_PARAM, DISTANCE_PARAM, BBOX_PARAM,
-    TEXTSEARCH_PARAM, FORMAT_PARAM, PAGE_PARAM, PAGE_SIZE_PARAM,
+    TEXTSEARCH_PARAM, ORDER_BY_PARAM, FORMAT_PARAM, PAGE_PARAM, PAGE_SIZE_PARAM,
     CALLBACK_PARAM)
-from functools import wraps
+from functools import reduce, wraps
 from itertools import count
 from collections import defaultdict
+from uuid import uuid4
 try:
     # Python 2
-    from urlparse import urlparse  # type: ignore
+    from urlparse import urlparse, parse_qsl  # type: ignore
     from urllib import urlencode
 except (ModuleNotFoundError, ImportError):
     # Python 3
-    from urllib.parse import urlencode, urlparse
+    from urllib.parse import urlencode, urlparse, parse_qsl
+import gzip
+import hashlib
+import operator
 import re
 import requests
+import time
 import ujson as json
 import logging
 
@@ -134,14 +143,17 @@ class ShareaboutsSessionAuth(authentication.BaseAuthentication):
 
 
 def is_owner(user, request):
-    username = getattr(user, 'username', None)
+    return is_owner_username(getattr(user, 'username', None), request)
+
+
+def is_owner_username(username, request):
     allowed_username = getattr(request, 'allowed_username', None)
     # XXX Watch out when mocking users in tests: bool(mock.Mock()) is True
     return (username and allowed_username == username)
 
 
 def is_apikey_auth(auth):
-    return isinstance(auth, apikey.models.ApiKey)
+    return isinstance(auth, (apikey.models.ApiKey, models.ApiKeySnapshot))
 
 
 def is_origin_auth(auth):
@@ -169,8 +181,8 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         if (request.method in permissions.SAFE_METHODS or
             is_owner(request.user, request) or request.user.is_superuser
             or (hasattr(request, 'client') and
-                hasattr(request.client, 'owner') and
-                is_owner(request.client.owner, request))):
+                hasattr(request.client, 'owner_username') and
+                is_owner_username(request.client.owner_username, request))):
             return True
         return False
 
@@ -279,11 +291,9 @@ class IsAllowedByDataPermissions(permissions.BasePermission):
         protected = (INCLUDE_INVISIBLE_PARAM in request.GET or
                      INCLUDE_PRIVATE_PARAM in request.GET)
 
-        user = getattr(request, 'user', None)
-        client = getattr(request, 'client', None)
         dataset = getattr(request, 'get_dataset', lambda: None)()
 
-        return models.check_data_permission(user, client, do_action, dataset, data_type, protected)
+        return models.check_request_data_permission(request, do_action, dataset, data_type, protected)
 
 
 ###############################################################################
@@ -438,7 +448,7 @@ class CorsEnabledMixin (object):
             response['Access-Control-Allow-Origin'] = request.META.get('HTTP_ORIGIN')
 
         # Allow AJAX requests only from trusted domains for unsafe methods.
-        elif isinstance(request.client, cors.models.Origin) or request.user.is_authenticated:
+        elif isinstance(request.client, (cors.models.Origin, models.OriginSnapshot)) or request.user.is_authenticated:
             response['Access-Control-Allow-Origin'] = request.META.get('HTTP_ORIGIN')
 
         else:
@@ -469,7 +479,7 @@ class FilteredResourceMixin (object):
         special_filters = set([FORMAT_PARAM, PAGE_PARAM, PAGE_SIZE_PARAM(),
             INCLUDE_SUBMISSIONS_PARAM, INCLUDE_PRIVATE_PARAM,
             INCLUDE_INVISIBLE_PARAM, NEAR_PARAM, DISTANCE_PARAM,
-            TEXTSEARCH_PARAM, BBOX_PARAM, CALLBACK_PARAM(self)])
+            TEXTSEARCH_PARAM, ORDER_BY_PARAM, BBOX_PARAM, CALLBACK_PARAM(self)])
 
         # Filter by full-text search
         textsearch_filter = self.request.GET.get(TEXTSEARCH_PARAM, None)
@@ -477,28 +487,98 @@ class FilteredResourceMixin (object):
             queryset = queryset.filter(data__icontains=textsearch_filter)
 
         # Then filter by attributes
-        for key, values in self.request.GET.lists():
-            if key not in special_filters:
-                # Filter quickly for indexed values
-                if self.get_dataset().indexes.filter(attr_name=key).exists():
-                    queryset = queryset.filter_by_index(key, *values)
+        attribute_filters = [(key, values) for key, values in self.request.GET.lists()
+                             if key not in special_filters]
+        order_by = self.request.GET.get(ORDER_BY_PARAM)
+        indexes = self.get_data_indexes() if (attribute_filters or order_by) else {}
+
+        for key, values in attribute_filters:
+            attr_name, _, lookup = key.rpartition('__')
+
+            # Compare the typed values of indexed attributes
+            if attr_name in indexes and lookup in self.index_lookups:
+                index = indexes[attr_name]
+                for value in values:
+                    queryset = queryset.filter_by_index_lookup(
+                        index, lookup, self.parse_index_value(index, key, value, lookup))
+
+            # Filter quickly for indexed values
+            elif key in indexes:
+                queryset = queryset.filter_by_index(key, *values)
+
+            # Filter on model fields, like the submitter
+            elif key in self.get_model_field_names(queryset.model):
+                queryset = self.filter_by_attribute(queryset, key, values)
+
+            # Filter on the data blob for other values
+            else:
+                queryset = self.filter_by_data(queryset, key, values)
 
-                # Filter slowly for other values
-                else:
-                    excluded = []
-                    for obj in queryset:
-                        if hasattr(obj, key):
-                            if getattr(obj, key) not in values:
-                                queryset = queryset.exclude(pk=obj.pk)
-                        else:
-                            # Is it in the data blob?
-                            data = json.loads(obj.data)
-                            if key not in data or data[key] not in values:
-                                excluded.append(obj.pk)
-                    queryset = queryset.exclude(pk__in=excluded)
+        # Order by an indexed attribute, descending if it starts with a "-"
+        if order_by:
+            descending = order_by.startswith('-')
+            attr_name = order_by[1:] if descending else order_by
+            if attr_name not in indexes:
+                raise QueryError(detail='You can only use "%s" with an indexed attribute, not %r' % (ORDER_BY_PARAM, attr_name))
+            queryset = queryset.order_by_index(indexes[attr_name], descending=descending)
 
         return queryset
 
+    # The comparisons that can be made with indexed attributes, as in
+    # "<attr>__<lookup>=<value>". Values for "in" are comma-separated.
+    index_lookups = ('gt', 'gte', 'lt', 'lte', 'in')
+
+    def get_data_indexes(self):
+        return {index.attr_name: index for index in self.get_dataset().indexes.all()}
+
+    def parse_index_value(self, index, key, value, lookup):
+        raw_values = value.split(',') if lookup == 'in' else [value]
+        parsed_values = [index.parse_value(raw_value) for raw_value in raw_values]
+        if None in parsed_values:
+            raise QueryError(detail='Invalid parameter for "%s": %r' % (key, value))
+        return parsed_values if lookup == 'in' else parsed_values[0]
+
+    def can_filter_data_by_containment(self, queryset):
+        return connections[queryset.db].vendor == 'postgresql'
+
+    def get_model_field_names(self, model):
+        return set(name for field in model._meta.concrete_fields
+                   for name in (field.name, field.attname))
+
+    def filter_by_attribute(self, queryset, key, values):
+        field = queryset.model._meta.get_field(key)
+
+        # Text fields compare to the query values the same way in the
+        # database as they do in Python. Other values are converted to the
+        # field's type, and any that can't be never match.
+        if not isinstance(field, (CharField, TextField)):
+            converted_values = []
+            for value in values:
+                try:
+                    converted_values.append(field.to_python(value))
+                except (ValidationError, TypeError, ValueError):
+                    pass
+            values = converted_values
+
+        return queryset.filter(**{key + '__in': values})
+
+    def filter_by_data(self, queryset, key, values):
+        if 'data' not in self.get_model_field_names(queryset.model):
+            return queryset.none()
+
+        # Check whether the blob contains the attribute with any of the query
+        # values. Only string attributes match, as they would in Python, and
+        # containment can use the blob's GIN index.
+        if self.can_filter_data_by_containment(queryset):
+            return queryset.filter(reduce(
+                operator.or_, [Q(data__contains={key: value}) for value in values]))
+
+        # Otherwise, compare the attribute's JSON value to each query value.
+        alias = 'data_attr_%s' % len(queryset.query.annotations)
+        return queryset\
+            .alias(**{alias: KeyTransform(key, 'data')})\
+            .filter(**{alias + '__in': values})
+
 
 class LocatedResourceMixin (object):
     """
@@ -575,7 +655,13 @@ class OwnedResourceMixin (ClientAuthenticationMixin, CorsEnabledMixin):
         # authentication must check against it.
         request.get_dataset = self.get_dataset
 
-        return super(OwnedResourceMixin, self).dispatch(request, *args, **kwargs)
+        response = super(OwnedResourceMixin, self).dispatch(request, *args, **kwargs)
+
+        # Apply any cache invalidation from changes made in this request.
+        if request.method.upper() not in permissions.SAFE_METHODS:
+            cache_buffer.flush()
+
+        return response
 
     def get_submitter(self):
         user = self.request.user
@@ -588,23 +674,35 @@ class OwnedResourceMixin (ClientAuthenticationMixin, CorsEnabledMixin):
                 self.owner_username_kwarg in self.kwargs
             ):
                 owner_username = self.kwargs[self.owner_username_kwarg]
-                self._owner = get_object_or_404(models.User.objects.all().prefetch_related('_groups', '_groups__permissions'), username=owner_username)
+                self._owner = self.get_object_or_missing(
+                    models.User.cache,
+                    lambda: get_object_or_404(models.User.objects.all().prefetch_related('_groups', '_groups__permissions'), username=owner_username),
+                    username=owner_username)
             else:
                 self._owner = None
         return self._owner
 
     @classmethod
     def _get_dataset_from_db(cls, owner_username, dataset_slug):
-        return get_object_or_404(
+        dataset = get_object_or_404(
             models.DataSet.objects.all()
                 .select_related('owner')
                 .prefetch_related('permissions')
                 .prefetch_related('keys')
                 .prefetch_related('keys__permissions')
                 .prefetch_related('origins')
-                .prefetch_related('origins__permissions'),
+                .prefetch_related('origins__permissions')
+                .prefetch_related('groups')
+                .prefetch_related('groups__permissions'),
             slug=dataset_slug, owner__username=owner_username)
 
+        # Authentication and permission checks only use the dataset's auth
+        # snapshot, so the related objects do not have to be cached along
+        # with it.
+        dataset.get_auth_snapshot()
+        dataset._prefetched_objects_cache = {}
+        return dataset
+
     @classmethod
     def _get_dataset_from_cache(cls, owner_username, dataset_slug):
         from ..cache import DataSetCache
@@ -634,23 +732,55 @@ class OwnedResourceMixin (ClientAuthenticationMixin, CorsEnabledMixin):
                 owner_username = self.kwargs[self.owner_username_kwarg]
                 dataset_slug = self.kwargs[self.dataset_slug_kwarg]
 
-                self._dataset = (
-                    self._get_dataset_from_cache(owner_username, dataset_slug) or
-                    self._get_dataset_from_db(owner_username, dataset_slug)
-                )
+                self._dataset = self._get_dataset_from_cache(owner_username, dataset_slug)
+                if self._dataset is None:
+                    self._dataset = self.get_object_or_missing(
+                        models.DataSet.cache,
+                        lambda: self._get_dataset_from_db(owner_username, dataset_slug),
+                        owner_username=owner_username, dataset_slug=dataset_slug)
+                    self._save_dataset_in_cache(self._dataset, owner_username, dataset_slug)
 
                 # Remember the owner in case we don't already
                 self._owner = self._dataset.owner
-
-                self._save_dataset_in_cache(self._dataset, owner_username, dataset_slug)
             else:
                 self._dataset = None
         return self._dataset
 
+    def get_object_or_missing(self, cache, lookup, **params):
+        """
+        Run the lookup for an object, unless the object was recently found
+        not to exist. If the lookup raises Http404, remember that the object
+        is missing for a little while.
+        """
+        if cache.is_missing(**params):
+            raise Http404
+
+        try:
+            return lookup()
+        except Http404:
+            cache.set_missing(**params)
+            raise
+
+    def get_serializer(self, *args, **kwargs):
+        # The URLs for each object in a list are built from cached instance
+        # parameters. Fetch them all at once, instead of one by one.
+        if kwargs.get('many') and args and isinstance(args[0], (list, tuple)):
+            self.prefetch_instance_params(args[0])
+        return super(OwnedResourceMixin, self).get_serializer(*args, **kwargs)
+
+    def prefetch_instance_params(self, objs):
+        objs_by_cache = defaultdict(list)
+        for obj in objs:
+            if hasattr(obj, 'cache'):
+                objs_by_cache[obj.cache].append(obj)
+
+        for cache, cache_objs in objs_by_cache.items():
+            cache.prefetch_instance_params(cache_objs)
+
     def is_verified_object(self, obj, ObjType=None):
         # Get the instance parameters from the cache
         ObjType = ObjType or self.queryset.model
-        params = ObjType.cache.get_cached_instance_params(obj.pk, lambda: obj)
+        params = ObjType.cache.get_instance_params(obj)
 
         # Make sure that the instance parameters match what we got in the URL.
         # We do not want to risk assuming a user owns a place, for example, just
@@ -680,7 +810,43 @@ class ProtectedOwnedResourceMixin (OwnedResourceMixin):
     permission_classes = (IsLoggedInOwnerOrPublicDataOnly,) + OwnedResourceMixin.permission_classes
 
 
+class CachedResponse (HttpResponse):
+    """
+    A response whose content was rendered by an earlier request and served
+    from the cache. It skips DRF's content negotiation and renderers, but
+    exposes its content as rendered_content, like a DRF response does.
+    """
+    @property
+    def rendered_content(self):
+        return self.content
+
+
 class CachedResourceMixin (object):
+    # When true, responses are cached as the final encoded body for the
+    # renderer that was chosen, so a cache hit does not have to serialize or
+    # render anything. Otherwise, the response data is cached and rendered
+    # again on each hit.
+    cache_rendered_content = True
+
+    # When true, a cache miss is rebuilt by only one worker at a time, and
+    # concurrent requests for the same content wait for that worker's result
+    # (for at most API_CACHE_LOCK_WAIT seconds) instead of all rebuilding it.
+    cache_single_flight = True
+    cache_lock_poll_interval = 0.05
+
+    # How many seconds an out-of-date response may be served for after the
+    # data that it depends on has changed. While it is served, the current
+    # response is rebuilt by a background task. Zero means that responses
+    # are always current. API_CACHE_MAX_STALENESS can override this per
+    # view class.
+    cache_max_staleness = 0
+
+    # Query parameters that do not change the response, and so are left out
+    # of the cache key. The "_" parameter is jQuery's cache buster. Every
+    # other parameter stays in the key, since filtered views treat any
+    # parameter they do not otherwise read as a filter on the data.
+    cache_ignored_params = ('_',)
+
     @property
     def cache_prefix(self):
         return self.request.path
@@ -688,57 +854,296 @@ class CachedResourceMixin (object):
     def get_cache_prefix(self):
         return self.cache_prefix
 
-    def get_cache_metakey(self):
-        prefix = self.cache_prefix
-        return prefix + '_keys'
+    def get_cache_generation_params(self):
+        return {
+            'owner_username': self.kwargs.get('owner_username'),
+            'dataset_slug': self.kwargs.get('dataset_slug'),
+            'place_id': self.kwargs.get('place_id'),
+        }
+
+    def get_cache_generation_keys(self):
+        """
+        Get the keys of the generation counters that this view's responses
+        depend on. By default, a response depends on the dataset's
+        configuration, and on either the place named in the URL or, if there
+        is none, all of the data in the dataset. Views whose responses depend
+        on some other scope should override.
+        """
+        from ..cache import DataSetCache, PlaceCache
+        params = self.get_cache_generation_params()
+        keys = [DataSetCache().get_config_generation_key(**params)]
+
+        if params['place_id'] is not None:
+            keys.append(PlaceCache().get_place_generation_key(**params))
+        else:
+            keys.append(DataSetCache().get_data_generation_key(**params))
+
+        return keys
 
     @csrf_exempt
     def dispatch(self, request, *args, **kwargs):
-        # Only do the cache for GET, OPTIONS, or HEAD method.
-        if request.method.upper() not in permissions.SAFE_METHODS:
+        # Only do the cache for GET or HEAD method. OPTIONS responses
+        # describe the view rather than the resource, so they would not be
+        # safe to share a cache entry with GET.
+        if request.method.upper() not in ('GET', 'HEAD'):
             return super(CachedResourceMixin, self).dispatch(request, *args, **kwargs)
 
         self.request = request
+        self.kwargs = kwargs
 
-        # Check whether the response data is in the cache.
+        # Check whether the response data is in the cache. The key includes
+        # the current generations of the data that the response depends on,
+        # so anything cached before the last change is never found.
         key = self.get_cache_key(request, *args, **kwargs)
-        response_data = django_cache.cache.get(key) or None
-
-        # Also check whether the request cache key is managed in the cache.
-        # This is important, because if it's not managed, then we'll never
-        # know when to invalidate it. If it's not managed we should just
-        # assume that it's invalid.
-        metakey = self.get_cache_metakey()
-        keyset = django_cache.cache.get(metakey) or set()
+        response_data = cache_buffer.get(key) or None
+        cache_status = 'hits'
+
+        # If the data has changed, we may be allowed to keep serving the
+        # previous response for a while, and rebuild it in the background.
+        # A background refresh itself always has to rebuild.
+        if response_data is None and not getattr(request, 'is_cache_refresh', False):
+            response_data = self.get_stale_response_data(request, key)
+            if response_data is not None:
+                cache_status = 'stale'
+
+        # On a miss, make sure that only one worker at a time rebuilds the
+        # response. Any others wait for it to show up in the cache.
+        lock_token = None
+        if response_data is None and self.cache_single_flight:
+            lock_token = self.acquire_cache_lock(key)
+            if lock_token is None:
+                response_data = self.wait_for_cached_response(key)
 
-        if (response_data is not None) and (key in keyset):
-            cached_response = self.respond_from_cache(response_data)
-            handler_name = request.method.lower()
+        try:
+            if response_data is not None:
+                cached_response = self.respond_from_cache(response_data)
+                handler_name = request.method.lower()
 
-            def cached_handler(*args, **kwargs):
-                return cached_response
+                def cached_handler(*args, **kwargs):
+                    return cached_response
 
-            # Patch the HTTP method
-            with patch.object(self, handler_name, new=cached_handler):
+                # Patch the HTTP method
+                with patch.object(self, handler_name, new=cached_handler):
+                    response = super(CachedResourceMixin, self).dispatch(request, *args, **kwargs)
+            else:
+                cache_status = 'misses'
+                rebuild_start = time.monotonic()
                 response = super(CachedResourceMixin, self).dispatch(request, *args, **kwargs)
-        else:
-            response = super(CachedResourceMixin, self).dispatch(request, *args, **kwargs)
 
-            # Only cache on OK resposne
-            if response.status_code == 200:
-                self.cache_response(key, response)
+                # Only cache on OK resposne
+                if response.status_code == 200:
+                    self.cache_response(key, response)
+                    if self.get_cache_max_staleness() > 0:
+                        self.set_latest_cache_key(request, key)
 
-        # Save all the buffered data to the cache
-        cache_buffer.flush()
+                    cache_stats.observe(self.get_cache_stats_scopes(), 'rebuild_seconds',
+                                        time.monotonic() - rebuild_start)
+
+            cache_stats.count(self.get_cache_stats_scopes(), cache_status)
+
+            if settings.API_CACHE_WARM_COUNT > 0 and response.status_code == 200:
+                self.record_cache_request(request)
+
+            # Save all the buffered data to the cache
+            cache_buffer.flush()
+        finally:
+            if lock_token is not None:
+                self.release_cache_lock(key, lock_token)
 
         # Disable client-side caching. Cause IE wrongly assumes that it should
-        # cache.
+        # cache. Clients are still able to revalidate with the ETag header.
         response['Cache-Control'] = 'no-cache'
-        return response
+        return self.respond_conditionally(request, response)
+
+    def get_cache_stats_scopes(self):
+        """
+        Get the scopes to record cache statistics for this view's responses
+        under: the view class and, if there is one, the dataset.
+        """
+        scopes = [('views', type(self).__name__)]
+        params = self.get_cache_generation_params()
+        if params['dataset_slug']:
+            scopes.append(('datasets', '%s/%s' % (params['owner_username'], params['dataset_slug'])))
+        return scopes
+
+    def get_cache_max_staleness(self):
+        return settings.API_CACHE_MAX_STALENESS.get(
+            type(self).__name__, self.cache_max_staleness)
+
+    def can_serve_stale(self, request):
+        """
+        Check whether an out-of-date response may be served for the request.
+        Only responses that are shared by all anonymous users are, since the
+        background refresh rebuilds them without a logged in user.
+        """
+        if self.get_cache_max_staleness() <= 0:
+            return False
+        return not (hasattr(request, 'user') and request.user.is_authenticated)
+
+    def get_latest_cache_key_key(self, request):
+        return self.get_cache_base_key(request) + ':latest'
+
+    def set_latest_cache_key(self, request, key):
+        """
+        Remember the key of the most recently cached response for the request,
+        regardless of the generation of the data that it was built from.
+        """
+        cache_buffer.set(self.get_latest_cache_key_key(request), key, settings.API_CACHE_TIMEOUT)
+
+    def get_stale_response_data(self, request, key):
+        """
+        Get the most recently cached response for the request, if it was built
+        from data that has changed since and may still be served anyway. The
+        first request to find the response out of date schedules a rebuild,
+        and the response may be served for at most the view's maximum
+        staleness after that. If the rebuild has not finished by then, the
+        response is rebuilt as usual. Return None if there is no response to
+        use.
+        """
+        if not self.can_serve_stale(request):
+            return None
+
+        latest_key = cache_buffer.get(self.get_latest_cache_key_key(request))
+        if latest_key is None or latest_key == key:
+            return None
+
+        # Schedule one rebuild for each new generation of the data. If the
+        # rebuild fails, another is scheduled once the note expires.
+        stale_since_key = latest_key + ':stale-since'
+        if django_cache.cache.add(key + ':refresh', True, settings.API_CACHE_LOCK_TIMEOUT):
+            self.schedule_cache_refresh(request, stale_since_key)
+
+        # Note when the cached response first went out of date. The note lives
+        # as long as the response itself, so neither further changes nor a
+        # failed rebuild start a new window. Past the window, the response is
+        # rebuilt right away.
+        now = time.time()
+        if not django_cache.cache.add(stale_since_key, now, settings.API_CACHE_TIMEOUT):
+            stale_since = django_cache.cache.get(stale_since_key)
+            if stale_since is None or now - stale_since > self.get_cache_max_staleness():
+                return None
+
+        return cache_buffer.get(latest_key)
+
+    def get_cache_replay_headers(self, request):
+        """
+        Get the request headers that a background task needs in order to
+        rebuild the same response for the request. Only the headers that
+        choose the format of the response are kept; credentials such as keys
+        and cookies are never stored or replayed. Replayed requests are made
+        anonymously, since their responses are cached under the key that
+        anonymous requests use.
+        """
+        return dict(
+            (header, request.META[header])
+            for header in tasks.REPLAYED_HEADERS
+            if header in request.META)
+
+    def schedule_cache_refresh(self, request, stale_since_key=None):
+        tasks.refresh_cached_response.delay(
+            request.path_info, request.META.get('QUERY_STRING', ''),
+            self.get_cache_replay_headers(request),
+            stale_since_key=stale_since_key)
+
+    def record_cache_request(self, request):
+        """
+        Count the request towards the popularity of the dataset's responses,
+        so that the most popular ones can be rebuilt as soon as the dataset
+        changes. Only requests that can be replayed without a logged in user
+        are counted.
+        """
+        from ..cache import DataSetCache
+        params = self.get_cache_generation_params()
+        if not params['dataset_slug'] or getattr(request, 'is_cache_refresh', False):
+            return
+        if hasattr(request, 'user') and request.user.is_authenticated:
+            return
+
+        request_info = json.dumps([
+            request.path_info,
+            request.META.get('QUERY_STRING', ''),
+            sorted(self.get_cache_replay_headers(request).items()),
+        ])
+        DataSetCache().record_request(request_info, **params)
+
+    def get_cache_lock_key(self, key):
+        return key + ':lock'
+
+    def acquire_cache_lock(self, key):
+        """
+        Try to take the lock for rebuilding the response cached under the
+        given key. Return a token for releasing the lock if we got it, or None
+        if some other worker holds it. The lock expires on its own, in case
+        its holder never releases it.
+        """
+        token = uuid4().hex
+        lock_key = self.get_cache_lock_key(key)
+        if django_cache.cache.add(lock_key, token, settings.API_CACHE_LOCK_TIMEOUT):
+            return token
+        return None
+
+    def release_cache_lock(self, key, token):
+        lock_key = self.get_cache_lock_key(key)
+        if django_cache.cache.get(lock_key) == token:
+            django_cache.cache.delete(lock_key)
+
+    def wait_for_cached_response(self, key):
+        """
+        Wait a short while for another worker to cache the response under the
+        given key. Stop waiting as soon as the response shows up, or the other
+        worker gives up its lock without caching anything (e.g., because the
+        response was not cacheable). Return None if there is no response to
+        use, in which case we should just build it ourselves.
+        """
+        lock_key = self.get_cache_lock_key(key)
+        deadline = time.monotonic() + settings.API_CACHE_LOCK_WAIT
+
+        while time.monotonic() < deadline:
+            time.sleep(self.cache_lock_poll_interval)
+            values = django_cache.cache.get_many([key, lock_key])
+            if values.get(key) is not None:
+                return cache_codec.decode(values[key])
+            if lock_key not in values:
+                break
+
+        return None
+
+    def respond_conditionally(self, request, response):
+        """
+        Respond with a 304 if the request's If-None-Match header says that the
+        client already has the current content.
+        """
+        etag = response.get('ETag')
+        if response.status_code != 200 or not etag:
+            return response
+
+        conditional_response = get_conditional_response(
+            request, etag=etag, response=response)
+
+        if conditional_response is not response:
+            # Keep the CORS headers, so that cross-origin clients can use the
+            # response.
+            for header, value in response.items():
+                if header.startswith('Access-Control-'):
+                    conditional_response[header] = value
+
+        return conditional_response
 
     def get_cache_key(self, request, *args, **kwargs):
-        querystring = request.META.get('QUERY_STRING', '')
-        contenttype = request.META.get('HTTP_ACCEPT', '')
+        # Read all the generations at once, before anything else (such as
+        # looking up the dataset) needs one of them.
+        generations = cache_buffer.get_generations(self.get_cache_generation_keys())
+        generation = '.'.join(map(str, generations))
+
+        return ':'.join([self.get_cache_base_key(request), generation])
+
+    def get_cache_base_key(self, request):
+        """
+        Get the part of the cache key that identifies the request, regardless
+        of the generation of the data that the response is built from.
+        """
+        querystring = self.get_cache_querystring(request)
+        contenttype = self.get_cache_contenttype(request)
 
         if not hasattr(request, 'user') or not request.user.is_authenticated:
             groups = ''
@@ -751,43 +1156,185 @@ class CachedResourceMixin (object):
                 if request.user.id == dataset.owner_id:
                     groups = '__owners__'
                 else:
-                    group_set = []
-                    for group in request.user._groups.all():
-                        if group.dataset_id == dataset.id:
-                            group_set.append(group.name)
-                    groups = ','.join(group_set)
+                    groups = request.user.get_group_fingerprint(dataset.id)
             else:
                 groups = ''
 
-        # TODO: Eliminate the jQuery cache busting parameter for now. Get
-        # rid of this after the old API has been deprecated.
-        cache_buster_pattern = re.compile(r'&?_=\d+')
-        querystring = re.sub(cache_buster_pattern, '', querystring)
-
         return ':'.join([self.cache_prefix, contenttype, querystring, groups])
 
+    def get_cache_querystring(self, request):
+        """
+        Get the query string in a canonical form, so that equivalent requests
+        share a cache entry: ignored parameters are dropped, repeated
+        parameters are dropped, and the rest are sorted by name. The values of
+        a parameter that is given more than once keep their order.
+
+        Only the cache buster and the JSONP callback are ignored. Requests
+        with any other extra parameter get their own entry, even if the view
+        does not read it.
+        """
+        params = parse_qsl(request.META.get('QUERY_STRING', ''), keep_blank_values=True)
+
+        # JSONP responses are cached without their callback wrapper, so all
+        # callback names share an entry.
+        ignored_params = self.cache_ignored_params
+        renderer = self.get_cache_renderer(request)
+        if isinstance(renderer, renderers.JSONPRenderer):
+            ignored_params += (renderer.callback_parameter,)
+
+        unique_params = []
+        for param in params:
+            if param[0] not in ignored_params and param not in unique_params:
+                unique_params.append(param)
+
+        unique_params.sort(key=lambda param: param[0])
+        return urlencode(unique_params)
+
+    def get_cache_contenttype(self, request):
+        """
+        Get the media type of the renderer that content negotiation will
+        choose for the request, so that requests with different Accept
+        headers that get the same content share a cache entry. If content
+        negotiation fails, fall back to the Accept header itself.
+        """
+        renderer, media_type = self.get_cache_renderer_and_media_type(request)
+        if renderer is None:
+            return request.META.get('HTTP_ACCEPT', '')
+        return media_type
+
+    def get_cache_renderer(self, request):
+        return self.get_cache_renderer_and_media_type(request)[0]
+
+    def get_cache_renderer_and_media_type(self, request):
+        """
+        Get the renderer and media type that content negotiation will choose
+        for the request, or (None, None) if content negotiation fails. The
+        result is kept for the rest of the request.
+        """
+        request = getattr(request, '_request', request)
+        if getattr(self, '_cache_renderer_request', None) is not request:
+            try:
+                negotiator = self.get_content_negotiator()
+                format_suffix = self.kwargs.get(self.settings.FORMAT_SUFFIX_KWARG)
+                self._cache_renderer = negotiator.select_renderer(
+                    Request(request), self.get_renderers(), format_suffix)
+            except exceptions.APIException:
+                self._cache_renderer = (None, None)
+            self._cache_renderer_request = request
+        return self._cache_renderer
+
+    def get_jsonp_callback(self, request, renderer):
+        return request.GET.get(renderer.callback_parameter, renderer.default_callback)
+
     def respond_from_cache(self, cached_data):
         # Given some cached data, construct a response.
         content, status, headers = cached_data
-        response = Response(content, status=status, headers=dict(headers))
+
+        # Rendered content can be sent as is. Authentication and permission
+        # checks still run, since the handler is only patched within DRF's
+        # dispatch.
+        if isinstance(content, bytes):
+            headers = [tuple(header) for header in headers]
+            is_gzipped = ('Content-Encoding', 'gzip') in headers
+
+            # Large bodies are cached gzipped. Send them that way if the client
+            # can take it; the GZip middleware leaves them alone since they
+            # already have a Content-Encoding. Otherwise, unzip them first.
+            if is_gzipped and not self.accepts_gzip(self.request):
+                content = gzip.decompress(content)
+                headers.remove(('Content-Encoding', 'gzip'))
+                is_gzipped = False
+
+            # JSONP bodies are cached without their callback wrapper, so wrap
+            # them in this request's callback.
+            renderer = self.get_cache_renderer(self.request)
+            if isinstance(renderer, renderers.JSONPRenderer):
+                if is_gzipped:
+                    content = gzip.decompress(content)
+                    headers.remove(('Content-Encoding', 'gzip'))
+                    is_gzipped = False
+                callback = self.get_jsonp_callback(self.request, renderer)
+                content = renderer.wrap(content, callback)
+                headers = [(header, self.get_jsonp_etag(value, callback) if header == 'ETag' else value)
+                           for header, value in headers]
+
+            response = CachedResponse(content, status=status)
+            for header, value in headers:
+                response[header] = value
+
+            if is_gzipped:
+                patch_vary_headers(response, ('Accept-Encoding',))
+                etag = response.get('ETag')
+                if etag and response.has_header('Content-Encoding') and not etag.startswith('W/'):
+                    response['ETag'] = 'W/' + etag
+        else:
+            response = Response(content, status=status, headers=dict(headers))
+
         return response
 
     def cache_response(self, key, response):
-        data = response.data
-        status = response.status_code
-        headers = list(response.items())
+        if self.cache_rendered_content:
+            # The browsable API renders forms and user details specific to
+            # the request, so its output should not be shared.
+            if isinstance(getattr(response, 'accepted_renderer', None), BrowsableAPIRenderer):
+                return response
+
+            response.render()
+            content = response.content
+
+            # Cache JSONP as plain json, so that it can be wrapped in any
+            # callback. Validators are based on the json, and the ETag sent
+            # depends on the callback too.
+            renderer = response.accepted_renderer
+            if isinstance(renderer, renderers.JSONPRenderer):
+                callback = self.get_jsonp_callback(self.request, renderer)
+                content = renderer.unwrap(content, callback)
+                self.set_validators(response, content)
+                headers = list(response.items())
+                response['ETag'] = self.get_jsonp_etag(response['ETag'], callback)
+            else:
+                self.set_validators(response, content)
+                headers = list(response.items())
+        else:
+            content = response.data
+            headers = list(response.items())
 
-        # Cache enough info to recreate the response.
-        django_cache.cache.set(key, (data, status, headers), settings.API_CACHE_TIMEOUT)
+        status = response.status_code
 
-        # Also, add the key to the set of pages cached from this view.
-        meta_key = self.get_cache_metakey()
-        keys = django_cache.cache.get(meta_key) or set()
-        keys.add(key)
-        django_cache.cache.set(meta_key, keys, settings.API_CACHE_TIMEOUT)
+        # Large rendered bodies are cached gzipped, so that they take less
+        # room in the cache, and so that they can be sent to most clients
+        # without compressing them again on every hit.
+        if (isinstance(content, bytes) and
+                len(content) >= settings.API_CACHE_GZIP_MIN_SIZE and
+                not response.has_header('Content-Encoding')):
+            content = gzip.compress(content)
+            headers.append(('Content-Encoding', 'gzip'))
+
+        # Cache enough info to recreate the response. It is written along with
+        # everything else when the buffer is flushed.
+        cache_buffer.set(key, (content, status, headers), settings.API_CACHE_TIMEOUT)
+        if isinstance(content, bytes):
+            cache_stats.observe(self.get_cache_stats_scopes(), 'size_bytes', len(content))
 
         return response
 
+    def get_jsonp_etag(self, etag, callback):
+        # Responses with different callbacks are different representations.
+        callback_hash = hashlib.sha1(callback.encode('utf-8')).hexdigest()[:8]
+        return etag[:-1] + '-' + callback_hash + '"'
+
+    def accepts_gzip(self, request):
+        return bool(re.search(r'\bgzip\b', request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+    def set_validators(self, response, content):
+        """
+        Set the ETag header on a rendered response, so that it is cached
+        along with it. There is no Last-Modified header: nothing in a
+        response says when an item was last deleted from it, or when its
+        related submissions or attachments last changed.
+        """
+        response['ETag'] = '"%s"' % hashlib.sha1(content).hexdigest()
+
 
 class SerializerParamsMixin (object):
     def get_serializer_defaults(self):
@@ -955,7 +1502,11 @@ class PlaceInstanceView (CachedResourceMixin, LocatedResourceMixin, OwnedResourc
 
     def get_object(self, queryset=None):
         place_id = self.kwargs['place_id']
-        obj = self.get_object_or_404(place_id)
+        obj = self.get_object_or_missing(
+            models.Place.cache, lambda: self.get_object_or_404(place_id),
+            owner_username=self.kwargs[self.owner_username_kwarg],
+            dataset_slug=self.kwargs[self.dataset_slug_kwarg],
+            place_id=place_id)
         self.verify_object(obj)
         return obj
 
@@ -1032,6 +1583,18 @@ class PlaceListView (CachedResourceMixin, SerializerParamsMixin, LocatedResource
         Filter the place list to only return the places where the attribute is
         equal to the given value. *The attribute should be indexed.*
 
+      * `<attr>__gt=<value>`, `<attr>__gte=<value>`, `<attr>__lt=<value>`,
+        `<attr>__lte=<value>`, `<attr>__in=<value>,<value>,...`
+
+        Filter the list by comparing an indexed attribute with the given
+        value(s), according to the index's type (string, number, boolean, or
+        datetime).
+
+      * `order_by=<attr>` or `order_by=-<attr>`
+
+        Order the list by an indexed attribute, ascending or (with a leading
+        `-`) descending. Anything without the attribute comes last.
+
     POST
     ----
 
@@ -1049,12 +1612,6 @@ class PlaceListView (CachedResourceMixin, SerializerParamsMixin, LocatedResource
     renderer_classes = (renderers.GeoJSONRenderer, renderers.GeoJSONPRenderer) + OwnedResourceMixin.renderer_classes[2:]
     parser_classes = (parsers.GeoJSONParser,) + OwnedResourceMixin.parser_classes[1:]
 
-    def get_cache_metakey(self):
-        metakey_kwargs = self.kwargs.copy()
-        metakey_kwargs.pop('pk_list', None)
-        prefix = reverse('place-list', kwargs=metakey_kwargs)
-        return prefix + '_keys'
-
     def get_serializer_overrides(self):
         return {'dataset': self.get_dataset()}
 
@@ -1230,6 +1787,18 @@ class SubmissionListView (CachedResourceMixin, SerializerParamsMixin, OwnedResou
         Filter the place list to only return the places where the attribute is
         equal to the given value. *The attribute should be indexed.*
 
+      * `<attr>__gt=<value>`, `<attr>__gte=<value>`, `<attr>__lt=<value>`,
+        `<attr>__lte=<value>`, `<attr>__in=<value>,<value>,...`
+
+        Filter the list by comparing an indexed attribute with the given
+        value(s), according to the index's type (string, number, boolean, or
+        datetime).
+
+      * `order_by=<attr>` or `order_by=-<attr>`
+
+        Order the list by an indexed attribute, ascending or (with a leading
+        `-`) descending. Anything without the attribute comes last.
+
     POST
     ----
 
@@ -1247,15 +1816,14 @@ class SubmissionListView (CachedResourceMixin, SerializerParamsMixin, OwnedResou
     place_id_kwarg = 'place_id'
     submission_set_name_kwarg = 'submission_set_name'
 
-    def get_cache_metakey(self):
-        metakey_kwargs = self.kwargs.copy()
-        metakey_kwargs.pop('pk_list', None)
-        prefix = reverse('submission-list', kwargs=metakey_kwargs)
-        return prefix + '_keys'
-
     def get_place(self, dataset):
         place_id = self.kwargs[self.place_id_kwarg]
-        place = get_object_or_404(models.Place, dataset=dataset, id=place_id)
+        place = self.get_object_or_missing(
+            models.Place.cache,
+            lambda: get_object_or_404(models.Place, dataset=dataset, id=place_id),
+            owner_username=self.kwargs[self.owner_username_kwarg],
+            dataset_slug=self.kwargs[self.dataset_slug_kwarg],
+            place_id=place_id)
         return place
 
     def get_serializer_overrides(self):
@@ -1326,6 +1894,18 @@ class DataSetSubmissionListView (CachedResourceMixin, OwnedResourceMixin, Filter
         Filter the place list to only return the places where the attribute is
         equal to the given value. *The attribute should be indexed.*
 
+      * `<attr>__gt=<value>`, `<attr>__gte=<value>`, `<attr>__lt=<value>`,
+        `<attr>__lte=<value>`, `<attr>__in=<value>,<value>,...`
+
+        Filter the list by comparing an indexed attribute with the given
+        value(s), according to the index's type (string, number, boolean, or
+        datetime).
+
+      * `order_by=<attr>` or `order_by=-<attr>`
+
+        Order the list by an indexed attribute, ascending or (with a leading
+        `-`) descending. Anything without the attribute comes last.
+
     ------------------------------------------------------------
     """
 
@@ -1335,11 +1915,17 @@ class DataSetSubmissionListView (CachedResourceMixin, OwnedResourceMixin, Filter
 
     submission_set_name_kwarg = 'submission_set_name'
 
-    def get_cache_metakey(self):
-        metakey_kwargs = self.kwargs.copy()
-        metakey_kwargs.pop('pk_list', None)
-        prefix = reverse('dataset-submission-list', kwargs=metakey_kwargs)
-        return prefix + '_keys'
+    def get_cache_generation_keys(self):
+        # The list only changes with the submissions in its own set (or in
+        # any set, for "submissions"), and with the places they belong to.
+        from ..cache import DataSetCache, SubmissionCache
+        params = self.get_cache_generation_params()
+        params['submission_set_name'] = self.kwargs[self.submission_set_name_kwarg]
+        return [
+            DataSetCache().get_config_generation_key(**params),
+            DataSetCache().get_places_generation_key(**params),
+            SubmissionCache().get_submission_set_generation_key(**params),
+        ]
 
     def get_queryset(self):
         dataset = self.get_dataset()
@@ -1367,7 +1953,7 @@ class DataSetSubmissionListView (CachedResourceMixin, OwnedResourceMixin, Filter
                 'submitter___groups')
 
 
-class DataSetInstanceView (ProtectedOwnedResourceMixin, generics.RetrieveUpdateDestroyAPIView):
+class DataSetInstanceView (CachedResourceMixin, ProtectedOwnedResourceMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     GET
     ---
@@ -1432,7 +2018,7 @@ class DataSetInstanceView (ProtectedOwnedResourceMixin, generics.RetrieveUpdateD
         return response
 
 
-class DataSetMetadataView (ProtectedOwnedResourceMixin, generics.RetrieveAPIView):
+class DataSetMetadataView (CachedResourceMixin, ProtectedOwnedResourceMixin, generics.RetrieveAPIView):
     """
     GET
     ---
@@ -1467,6 +2053,12 @@ class DataSetMetadataView (ProtectedOwnedResourceMixin, generics.RetrieveAPIView
         except self.queryset.model.DoesNotExist:
             raise Http404
 
+    def get_cache_generation_keys(self):
+        # The metadata is all part of the dataset's configuration.
+        from ..cache import DataSetCache
+        params = self.get_cache_generation_params()
+        return [DataSetCache().get_config_generation_key(**params)]
+
     def get_object(self, queryset=None):
         dataset_slug = self.kwargs[self.dataset_slug_kwarg]
         owner_username = self.kwargs[self.owner_username_kwarg]
@@ -1528,7 +2120,7 @@ class DataSetListMixin (object):
         return dict(list(sets.items()))
 
 
-class DataSetListView (DataSetListMixin, SerializerParamsMixin, ProtectedOwnedResourceMixin, generics.ListCreateAPIView):
+class DataSetListView (CachedResourceMixin, DataSetListMixin, SerializerParamsMixin, ProtectedOwnedResourceMixin, generics.ListCreateAPIView):
     """
 
     GET
@@ -1575,6 +2167,11 @@ class DataSetListView (DataSetListMixin, SerializerParamsMixin, ProtectedOwnedRe
     def get_serializer_overrides(self):
         return {'owner': self.get_owner()}
 
+    def get_cache_generation_keys(self):
+        from ..cache import DataSetCache
+        params = self.get_cache_generation_params()
+        return [DataSetCache().get_owner_generation_key(**params)]
+
     def pre_save(self, obj):
         obj.owner = self.get_owner()
 
@@ -1705,8 +2302,12 @@ class AdminDataSetListView (CachedResourceMixin, DataSetListMixin, generics.List
     permission_classes = (IsLoggedInAdmin,)
     content_negotiation_class = ShareaboutsContentNegotiation
 
+    def get_cache_generation_keys(self):
+        from ..cache import DataSetCache
+        return [DataSetCache.all_datasets_generation_key]
+
 
-class AttachmentListView (OwnedResourceMixin, SerializerParamsMixin, FilteredResourceMixin, generics.ListCreateAPIView):
+class AttachmentListView (CachedResourceMixin, OwnedResourceMixin, SerializerParamsMixin, FilteredResourceMixin, generics.ListCreateAPIView):
     """
 
     GET
@@ -1730,6 +2331,14 @@ class AttachmentListView (OwnedResourceMixin, SerializerParamsMixin, FilteredRes
     thing_id_kwarg = 'thing_id'
     submission_set_name_kwarg = 'submission_set_name'
 
+    def get_cache_generation_params(self):
+        # The attachments of a place are listed under the place's id, which
+        # is its thing id.
+        params = super(AttachmentListView, self).get_cache_generation_params()
+        if params['place_id'] is None:
+            params['place_id'] = self.kwargs.get(self.thing_id_kwarg)
+        return params
+
     def get_thing(self):
         thing_id = self.kwargs[self.thing_id_kwarg]
         dataset = self.get_dataset()
@@ -1843,7 +2452,7 @@ class OriginListView (ClientAuthListView):
 # ------------------
 #
 
-class UserInstanceView (OwnedResourceMixin, generics.RetrieveAPIView):
+class UserInstanceView (CachedResourceMixin, OwnedResourceMixin, generics.RetrieveAPIView):
     queryset = models.User.objects.all()
     client_authentication_classes = ()
     always_allow_options = True
@@ -1854,6 +2463,15 @@ class UserInstanceView (OwnedResourceMixin, generics.RetrieveAPIView):
         return models.User.objects.all()\
             .prefetch_related('social_auth')
 
+    def get_cache_generation_keys(self):
+        from ..cache import GroupCache, UserCache
+        username = self.kwargs[self.owner_username_kwarg]
+        dataset_ids = UserCache.get_group_dataset_ids(
+            lambda: models.Group.objects.filter(submitters__username=username).values_list('dataset_id', flat=True),
+            username=username)
+        return [UserCache.get_user_generation_key(username=username)] + [
+            GroupCache.get_groups_generation_key(dataset_id=dataset_id) for dataset_id in dataset_ids]
+
     def get_object(self, queryset=None):
         owner_username = self.kwargs[self.owner_username_kwarg]
         owner = get_object_or_404(self.get_queryset(), username=owner_username)
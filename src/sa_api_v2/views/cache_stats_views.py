@@ -0,0 +1,110 @@
+from django.http import HttpResponse
+from rest_framework import views
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
+from rest_framework.response import Response
+from ..cache import cache_stats
+from .base_views import IsLoggedInAdmin
+import logging
+
+log = logging.getLogger('sa_api_v2.views')
+
+
+###############################################################################
+#
+# Cache Statistics Views
+# ----------------------
+#
+
+class CacheStatsView (views.APIView):
+    """
+
+    GET
+    ---
+    Get the cache statistics recorded for each view class, dataset, and cache
+    class. Statistics are only recorded while `API_CACHE_STATS` is on.
+
+    **Authentication**: Basic or session auth *(required, superuser only)*
+
+    DELETE
+    ------
+    Reset all of the cache statistics.
+
+    **Authentication**: Basic or session auth *(required, superuser only)*
+
+    ------------------------------------------------------------
+    """
+    permission_classes = (IsLoggedInAdmin,)
+    renderer_classes = (JSONRenderer, BrowsableAPIRenderer)
+
+    def get(self, request):
+        return Response(cache_stats.get_stats())
+
+    def delete(self, request):
+        log.info('Resetting cache statistics')
+        cache_stats.reset()
+        return Response(status=204)
+
+
+class CacheMetricsView (views.APIView):
+    """
+    The cache statistics, in the Prometheus text exposition format.
+    """
+    permission_classes = (IsLoggedInAdmin,)
+
+    metric_prefix = 'shareabouts_cache_'
+    scope_labels = {
+        'views': 'view',
+        'datasets': 'dataset',
+        'caches': 'cache',
+    }
+
+    def get(self, request):
+        return HttpResponse(self.render_metrics(cache_stats.get_stats()),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def render_metrics(self, stats):
+        counters = {}
+        histograms = {}
+
+        for scope_type, scope_stats in stats.items():
+            label = self.scope_labels[scope_type]
+            for name, metrics in sorted(scope_stats.items()):
+                labels = '%s="%s"' % (label, self.escape_label(name))
+                for metric, value in sorted(metrics.items()):
+                    if isinstance(value, dict):
+                        histograms.setdefault(metric, []).append((labels, value))
+                    else:
+                        counters.setdefault(metric, []).append((labels, value))
+
+        lines = []
+        for metric, samples in sorted(counters.items()):
+            metric_name = self.metric_prefix + metric + '_total'
+            lines.append('# TYPE %s counter' % metric_name)
+            for labels, value in samples:
+                lines.append('%s{%s} %s' % (metric_name, labels, self.format_value(value)))
+
+        for metric, samples in sorted(histograms.items()):
+            metric_name = self.metric_prefix + metric
+            lines.append('# TYPE %s histogram' % metric_name)
+            for labels, histogram in samples:
+                # Buckets are recorded separately, but Prometheus expects
+                # each bucket to include everything below it.
+                cumulative = 0
+                for upper_bound, value in self.sorted_buckets(histogram['buckets']):
+                    cumulative += value
+                    lines.append('%s_bucket{%s,le="%s"} %s' % (metric_name, labels, upper_bound, self.format_value(cumulative)))
+                lines.append('%s_bucket{%s,le="+Inf"} %s' % (metric_name, labels, self.format_value(histogram['count'])))
+                lines.append('%s_sum{%s} %s' % (metric_name, labels, self.format_value(histogram['sum'])))
+                lines.append('%s_count{%s} %s' % (metric_name, labels, self.format_value(histogram['count'])))
+
+        return '\n'.join(lines) + '\n'
+
+    def sorted_buckets(self, buckets):
+        return sorted(((upper_bound, value) for upper_bound, value in buckets.items()
+                       if upper_bound != '+Inf'), key=lambda bucket: float(bucket[0]))
+
+    def escape_label(self, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def format_value(self, value):
+        return ('%d' % value) if float(value).is_integer() else repr(float(value))